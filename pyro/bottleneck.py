@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Attributes the throughput loss of a sweep to profiler metrics.
+
+The metrics of all configurations (e.g. core counts) are aligned into one
+configurations x metrics matrix, and every metric is scored at once by its
+correlation with the throughput, optionally after removing the effect of
+control variables (e.g. the core count itself) by partial regression. A
+metric scores high if it grows where the throughput drops.
+
+Usage:
+>>> metrics = {}
+>>> for cores in [1, 2, 4, 8]:
+...     lockstat, perf, procstat = run_with_profilers(cores)
+...     metrics[cores] = merge_metrics(
+...         prefix_metrics('lockstat', lockstat.results()),
+...         perf_metrics(perf.results()),
+...         prefix_metrics('procstat', procstat.results()))
+...     throughput[cores] = perftest.parse_postmark_data(...)['read']
+>>> matrix = MetricMatrix(metrics, throughput)
+>>> rank_bottlenecks(matrix, topn=10)
+>>> explain(matrix, steps=3)
+"""
+
+import numpy as np
+
+
+def prefix_metrics(prefix, data):
+    """Flattens nested dicts of metrics, e.g. the results() of a Profiler or
+    perftest.parse_lockstat_data(), into {'prefix.key.subkey': value}.
+    """
+    results = {}
+    todo = [(prefix, data)]
+    while todo:
+        name, node = todo.pop()
+        for key, value in node.items():
+            child = '{}.{}'.format(name, key) if name else str(key)
+            if type(value) == dict:
+                todo.append((child, value))
+            else:
+                results[child] = float(value)
+    return results
+
+
+def perf_metrics(data, prefix='perf'):
+    """Converts PerfProfiler.results() or perftest.parse_perf_data() into
+    {'perf.<event>.<symbol>': fraction of samples}, summed over commands.
+    """
+    results = {}
+    for event, entries in data.items():
+        for percent, _, symbol in entries:
+            name = '{}.{}.{}'.format(prefix, event, symbol)
+            results[name] = results.get(name, 0.0) + percent
+    return results
+
+
+def merge_metrics(*sources):
+    """Merges several {name: value} dicts of one configuration.
+    """
+    results = {}
+    for source in sources:
+        results.update(source)
+    return results
+
+
+class MetricMatrix(object):
+    """The metrics and the throughput of the configurations of a sweep.
+
+    @ivar configs the configurations, sorted.
+    @ivar names the names of the metrics, sorted.
+    @ivar values an array of shape (configs, metrics).
+    @ivar throughput an array of shape (configs,).
+    """
+    def __init__(self, metrics, throughput, **kwargs):
+        """@param metrics {config: {metric: value}}.
+        @param throughput {config: throughput}. Only the configurations with
+        both metrics and a throughput are used.
+
+        Optional parameters:
+        @param fill the value of a metric missing in a configuration
+        (default: 0, e.g. a lock class without contention or a symbol out of
+        the top N of perf).
+        """
+        fill = kwargs.get('fill', 0.0)
+        self.configs = sorted(c for c in metrics if c in throughput)
+        names = set()
+        for config in self.configs:
+            names.update(metrics[config])
+        self.names = sorted(names)
+        ids = dict((name, i) for i, name in enumerate(self.names))
+        self.values = np.full((len(self.configs), len(self.names)),
+                              float(fill))
+        for row, config in enumerate(self.configs):
+            data = metrics[config]
+            if data:
+                cols = [ids[name] for name in data]
+                self.values[row, cols] = list(data.values())
+        self.throughput = np.array([throughput[c] for c in self.configs],
+                                   dtype=np.float64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def column(self, name):
+        return self.values[:, self.names.index(name)]
+
+    def controls(self, controls):
+        """Returns the control variables as an array (configs, controls).
+
+        @param controls a list of metric names, {config: value} dicts or
+        arrays of configs.
+        """
+        columns = []
+        for control in controls:
+            if isinstance(control, str):
+                columns.append(self.column(control))
+            elif type(control) == dict:
+                columns.append([control[c] for c in self.configs])
+            else:
+                columns.append(control)
+        return np.array(columns, dtype=np.float64).reshape(
+            (len(columns), len(self.configs))).T
+
+
+def _residualize(values, controls):
+    """Removes the least-squares fit of an intercept and the controls from
+    each column of values.
+    """
+    basis = np.column_stack([np.ones(len(values)), controls])
+    q, r = np.linalg.qr(basis)
+    # Drops the directions of linearly dependent controls.
+    q = q[:, np.abs(np.diag(r)) > 1e-10 * max(1.0, np.abs(r).max())]
+    return values - q.dot(q.T.dot(values)), q.shape[1]
+
+
+def _scale(values):
+    """Returns the largest magnitude of each column, at least 1e-300.
+    """
+    if not len(values):
+        return np.ones(values.shape[1:])
+    return np.maximum(np.abs(values).max(axis=0), 1e-300)
+
+
+def _correlate(values, target, scale, target_scale):
+    """Returns the correlations and the regression slopes of target on each
+    of the centered columns of values.
+
+    @param scale, target_scale the magnitudes of the columns and the target
+    before they were centered, below which variations are rounding errors.
+    """
+    sxx = np.einsum('ck,ck->k', values, values)
+    sxy = target.dot(values)
+    syy = target.dot(target)
+    # Columns without variation (e.g. fully explained by the controls)
+    # explain nothing.
+    varying = sxx > (1e-9 * scale) ** 2 * len(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(varying & (syy > (1e-9 * target_scale) ** 2 *
+                                len(target)),
+                     sxy / np.sqrt(sxx * syy), 0.0)
+        slope = np.where(varying, sxy / sxx, 0.0)
+    return np.clip(r, -1, 1), slope, varying
+
+
+def rank_bottlenecks(matrix, **kwargs):
+    """Ranks the metrics by how well their growth explains the loss of
+    throughput across the configurations.
+
+    @param matrix a MetricMatrix.
+
+    Optional parameters:
+    @param controls the variables whose effect is removed from the
+    throughput and all metrics first (partial correlation), see
+    MetricMatrix.controls(). E.g. [{cores: cores}] to find what explains the
+    loss beyond the growth of concurrency.
+    @param topn only returns the top N metrics (default: all).
+    @return a list of (metric, {'score', 'r', 'partial-r', 'slope', 't'})
+    sorted by score. 'r' is the correlation with the throughput, 'partial-r'
+    the one after removing the controls and score = -partial-r. 'slope' is
+    the partial regression coefficient (throughput per unit of the metric)
+    and 't' its t statistic.
+    """
+    controls = matrix.controls(kwargs.get('controls', []))
+    topn = kwargs.get('topn', 0)
+    values = matrix.values
+    target = matrix.throughput
+    scale, target_scale = _scale(values), _scale(target)
+
+    r, _, _ = _correlate(values - values.mean(axis=0),
+                         target - target.mean(), scale, target_scale)
+    residuals, rank = _residualize(values, controls)
+    target_residuals, _ = _residualize(target, controls)
+    partial, slope, varying = _correlate(residuals, target_residuals, scale,
+                                         target_scale)
+    dof = len(target) - rank - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(varying & (dof > 0),
+                     partial * np.sqrt(max(dof, 0) / (1 - partial ** 2)),
+                     0.0)
+    score = -partial
+    order = np.argsort(-score, kind='stable')
+    order = order[varying[order]]
+    if topn:
+        order = order[:topn]
+    return [(matrix.names[i], {'score': float(score[i]), 'r': float(r[i]),
+                               'partial-r': float(partial[i]),
+                               'slope': float(slope[i]), 't': float(t[i])})
+            for i in order.tolist()]
+
+
+def explain(matrix, steps=3, **kwargs):
+    """Selects the metrics that explain the throughput loss by forward
+    stepwise regression: each step adds the metric whose partial correlation
+    with the throughput, given the controls and the metrics selected before,
+    is the most negative. Redundant metrics (e.g. all fields of one lock
+    class) are thus picked only once.
+
+    @param matrix a MetricMatrix.
+    @param steps the maximal number of metrics to select.
+
+    Optional parameters:
+    @param controls see rank_bottlenecks().
+    @return a list of (metric, {'partial-r', 'r2'}), where 'r2' is the
+    fraction of the variance of the throughput explained by the controls and
+    the metrics selected so far.
+    """
+    controls = matrix.controls(kwargs.get('controls', []))
+    values = matrix.values
+    target = matrix.throughput
+    scale, target_scale = _scale(values), _scale(target)
+    total = np.sum((target - target.mean()) ** 2)
+    selected = []
+    results = []
+    for _ in range(steps):
+        residuals, rank = _residualize(
+            values, np.column_stack([controls, values[:, selected]]))
+        target_residuals, _ = _residualize(
+            target, np.column_stack([controls, values[:, selected]]))
+        # At least one degree of freedom must be left.
+        if len(target) - rank - 1 < 1:
+            break
+        partial, slope, varying = _correlate(residuals, target_residuals,
+                                             scale, target_scale)
+        partial[~varying] = 0
+        partial[selected] = 0
+        best = int(np.argmin(partial))
+        if partial[best] >= 0:
+            break
+        selected.append(best)
+        remaining = target_residuals - slope[best] * residuals[:, best]
+        r2 = 1 - np.sum(remaining ** 2) / total if total > 0 else 0.0
+        results.append((matrix.names[best],
+                        {'partial-r': float(partial[best]),
+                         'r2': float(r2)}))
+    return results
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.bottleneck
+"""
+
+from pyro import bottleneck
+import numpy as np
+import time
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+    def test_flatten(self):
+        lockstat = {'sb->s_lock': {'contentions': 10, 'waittime-total': 2.5}}
+        self.assertEqual({'lockstat.sb->s_lock.contentions': 10.0,
+                          'lockstat.sb->s_lock.waittime-total': 2.5},
+                         bottleneck.prefix_metrics('lockstat', lockstat))
+        perf = {'cycles': [(0.25, 'postmark', 'd_lookup'),
+                           (0.5, 'kworker', 'd_lookup'),
+                           (0.1, 'postmark', 'memcpy')]}
+        self.assertEqual({'perf.cycles.d_lookup': 0.75,
+                          'perf.cycles.memcpy': 0.1},
+                         bottleneck.perf_metrics(perf))
+        self.assertEqual({'a': 1, 'b': 3}, bottleneck.merge_metrics(
+            {'a': 1, 'b': 2}, {'b': 3}))
+
+    def test_matrix(self):
+        matrix = bottleneck.MetricMatrix(
+            {1: {'a': 1, 'b': 2}, 2: {'a': 3}, 4: {'c': 5}},
+            {1: 100, 2: 150, 8: 300})
+        self.assertEqual([1, 2], matrix.configs)
+        self.assertEqual(['a', 'b'], matrix.names)
+        self.assertEqual([[1, 2], [3, 0]], matrix.values.tolist())
+        self.assertEqual([100, 150], matrix.throughput.tolist())
+        self.assertEqual([[1, 1], [2, 3]], matrix.controls(
+            [{1: 1, 2: 2}, 'a']).tolist())
+
+
+class TestAttribution(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        cores = [1, 2, 4, 6, 8, 12, 16, 24, 32, 48]
+        self.cores = dict((n, n) for n in cores)
+        metrics = {}
+        throughput = {}
+        for n in cores:
+            # The wait time on one lock grows irregularly with the cores.
+            wait = n ** 2 * (1 + 0.3 * np.sin(n))
+            data = dict(('lockstat.lock{}.waittime-total'.format(i),
+                         rng.uniform(0, 100)) for i in range(3000))
+            data['lockstat.sb_lock.waittime-total'] = wait
+            data['lockstat.sb_lock.contentions'] = wait / 10
+            # Grows with the cores but does not hurt the throughput.
+            data['perf.cycles.memcpy'] = 0.01 * n
+            data['procstat.idle'] = 5.0
+            metrics[n] = data
+            throughput[n] = 1000 * n - 0.5 * wait
+        self.matrix = bottleneck.MetricMatrix(metrics, throughput)
+
+    def test_rank(self):
+        start = time.time()
+        ranking = bottleneck.rank_bottlenecks(
+            self.matrix, controls=[self.cores], topn=5)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(5, len(ranking))
+        names = [name for name, _ in ranking]
+        self.assertEqual(set(['lockstat.sb_lock.waittime-total',
+                              'lockstat.sb_lock.contentions']),
+                         set(names[:2]))
+        stats = ranking[0][1]
+        self.assertAlmostEqual(-1.0, stats['partial-r'])
+        self.assertAlmostEqual(1.0, stats['score'])
+        self.assertTrue(stats['t'] < -10)
+        slopes = dict(ranking[:2])
+        self.assertAlmostEqual(
+            -0.5, slopes['lockstat.sb_lock.waittime-total']['slope'])
+
+        # Constant metrics are not ranked.
+        ranking = bottleneck.rank_bottlenecks(self.matrix)
+        self.assertFalse('procstat.idle' in [name for name, _ in ranking])
+        self.assertEqual(len(self.matrix) - 1, len(ranking))
+
+    def test_explain(self):
+        steps = bottleneck.explain(self.matrix, steps=3,
+                                   controls=[self.cores])
+        self.assertTrue(steps[0][0].startswith('lockstat.sb_lock.'))
+        self.assertAlmostEqual(1.0, steps[0][1]['r2'])
+        # The other field of the same lock adds nothing and nothing is left
+        # to explain.
+        self.assertFalse(any(name.startswith('lockstat.sb_lock.')
+                             for name, _ in steps[1:]))
+
+        # Each step explains more of the variance.
+        steps = bottleneck.explain(self.matrix, steps=2)
+        self.assertTrue(steps[0][1]['r2'] < steps[-1][1]['r2'] <= 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Call graphs from the output of 'opreport -cl'.
+
+opreport prints one block for each symbol, separated by dashed lines:
+
+  <caller lines, indented>
+  <the symbol itself, not indented>
+  <the [self] line, indented>
+  <callee lines, indented>
+
+Symbols are interned into integer ids, and the costs are kept in NumPy arrays
+of shape (symbols, events) and (edges, events).
+"""
+
+from array import array
+import numpy as np
+
+
+class CallGraph(object):
+    """A call graph with per-event exclusive and inclusive costs.
+
+    Attributes:
+    @param events the list of event names.
+    @param symbols the list of symbol names, indexed by symbol id.
+    @param exclusive the self cost of each symbol, shape (symbols, events).
+    @param inclusive the self cost plus the cost of callees,
+    shape (symbols, events).
+    @param src, dst the caller and callee ids of each edge.
+    @param edge_counts the cost of each edge, shape (edges, events).
+    @param from_callee True if the edge is listed as a callee line in the block
+    of src, False if it is listed as a caller line in the block of dst.
+    """
+    def __init__(self, events=None):
+        self.events = list(events or [])
+        self.symbols = []
+        self.symbol_ids = {}
+        self.exclusive = np.zeros((0, len(self.events)), dtype=np.int64)
+        self.inclusive = self.exclusive
+        self.src = np.zeros(0, dtype=np.int32)
+        self.dst = np.zeros(0, dtype=np.int32)
+        self.edge_counts = np.zeros((0, len(self.events)), dtype=np.int64)
+        self.from_callee = np.zeros(0, dtype=bool)
+        self.caller_index_ = None
+        self.callee_index_ = None
+
+    def intern(self, name):
+        """Returns the id of a symbol, assigning a new one if necessary.
+        """
+        try:
+            return self.symbol_ids[name]
+        except KeyError:
+            sid = len(self.symbols)
+            self.symbol_ids[name] = sid
+            self.symbols.append(name)
+            return sid
+
+    def build(self, self_ids, self_counts, src, dst, edge_counts,
+              from_callee):
+        """Sets the costs and edges, and computes the inclusive costs.
+        """
+        nevents = len(self.events)
+        nsyms = len(self.symbols)
+        self.exclusive = np.zeros((nsyms, nevents), dtype=np.int64)
+        self_ids = np.asarray(self_ids, dtype=np.int32)
+        self_counts = np.asarray(self_counts, dtype=np.int64).reshape(
+            (len(self_ids), nevents))
+        np.add.at(self.exclusive, self_ids, self_counts)
+
+        self.src = np.asarray(src, dtype=np.int32)
+        self.dst = np.asarray(dst, dtype=np.int32)
+        self.edge_counts = np.asarray(edge_counts, dtype=np.int64).reshape(
+            (len(self.src), nevents))
+        self.from_callee = np.asarray(from_callee, dtype=bool)
+
+        self.inclusive = self.exclusive.copy()
+        np.add.at(self.inclusive, self.src[self.from_callee],
+                  self.edge_counts[self.from_callee])
+        self.caller_index_ = None
+        self.callee_index_ = None
+
+    def event_index(self, event=None):
+        """Returns the column of an event (default: the first event).
+        """
+        if event is None:
+            return 0
+        return self.events.index(event)
+
+    @staticmethod
+    def _make_index(keys, mask):
+        """Sorts the masked edges by keys for fast lookups.
+
+        @return (edge ids sorted by key, sorted keys)
+        """
+        edges = np.nonzero(mask)[0]
+        order = edges[np.argsort(keys[edges], kind='stable')]
+        return order, keys[order]
+
+    def _edges_of(self, index, sid):
+        order, keys = index
+        begin = np.searchsorted(keys, sid, side='left')
+        end = np.searchsorted(keys, sid, side='right')
+        return order[begin:end]
+
+    def _top(self, edges, peers, event, topn):
+        col = self.event_index(event)
+        totals = np.bincount(peers[edges],
+                             weights=self.edge_counts[edges, col],
+                             minlength=len(self.symbols))
+        nonzero = np.nonzero(totals)[0]
+        best = nonzero[np.argsort(-totals[nonzero], kind='stable')][:topn]
+        return [(self.symbols[i], int(totals[i])) for i in best]
+
+    def top_callers(self, symbol, event=None, topn=10):
+        """Returns the top N callers of a symbol.
+
+        @param symbol the symbol name.
+        @param event the event name (default: the first event).
+        @return [(caller, count), ...] in descending order.
+        """
+        if self.caller_index_ is None:
+            self.caller_index_ = self._make_index(self.dst, ~self.from_callee)
+        edges = self._edges_of(self.caller_index_, self.symbol_ids[symbol])
+        return self._top(edges, self.src, event, topn)
+
+    def top_callees(self, symbol, event=None, topn=10):
+        """Returns the top N callees of a symbol, by their inclusive cost
+        when called from this symbol.
+
+        @return [(callee, count), ...] in descending order.
+        """
+        if self.callee_index_ is None:
+            self.callee_index_ = self._make_index(self.src, self.from_callee)
+        edges = self._edges_of(self.callee_index_, self.symbol_ids[symbol])
+        return self._top(edges, self.dst, event, topn)
+
+    def top_symbols(self, event=None, topn=10, inclusive=False):
+        """Returns the top N symbols by exclusive or inclusive cost.
+
+        @return [(symbol, count), ...] in descending order.
+        """
+        costs = (self.inclusive if inclusive else self.exclusive)[
+            :, self.event_index(event)]
+        best = np.argsort(-costs, kind='stable')[:topn]
+        return [(self.symbols[i], int(costs[i])) for i in best]
+
+
+def parse_oprofile_callgraph(filename):
+    """Parses the output of 'opreport -cl' into a CallGraph.
+
+    The file is read line by line, and symbols, costs and edges are kept in
+    compact arrays until the whole graph is built.
+
+    @param filename the opreport output file path.
+    @return a CallGraph.
+    """
+    graph = CallGraph()
+    # Index of the first field of the symbol name.
+    symbol_col = None
+    self_ids = array('i')
+    self_counts = array('q')
+    src = array('i')
+    dst = array('i')
+    edge_counts = array('q')
+    from_callee = array('b')
+    # The caller lines of the current block, and the id of its symbol.
+    callers = []
+    owner = None
+
+    with open(filename) as fobj:
+        for line in fobj:
+            if line.startswith('Counted'):
+                graph.events.append(line.split()[1])
+                continue
+            if line.startswith('samples'):
+                # e.g. 'samples % samples % image name app name symbol name'
+                symbol_col = 2 * len(graph.events) + line.count(' name') - 1
+                continue
+            if line.startswith('---'):
+                callers = []
+                owner = None
+                continue
+            fields = line.split()
+            if symbol_col is None or len(fields) <= symbol_col \
+                    or not fields[0].isdigit():
+                continue
+            if fields[-1] == '[self]':
+                continue
+            name = ' '.join(fields[symbol_col:])
+            counts = [int(x) for x in fields[0:2 * len(graph.events):2]]
+            sid = graph.intern(name)
+            if not line[0].isspace():
+                owner = sid
+                self_ids.append(sid)
+                self_counts.extend(counts)
+                for caller, caller_counts in callers:
+                    src.append(caller)
+                    dst.append(sid)
+                    edge_counts.extend(caller_counts)
+                    from_callee.append(False)
+                callers = []
+            elif owner is None:
+                callers.append((sid, counts))
+            else:
+                src.append(owner)
+                dst.append(sid)
+                edge_counts.extend(counts)
+                from_callee.append(True)
+
+    graph.build(self_ids, self_counts, src, dst, edge_counts,
+                np.asarray(from_callee, dtype=bool))
+    return graph
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.callgraph
+"""
+
+from pyro import callgraph, synthetic
+import os
+import shutil
+import tempfile
+import unittest
+
+OPREPORT = """\
+CPU: Intel Core/i7, speed 2.4e+06 MHz (estimated)
+Counted CPU_CLK_UNHALTED events (Clock cycles) with a unit mask of 0x00 (No unit mask) count 100000
+Counted LLC_MISSES events (Last level cache misses) with a unit mask of 0x41 (No unit mask) count 6000
+samples  %        samples  %        image name               symbol name
+-------------------------------------------------------------------------------
+100      10.0000  10       10.0000  vmlinux                  sys_write
+  100    10.0000  10       10.0000  vmlinux                  sys_write [self]
+  300    30.0000  30       30.0000  vmlinux                  ext4_write
+  50      5.0000  1         1.0000  vmlinux                  _raw_spin_lock
+-------------------------------------------------------------------------------
+  250    25.0000  25       25.0000  vmlinux                  sys_write
+  50      5.0000  5         5.0000  vmlinux                  sys_pwrite
+200      20.0000  20       20.0000  vmlinux                  ext4_write
+  200    20.0000  20       20.0000  vmlinux                  ext4_write [self]
+  100    10.0000  10       10.0000  vmlinux                  _raw_spin_lock
+-------------------------------------------------------------------------------
+  40      4.0000  1         1.0000  vmlinux                  sys_write
+  100    10.0000  10       10.0000  vmlinux                  ext4_write
+150      15.0000  11       11.0000  vmlinux                  _raw_spin_lock
+  150    15.0000  11       11.0000  vmlinux                  _raw_spin_lock [self]
+-------------------------------------------------------------------------------
+5         0.5000  0         0       no-vmlinux               (no symbols)
+-------------------------------------------------------------------------------
+"""
+
+
+class TestCallGraph(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'opreport.txt')
+        with open(self.path, 'w') as fobj:
+            fobj.write(OPREPORT)
+        self.graph = callgraph.parse_oprofile_callgraph(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def cost(self, costs, symbol, event):
+        return costs[self.graph.symbol_ids[symbol],
+                     self.graph.event_index(event)]
+
+    def test_symbols(self):
+        graph = self.graph
+        self.assertEqual(['CPU_CLK_UNHALTED', 'LLC_MISSES'], graph.events)
+        self.assertEqual(set(['sys_write', 'ext4_write', '_raw_spin_lock',
+                              'sys_pwrite', '(no symbols)']),
+                         set(graph.symbols))
+        self.assertEqual(len(graph.symbols), len(graph.exclusive))
+
+    def test_costs(self):
+        graph = self.graph
+        self.assertEqual(100, self.cost(graph.exclusive, 'sys_write', None))
+        self.assertEqual(450, self.cost(graph.inclusive, 'sys_write', None))
+        self.assertEqual(41, self.cost(graph.inclusive, 'sys_write',
+                                       'LLC_MISSES'))
+        self.assertEqual(300, self.cost(graph.inclusive, 'ext4_write', None))
+        self.assertEqual(150, self.cost(graph.inclusive, '_raw_spin_lock',
+                                        None))
+        self.assertEqual(0, self.cost(graph.exclusive, 'sys_pwrite', None))
+
+    def test_queries(self):
+        graph = self.graph
+        self.assertEqual([('sys_write', 250), ('sys_pwrite', 50)],
+                         graph.top_callers('ext4_write'))
+        self.assertEqual([('ext4_write', 10)],
+                         graph.top_callers('_raw_spin_lock', 'LLC_MISSES',
+                                           topn=1))
+        self.assertEqual([('ext4_write', 300), ('_raw_spin_lock', 50)],
+                         graph.top_callees('sys_write'))
+        self.assertEqual([], graph.top_callees('_raw_spin_lock'))
+        self.assertEqual([('sys_write', 450), ('ext4_write', 300)],
+                         graph.top_symbols(topn=2, inclusive=True))
+
+    def test_synthetic(self):
+        path = os.path.join(self.tmpdir, 'synthetic.txt')
+        with open(path, 'w') as fobj:
+            records = synthetic.generate_oprofile(fobj, 64 * 1024)
+        graph = callgraph.parse_oprofile_callgraph(path)
+        self.assertEqual(records, len(graph.symbols))
+        self.assertTrue((graph.inclusive >= graph.exclusive).all())
+        self.assertTrue(graph.from_callee.any())
+        self.assertTrue((~graph.from_callee).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,8 +5,16 @@
 # License: BSD License
 
 from __future__ import print_function
+import atexit
 import functools
+import numpy as np
 import os
+import signal
+import struct
+import sys
+import threading
+import time
+import traceback
 
 
 class memorized(object):
@@ -40,9 +48,10 @@ class memorized(object):
 
 
 class before(object):
-    """Run some functions before the actual execution of the decorated
-    function. A typical example, preparing the test environment before running
-    performance tests.
+    """Run a function before each execution of the decorated function. A
+    typical example, preparing the test environment before running
+    performance tests. Use a fixture for setup that is expensive or needs a
+    teardown.
     """
     def __init__(self, func, *args, **kwargs):
         self.func = func
@@ -50,12 +59,16 @@ class before(object):
         self.kwargs = kwargs
 
     def __call__(self, func):
-        self.func(self.args)
-        return func
+        @functools.wraps(func)
+        def before_func(*args, **kwargs):
+            self.func(*self.args, **self.kwargs)
+            return func(*args, **kwargs)
+        return before_func
 
 
 class after(object):
-    """After the execution, run some tests.
+    """Run a function after each execution of the decorated function, even if
+    it raises.
     """
     def __init__(self, func, *args, **kwargs):
         self.func = func
@@ -63,9 +76,333 @@ class after(object):
         self.kwargs = kwargs
 
     def __call__(self, func):
+        @functools.wraps(func)
+        def after_func(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.func(*self.args, **self.kwargs)
+        return after_func
+
+
+# From the widest to the narrowest scope.
+SCOPES = ['session', 'module', 'benchmark']
+
+
+class fixture(object):
+    """Declares a setup shared by benchmarks, similar to pytest fixtures.
+
+    The function either returns the value of the fixture, or yields it once
+    and tears it down after the yield. A fixture is set up once per scope:
+     - 'session': once until FixtureManager.teardown() (at exit at the
+       latest).
+     - 'module': once for the benchmarks of each Python module.
+     - 'benchmark': once for all iterations of one benchmark run.
+
+    Usage:
+    >>> @fixture(scope='session')
+    >>> def disk():
+    >>>     osutil.mount('/dev/sdb', '/mnt/test', format='ext4')
+    >>>     yield '/mnt/test'
+    >>>     osutil.umount('/mnt/test')
+    >>>
+    >>> @benchmark(times=3, fixtures=[disk])
+    >>> def create_files(disk):
+    >>>     # The value of the fixture is passed as a keyword argument.
+
+    Optional parameters:
+    @param scope 'session', 'module' or 'benchmark' (default).
+    @param requires the fixtures that this fixture depends on. Their values
+    are passed to the function as keyword arguments. They must not have a
+    narrower scope.
+    @param name the name of the keyword argument (default: the function
+    name).
+    """
+    def __init__(self, **kwargs):
+        self.scope = kwargs.get('scope', 'benchmark')
+        if self.scope not in SCOPES:
+            raise ValueError('Unknown scope: {}'.format(self.scope))
+        self.requires = list(kwargs.get('requires', []))
+        for dep in self.requires:
+            if SCOPES.index(dep.scope) > SCOPES.index(self.scope):
+                raise ValueError(
+                    'A {} fixture can not require the {} fixture {}'.format(
+                        self.scope, dep.scope, dep.name))
+        self.name = kwargs.get('name', '')
+        self.func = None
+
+    def __call__(self, func):
+        self.func = func
+        if not self.name:
+            self.name = func.__name__
+        return self
+
+    def __repr__(self):
+        return '<fixture {} ({})>'.format(self.name, self.scope)
+
+
+class FixtureManager(object):
+    """Caches the values of fixtures in their scopes and tears them down in
+    the reverse order of their setup.
+    """
+    def __init__(self):
+        # [(fixture, scope key, value, generator)], in the order of setup.
+        self.active_ = []
+        self.lock_ = threading.RLock()
+        # Accumulated seconds of setup and teardown: {fixture name: seconds}.
+        self.setup_time = {}
+        self.teardown_time = {}
+
+    @staticmethod
+    def _scope_key(fix, module, run):
+        if fix.scope == 'session':
+            return None
+        if fix.scope == 'module':
+            return module
+        return run
+
+    def _find(self, fix, key):
+        for entry in self.active_:
+            if entry[0] is fix and entry[1] == key:
+                return entry
+        return None
+
+    def setup(self, fix, module='', run=None):
+        """Returns the value of the fixture in the scope, setting it up if it
+        is not cached.
+
+        @param module the module of the benchmark.
+        @param run an identifier of the benchmark run.
+        @return (value, the seconds spent in setting it and its dependencies
+        up by this call).
+        """
+        with self.lock_:
+            key = self._scope_key(fix, module, run)
+            entry = self._find(fix, key)
+            if entry:
+                return entry[2], 0.0
+            start = time.time()
+            kwargs = {}
+            for dep in fix.requires:
+                kwargs[dep.name] = self.setup(dep, module, run)[0]
+            dep_done = time.time()
+            result = fix.func(**kwargs)
+            generator = None
+            if hasattr(result, 'send') and hasattr(result, 'throw'):
+                generator = result
+                try:
+                    result = next(generator)
+                except StopIteration:
+                    raise RuntimeError(
+                        'Fixture {} did not yield a value'.format(fix.name))
+            end = time.time()
+            self.setup_time[fix.name] = \
+                self.setup_time.get(fix.name, 0.0) + end - dep_done
+            self.active_.append((fix, key, result, generator))
+            return result, end - start
+
+    def teardown(self, scope=None, module=None, run=None):
+        """Tears down the cached fixtures, the latest first. All of them are
+        torn down even if some teardowns raise; the first error is raised
+        afterwards.
+
+        @param scope only tears down the fixtures of this scope.
+        @param module only tears down the module fixtures of this module.
+        @param run only tears down the benchmark fixtures of this run.
+        @return the seconds spent in teardown.
+        """
+        with self.lock_:
+            selected = []
+            for entry in self.active_:
+                fix, key = entry[:2]
+                if scope and fix.scope != scope:
+                    continue
+                if module is not None and fix.scope == 'module' and \
+                        key != module:
+                    continue
+                if run is not None and fix.scope == 'benchmark' and \
+                        key is not run:
+                    continue
+                selected.append(entry)
+            self.active_ = [entry for entry in self.active_
+                            if entry not in selected]
+            errors = []
+            total = 0.0
+            for fix, _, _, generator in reversed(selected):
+                if generator is None:
+                    continue
+                start = time.time()
+                try:
+                    next(generator)
+                    errors.append(RuntimeError(
+                        'Fixture {} yielded more than once'.format(fix.name)))
+                except StopIteration:
+                    pass
+                except Exception as err:
+                    errors.append(err)
+                finally:
+                    generator.close()
+                    elapsed = time.time() - start
+                    total += elapsed
+                    self.teardown_time[fix.name] = \
+                        self.teardown_time.get(fix.name, 0.0) + elapsed
+            if errors:
+                raise errors[0]
+            return total
+
+
+# The fixture manager used by benchmarks by default.
+FIXTURES = FixtureManager()
+atexit.register(FIXTURES.teardown)
+
+
+class BenchmarkError(RuntimeError):
+    """Some isolated iterations of a benchmark failed or timed out.
+
+    @ivar iterations the resources of all iterations, see run_isolated().
+    """
+    def __init__(self, message, iterations):
+        super(BenchmarkError, self).__init__(message)
+        self.iterations = iterations
+
+
+# Seconds between two polls of the running iterations.
+POLL_INTERVAL = 0.005
+
+
+def _child(func, args, kwargs, wfd):
+    """Runs one iteration in a forked child and reports its wall time through
+    the pipe. Never returns.
+    """
+    status = 1
+    try:
+        start = time.time()
+        func(*args, **kwargs)
+        os.write(wfd, struct.pack('d', time.time() - start))
+        status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Skips atexit handlers, e.g. the teardown of the parent's fixtures.
+        os._exit(status)
+
+
+def _iteration_stats(status, rusage, wall_time, timeout):
+    if os.WIFSIGNALED(status):
+        code = -os.WTERMSIG(status)
+    else:
+        code = os.WEXITSTATUS(status)
+    return {'status': code, 'timeout': timeout, 'wall-time': wall_time,
+            'user-time': rusage.ru_utime, 'sys-time': rusage.ru_stime,
+            # ru_maxrss is in kilobytes on Linux.
+            'max-rss': rusage.ru_maxrss * 1024,
+            'minor-faults': rusage.ru_minflt,
+            'major-faults': rusage.ru_majflt,
+            'voluntary-switches': rusage.ru_nvcsw,
+            'involuntary-switches': rusage.ru_nivcsw,
+            'block-in': rusage.ru_inblock, 'block-out': rusage.ru_oublock}
+
+
+def _kill_group(pid):
+    """Kills the process group led by an iteration.
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
         pass
 
 
+def run_isolated(func, times=1, args=(), kwargs=None, **options):
+    """Runs each iteration of func in a forked child process and collects
+    its resources with os.wait4().
+
+    The children inherit the memory of the caller, e.g. the values of the
+    fixtures, and nothing they change is seen by the caller or the other
+    iterations. Each child leads its own process group, so that the
+    processes it spawns are killed with it.
+
+    @param func the function of one iteration.
+    @param times the number of iterations.
+    @param args, kwargs the arguments of func.
+
+    Optional parameters:
+    @param timeout kills the process group of an iteration with SIGKILL
+    after this many seconds (default: 0, no timeout).
+    @param workers the number of iterations that run in parallel (default:
+    1).
+    @param callback called with the index and the resources of each
+    iteration when it finishes.
+    @return a list of the resources of each iteration: {'status': exit code
+    or -signal, 'timeout': bool, 'wall-time': seconds in func, or since the
+    fork if it did not finish, 'user-time', 'sys-time', 'max-rss': bytes,
+    'minor-faults', 'major-faults', 'voluntary-switches',
+    'involuntary-switches', 'block-in', 'block-out': 512-byte blocks}.
+    """
+    kwargs = kwargs or {}
+    timeout = options.get('timeout', 0)
+    workers = max(1, options.get('workers', 1))
+    callback = options.get('callback', None)
+    results = [None] * times
+    # {pid: (index, read fd of the pipe, start time)}
+    running = {}
+    pending = 0
+    try:
+        while pending < times or running:
+            while pending < times and len(running) < workers:
+                rfd, wfd = os.pipe()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    os.setpgrp()
+                    os.close(rfd)
+                    _child(func, args, kwargs, wfd)
+                # Also here, in case the child has not run yet when it is
+                # killed.
+                try:
+                    os.setpgid(pid, pid)
+                except OSError:
+                    pass
+                os.close(wfd)
+                running[pid] = (pending, rfd, time.time())
+                pending += 1
+            time.sleep(POLL_INTERVAL)
+            now = time.time()
+            for pid in list(running):
+                index, rfd, start = running[pid]
+                killed = False
+                done, status, rusage = os.wait4(pid, os.WNOHANG)
+                if done == 0:
+                    if not timeout or now - start < timeout:
+                        continue
+                    _kill_group(pid)
+                    done, status, rusage = os.wait4(pid, 0)
+                    killed = True
+                del running[pid]
+                data = os.read(rfd, 8)
+                os.close(rfd)
+                if len(data) == 8:
+                    wall_time = struct.unpack('d', data)[0]
+                else:
+                    wall_time = time.time() - start
+                results[index] = _iteration_stats(status, rusage, wall_time,
+                                                  killed)
+                if callback:
+                    callback(index, results[index])
+    finally:
+        # Only on errors of the caller, e.g. KeyboardInterrupt.
+        for pid, (_, rfd, _) in running.items():
+            _kill_group(pid)
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            os.close(rfd)
+    return results
+
+
 class benchmark(object):
     """Run a function as benchmark for several times.
 
@@ -75,28 +412,313 @@ class benchmark(object):
         >>> # do awesome benchmarks.
 
     @param times How many times should this benchmark run. Optional.
-    @param timeout Set the timeout in seconds.
+    @param timeout Set the timeout in seconds of each iteration. It is only
+    enforced for isolated iterations and is ignored without 'isolate', since
+    an iteration in this process can not be killed.
     @param silence If true, it do not generate output.
+    @param isolate If true, runs each iteration in a forked child process,
+    see run_isolated(). The resources of each iteration are kept in
+    'iterations', and BenchmarkError is raised if any iteration fails or
+    times out. Optional.
+    @param workers the number of isolated iterations that run in parallel.
+    Optional.
+    @param metrics a metrics.MetricsServer to export the duration of each
+    iteration as 'pyro_benchmark_iteration_seconds'. Optional.
+    @param fixtures a list of fixtures, whose values are passed to the
+    function as keyword arguments. Their setup and teardown are not measured,
+    see 'setup_time' and 'teardown_time' of the last run. Optional.
+    @param manager the FixtureManager that caches the fixtures (default:
+    FIXTURES). Optional.
     """
     def __init__(self, **kwargs):
         self.times = kwargs.get('times', 1)
         # Timeout in seconds
         self.timeout = kwargs.get('timeout', 0)
         self.silence = kwargs.get('silence', False)
+        self.metrics = kwargs.get('metrics', None)
+        self.isolate = kwargs.get('isolate', False)
+        self.workers = kwargs.get('workers', 1)
+        self.iterations = []
+        self.fixtures = list(kwargs.get('fixtures', []))
+        self.manager = kwargs.get('manager', FIXTURES)
+        self.setup_time = 0.0
+        self.teardown_time = 0.0
 
     def __call__(self, func):
         def benchmark_func(*args):
-            times_start = os.times()
-            for _ in range(self.times):
-                func(*args)
-            times_end = os.times()
-            user_time = times_end[0] - times_start[0]
-            sys_time = times_end[1] - times_start[1]
+            labels = {'benchmark': func.__name__}
+            # Identifies the benchmark fixtures of this run.
+            run = object()
+            self.setup_time = 0.0
+            self.teardown_time = 0.0
+            error = None
+            try:
+                values = {}
+                for fix in self.fixtures:
+                    values[fix.name], seconds = self.manager.setup(
+                        fix, func.__module__, run)
+                    self.setup_time += seconds
+                times_start = os.times()
+                if self.isolate:
+                    self._run_isolated(func, args, values, labels)
+                else:
+                    for _ in range(self.times):
+                        start = time.time()
+                        func(*args, **values)
+                        self._observe(time.time() - start, labels)
+                times_end = os.times()
+            except BaseException as err:
+                error = err
+                raise
+            finally:
+                teardown_start = time.time()
+                try:
+                    self.manager.teardown('benchmark', run=run)
+                except Exception:
+                    if error is None:
+                        raise
+                    # Keeps the error of the benchmark itself.
+                    sys.stderr.write('Fixture teardown failed after {} '
+                                     'failed:\n'.format(func.__name__))
+                    traceback.print_exc()
+                finally:
+                    self.teardown_time = time.time() - teardown_start
+            # Includes the reaped children, e.g. the isolated iterations.
+            user_time = times_end[0] - times_start[0] + \
+                times_end[2] - times_start[2]
+            sys_time = times_end[1] - times_start[1] + \
+                times_end[3] - times_start[3]
             if not self.silence:
-                print("Run benchmark %s for %d times.",
-                      func.__name__, self.times)
-                print("Total: user time: %fs system time: %fs.",
-                      user_time, sys_time)
-                print("Average: user time: %fs system time %fs.",
-                      user_time / self.times, sys_time / self.times)
+                print("Run benchmark {} for {} times.".format(
+                      func.__name__, self.times))
+                print("Total: user time: {:f}s system time: {:f}s.".format(
+                      user_time, sys_time))
+                print("Average: user time: {:f}s system time {:f}s.".format(
+                      user_time / self.times, sys_time / self.times))
+                if self.fixtures:
+                    print("Fixtures: setup: {:f}s teardown: {:f}s.".format(
+                          self.setup_time, self.teardown_time))
+                if self.isolate:
+                    print("Max RSS: {} KB.".format(max(
+                        it['max-rss'] for it in self.iterations) // 1024))
+        benchmark_func.benchmark = self
         return benchmark_func
+
+    def _observe(self, seconds, labels):
+        if self.metrics:
+            self.metrics.observe('pyro_benchmark_iteration_seconds',
+                                 seconds, labels,
+                                 'Wall time of benchmark iterations.')
+
+    def _run_isolated(self, func, args, kwargs, labels):
+        def _finished(_, stats):
+            if not stats['status']:
+                self._observe(stats['wall-time'], labels)
+
+        self.iterations = run_isolated(
+            func, self.times, args, kwargs, timeout=self.timeout,
+            workers=self.workers, callback=_finished)
+        failed = [i for i, stats in enumerate(self.iterations)
+                  if stats['status']]
+        if failed:
+            timeouts = len([i for i in failed
+                            if self.iterations[i]['timeout']])
+            raise BenchmarkError(
+                'Benchmark {}: {} of {} iterations failed ({} timed out)'
+                .format(func.__name__, len(failed), self.times, timeouts),
+                self.iterations)
+
+
+class LatencyHistogram(object):
+    """A log-bucketed (HDR-style) histogram of durations in nanoseconds.
+
+    Each power-of-2 range of durations is split into 2 ** (sub_bits - 1)
+    linear buckets, so the relative error of a recorded value is below
+    2 ** (1 - sub_bits). The counts are kept in a preallocated list, which
+    is faster to increment from Python than an array.array or a NumPy array,
+    and histograms with the same sub_bits can be merged, e.g. across threads
+    or processes (they are picklable).
+    """
+    SUB_BITS = 7
+    # Durations above 2 ** MAX_BITS ns (about 4.9 hours) are clamped.
+    MAX_BITS = 44
+
+    def __init__(self, sub_bits=SUB_BITS):
+        self.sub_bits = sub_bits
+        self.size = (self.MAX_BITS - sub_bits + 2) << (sub_bits - 1)
+        self.counts = [0] * self.size
+
+    def bucket(self, nanoseconds):
+        """Returns the bucket index of a duration.
+        """
+        shift = nanoseconds.bit_length() - self.sub_bits
+        if shift <= 0:
+            return nanoseconds
+        return min((shift << (self.sub_bits - 1)) + (nanoseconds >> shift),
+                   self.size - 1)
+
+    def record(self, nanoseconds):
+        self.counts[self.bucket(nanoseconds)] += 1
+
+    def bucket_bounds(self):
+        """Returns the lower and upper bounds (exclusive) in nanoseconds of
+        all buckets, as two arrays.
+        """
+        half = 1 << (self.sub_bits - 1)
+        index = np.arange(self.size, dtype=np.int64)
+        shift = np.maximum(index // half - 1, 0)
+        mantissa = index - shift * half
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def to_array(self):
+        """Returns a copy of the counts as a NumPy array.
+        """
+        return np.array(self.counts, dtype=np.int64)
+
+    def merge(self, other):
+        """Adds the counts of another LatencyHistogram.
+        """
+        if other.sub_bits != self.sub_bits:
+            raise ValueError('Can not merge histograms of different '
+                             'precisions: {} and {}'.format(self.sub_bits,
+                                                           other.sub_bits))
+        # In place, as timed keeps references to the counts.
+        self.counts[:] = (self.to_array() + other.to_array()).tolist()
+        return self
+
+    def __len__(self):
+        return int(self.to_array().sum())
+
+    def percentile(self, q):
+        """Returns the q-th percentile in seconds, or NaN if it is empty.
+
+        @param q a percentile in [0, 100].
+        """
+        counts = self.to_array()
+        cumulative = np.cumsum(counts)
+        total = int(cumulative[-1])
+        if not total:
+            return float('nan')
+        rank = max(1, int(np.ceil(q / 100.0 * total)))
+        index = int(np.searchsorted(cumulative, rank))
+        low, high = self.bucket_bounds()
+        if high[index] - low[index] == 1:
+            return int(low[index]) / 1e9
+        return (int(low[index]) + int(high[index]) - 1) / 2.0 / 1e9
+
+    def summary(self):
+        """Returns {'count', 'p50', 'p99', 'p999', 'max'}, in seconds.
+        """
+        return {'count': len(self), 'p50': self.percentile(50),
+                'p99': self.percentile(99), 'p999': self.percentile(99.9),
+                'max': self.percentile(100)}
+
+
+class timed(object):
+    """Records the latency of every call of a function, or of a block with
+    'with', into per-thread LatencyHistograms.
+
+    Each thread records into its own histogram without any lock, and
+    histogram() merges them on demand.
+
+    Usage:
+    >>> parse_timer = timed('parse')
+    >>> @parse_timer
+    >>> def parse(line):
+        >>> # ...
+    >>> with parse_timer:
+        >>> # ...
+    >>> parse_timer.histogram().summary()
+    >>> @timed  # Named after the function.
+    >>> def scan(block):
+        >>> # ...
+    >>> scan.timed.histogram()
+
+    @param name the name of the timer. Optional.
+    @param sub_bits the precision of the histograms (see LatencyHistogram).
+    """
+    def __new__(cls, name='', **kwargs):
+        if callable(name):
+            # The bare @timed form, which passes the function as the name.
+            timer = super(timed, cls).__new__(cls)
+            timer.__init__(name.__name__, **kwargs)
+            return timer(name)
+        return super(timed, cls).__new__(cls)
+
+    def __init__(self, name='', **kwargs):
+        self.name = name
+        self.sub_bits = kwargs.get('sub_bits', LatencyHistogram.SUB_BITS)
+        self.histograms = []
+        self.lock_ = threading.Lock()
+        self.local_ = threading.local()
+
+    def _thread_histogram(self):
+        """Returns the histogram of the calling thread.
+        """
+        try:
+            return self.local_.histogram
+        except AttributeError:
+            hist = LatencyHistogram(self.sub_bits)
+            with self.lock_:
+                self.histograms.append(hist)
+            self.local_.histogram = hist
+            self.local_.counts = hist.counts
+            self.local_.starts = []
+            return hist
+
+    def __call__(self, func):
+        if not self.name:
+            self.name = func.__name__
+        local = self.local_
+        new_histogram = self._thread_histogram
+        sub_bits = self.sub_bits
+        half_bits = sub_bits - 1
+        last = LatencyHistogram(sub_bits).size - 1
+
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # LatencyHistogram.record(), inlined on the hot path.
+                elapsed = time.perf_counter_ns() - start
+                try:
+                    counts = local.counts
+                except AttributeError:
+                    counts = new_histogram().counts
+                shift = elapsed.bit_length() - sub_bits
+                if shift > 0:
+                    elapsed = (shift << half_bits) + (elapsed >> shift)
+                    if elapsed > last:
+                        elapsed = last
+                counts[elapsed] += 1
+        timed_func.timed = self
+        return timed_func
+
+    def __enter__(self):
+        self._thread_histogram()
+        self.local_.starts.append(time.perf_counter_ns())
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter_ns() - self.local_.starts.pop()
+        self.local_.histogram.record(elapsed)
+        return False
+
+    def histogram(self):
+        """Returns the histogram merged from all threads.
+        """
+        merged = LatencyHistogram(self.sub_bits)
+        with self.lock_:
+            histograms = list(self.histograms)
+        for hist in histograms:
+            merged.merge(hist)
+        return merged
+
+    def reset(self):
+        """Clears the histograms of all threads.
+        """
+        with self.lock_:
+            for hist in self.histograms:
+                hist.counts[:] = [0] * hist.size
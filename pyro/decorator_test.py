@@ -8,6 +8,14 @@
 """
 
 from pyro import decorator
+from unittest import mock
+import io
+import math
+import os
+import pickle
+import signal
+import subprocess
+import threading
 import time
 import unittest
 
@@ -37,5 +45,371 @@ class TestDecorators(unittest.TestCase):
         bm_func(self)
         self.assertEqual(5, self.bm_count)
 
+    def test_before_after(self):
+        calls = []
+
+        @decorator.before(calls.append, 'before')
+        @decorator.after(calls.append, 'after')
+        def func(value):
+            calls.append(value)
+            return value * 2
+
+        # Nothing runs at decoration time.
+        self.assertEqual([], calls)
+        self.assertEqual(4, func(2))
+        self.assertEqual(['before', 2, 'after'], calls)
+
+
+class TestFixtures(unittest.TestCase):
+    def setUp(self):
+        self.manager = decorator.FixtureManager()
+        self.log = []
+
+        @decorator.fixture(scope='session')
+        def disk():
+            self.log.append('mkfs')
+            time.sleep(0.05)
+            yield '/mnt/test'
+            self.log.append('umount')
+
+        @decorator.fixture(scope='module', requires=[disk])
+        def dataset(disk):
+            self.log.append('dataset')
+            return disk + '/data'
+
+        @decorator.fixture(requires=[dataset])
+        def cache(dataset):
+            self.log.append('warm')
+            yield dataset
+            self.log.append('drop')
+
+        self.disk, self.dataset, self.cache = disk, dataset, cache
+
+    def test_scopes(self):
+        seen = []
+
+        @decorator.benchmark(times=3, silence=True, manager=self.manager,
+                             fixtures=[self.disk, self.cache])
+        def bm_func(disk, cache):
+            seen.append((disk, cache))
+
+        bm_func()
+        self.assertEqual([('/mnt/test', '/mnt/test/data')] * 3, seen)
+        self.assertEqual(['mkfs', 'dataset', 'warm', 'drop'], self.log)
+        self.assertTrue(bm_func.benchmark.setup_time >= 0.05)
+
+        # The session and module fixtures are reused by the next run.
+        bm_func()
+        self.assertEqual(['mkfs', 'dataset', 'warm', 'drop', 'warm', 'drop'],
+                         self.log)
+        self.assertTrue(bm_func.benchmark.setup_time < 0.05)
+        self.assertTrue(self.manager.setup_time['disk'] >= 0.05)
+
+        # Another module sets up its own module fixtures.
+        self.manager.setup(self.dataset, module='other')
+        self.assertEqual(2, self.log.count('dataset'))
+        self.assertEqual(1, self.log.count('mkfs'))
+
+        self.manager.teardown()
+        self.assertEqual('umount', self.log[-1])
+        self.assertEqual([], self.manager.active_)
+
+    def test_teardown_on_error(self):
+        @decorator.benchmark(silence=True, manager=self.manager,
+                             fixtures=[self.cache])
+        def failing(cache):
+            raise IOError('disk full')
+
+        with self.assertRaises(IOError):
+            failing()
+        self.assertEqual('drop', self.log[-1])
+
+        @decorator.fixture(scope='session')
+        def broken():
+            yield 1
+            raise ValueError('can not umount')
+
+        self.manager.setup(broken)
+        with self.assertRaises(ValueError):
+            self.manager.teardown()
+        # The other fixtures are still torn down.
+        self.assertEqual('umount', self.log[-1])
+        self.assertEqual([], self.manager.active_)
+
+    def test_teardown_error_after_benchmark_error(self):
+        @decorator.fixture()
+        def broken():
+            yield 1
+            raise ValueError('can not umount')
+
+        @decorator.benchmark(silence=True, manager=self.manager,
+                             fixtures=[broken])
+        def failing(broken):
+            raise IOError('disk full')
+
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            with self.assertRaises(IOError):
+                failing()
+        # The teardown error is logged instead.
+        self.assertTrue('can not umount' in stderr.getvalue())
+        self.assertEqual([], self.manager.active_)
+
+        @decorator.benchmark(silence=True, manager=self.manager,
+                             fixtures=[broken])
+        def passing(broken):
+            pass
+
+        self.assertRaises(ValueError, passing)
+
+    def test_invalid_scopes(self):
+        with self.assertRaises(ValueError):
+            decorator.fixture(scope='forever')
+        with self.assertRaises(ValueError):
+            decorator.fixture(scope='session', requires=[self.cache])
+
+
+def process_running(pid):
+    """Returns True if the process exists and is not a zombie.
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as fobj:
+            return fobj.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+
+class TestIsolated(unittest.TestCase):
+    def test_isolated_iterations(self):
+        calls = []
+
+        @decorator.benchmark(times=3, silence=True, isolate=True)
+        def allocate(size):
+            calls.append(size)
+            data = bytearray(size)
+            data[::4096] = b'x' * len(data[::4096])
+
+        allocate(64 << 20)
+        # The iterations ran in children.
+        self.assertEqual([], calls)
+        iterations = allocate.benchmark.iterations
+        self.assertEqual(3, len(iterations))
+        for stats in iterations:
+            self.assertEqual(0, stats['status'])
+            self.assertFalse(stats['timeout'])
+            self.assertTrue(stats['max-rss'] >= 64 << 20)
+            self.assertTrue(stats['minor-faults'] >= (64 << 20) / 4096)
+
+    def test_timeout(self):
+        @decorator.benchmark(times=2, silence=True, isolate=True, timeout=0.2)
+        def hang():
+            time.sleep(60)
+
+        start = time.time()
+        with self.assertRaises(decorator.BenchmarkError) as context:
+            hang()
+        self.assertTrue(time.time() - start < 10)
+        iterations = context.exception.iterations
+        self.assertEqual([-signal.SIGKILL] * 2,
+                         [stats['status'] for stats in iterations])
+        self.assertTrue(all(stats['timeout'] for stats in iterations))
+        self.assertTrue(all(stats['wall-time'] >= 0.2
+                            for stats in iterations))
+
+    def test_timeout_kills_spawned_processes(self):
+        rfd, wfd = os.pipe()
+
+        def spawn():
+            pid = subprocess.Popen(['sleep', '60']).pid
+            os.write(wfd, str(pid).encode('utf-8'))
+            time.sleep(60)
+
+        try:
+            results = decorator.run_isolated(spawn, timeout=0.2)
+            os.close(wfd)
+            pid = int(os.read(rfd, 32))
+        finally:
+            os.close(rfd)
+        self.assertTrue(results[0]['timeout'])
+        for _ in range(100):
+            if not process_running(pid):
+                break
+            time.sleep(0.01)
+        self.assertFalse(process_running(pid))
+
+    def test_failure(self):
+        def fail(index):
+            if index.pop() == 1:
+                raise ValueError('bad iteration')
+
+        with mock.patch('traceback.print_exc'):
+            results = decorator.run_isolated(fail, 1, ([1],))
+        self.assertEqual(1, results[0]['status'])
+        self.assertFalse(results[0]['timeout'])
+        self.assertEqual(0, decorator.run_isolated(fail, 1, ([0],))[0][
+            'status'])
+
+    def test_parallel_workers(self):
+        finished = []
+        start = time.time()
+        results = decorator.run_isolated(
+            time.sleep, 4, (0.5,), workers=4,
+            callback=lambda index, stats: finished.append(index))
+        self.assertTrue(time.time() - start < 1.9)
+        self.assertEqual([0, 1, 2, 3], sorted(finished))
+        for stats in results:
+            self.assertAlmostEqual(0.5, stats['wall-time'], delta=0.3)
+
+    def test_fixtures_are_inherited(self):
+        manager = decorator.FixtureManager()
+        log = []
+
+        @decorator.fixture(scope='session')
+        def table():
+            log.append('setup')
+            yield {'rows': 10}
+            log.append('teardown')
+
+        @decorator.benchmark(times=2, silence=True, isolate=True,
+                             manager=manager, fixtures=[table])
+        def scan(table):
+            if table['rows'] != 10:
+                os._exit(3)
+
+        scan()
+        scan()
+        manager.teardown()
+        self.assertEqual(['setup', 'teardown'], log)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        hist = decorator.LatencyHistogram()
+        self.assertTrue(math.isnan(hist.percentile(50)))
+        for nanoseconds in range(1, 100001):
+            hist.record(nanoseconds * 1000)
+        self.assertEqual(100000, len(hist))
+        summary = hist.summary()
+        # The relative error is below 2 ** (1 - SUB_BITS).
+        for name, expected in [('p50', 0.05), ('p99', 0.099),
+                               ('p999', 0.0999), ('max', 0.1)]:
+            self.assertAlmostEqual(expected, summary[name],
+                                   delta=expected / 64)
+
+    def test_small_values_are_exact(self):
+        hist = decorator.LatencyHistogram()
+        for nanoseconds in [0, 5, 5, 100]:
+            hist.record(nanoseconds)
+        self.assertEqual(5e-9, hist.percentile(50))
+        self.assertEqual(100e-9, hist.percentile(100))
+
+    def test_bucket_bounds(self):
+        hist = decorator.LatencyHistogram(sub_bits=4)
+        low, high = hist.bucket_bounds()
+        self.assertTrue(all(low[1:] == high[:-1]))
+        for nanoseconds in [0, 7, 15, 16, 17, 1000, 123456789]:
+            index = hist.bucket(nanoseconds)
+            self.assertTrue(low[index] <= nanoseconds < high[index])
+        # Clamped at the last bucket.
+        self.assertEqual(hist.size - 1, hist.bucket(2 ** 60))
+
+    def test_merge(self):
+        first = decorator.LatencyHistogram()
+        second = decorator.LatencyHistogram()
+        first.record(1000)
+        second.record(3000)
+        # Across processes, histograms are pickled.
+        first.merge(pickle.loads(pickle.dumps(second)))
+        self.assertEqual(2, len(first))
+        self.assertAlmostEqual(3e-6, first.percentile(100), delta=3e-6 / 64)
+        self.assertRaises(ValueError, first.merge,
+                          decorator.LatencyHistogram(sub_bits=5))
+
+
+class TestTimed(unittest.TestCase):
+    # The maximal overhead of @timed on each call, in seconds, on a machine
+    # where a call through a pass-through decorator takes REFERENCE_CALL
+    # seconds. The budget scales up on slower (or busy virtual) machines.
+    OVERHEAD_BUDGET = 1e-6
+    REFERENCE_CALL = 200e-9
+
+    def test_decorator(self):
+        timer = decorator.timed()
+
+        @timer
+        def sleep_func(seconds):
+            time.sleep(seconds)
+            return seconds
+
+        self.assertEqual(0.01, sleep_func(0.01))
+        self.assertEqual('sleep_func', timer.name)
+        self.assertTrue(sleep_func.timed is timer)
+        self.assertAlmostEqual(0.01, timer.histogram().percentile(50),
+                               delta=0.01)
+
+        @timer
+        def fail_func():
+            raise KeyError()
+
+        self.assertRaises(KeyError, fail_func)
+        self.assertEqual(2, len(timer.histogram()))
+        timer.reset()
+        self.assertEqual(0, len(timer.histogram()))
+
+    def test_bare_decorator(self):
+        @decorator.timed
+        def square(x):
+            return x * x
+
+        self.assertEqual(9, square(3))
+        self.assertEqual('square', square.__name__)
+        self.assertEqual('square', square.timed.name)
+        self.assertEqual(1, len(square.timed.histogram()))
+
+    def test_context_manager_and_threads(self):
+        timer = decorator.timed('block')
+
+        def work():
+            for _ in range(100):
+                with timer:
+                    with timer:
+                        pass
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, len(timer.histograms))
+        self.assertEqual(800, len(timer.histogram()))
+
+    def test_overhead(self):
+        def noop():
+            pass
+
+        def passthrough(*args, **kwargs):
+            return noop(*args, **kwargs)
+
+        timed_noop = decorator.timed()(noop)
+
+        # Alternates the runs so that all see the same noise, and keeps the
+        # best of each.
+        calls = 20000
+        best = dict((func, float('inf'))
+                    for func in (noop, passthrough, timed_noop))
+        for _ in range(25):
+            for func in best:
+                start = time.perf_counter()
+                for _ in range(calls):
+                    func()
+                best[func] = min(best[func],
+                                 (time.perf_counter() - start) / calls)
+        overhead = best[timed_noop] - best[noop]
+        budget = self.OVERHEAD_BUDGET * max(
+            1.0, best[passthrough] / self.REFERENCE_CALL)
+        self.assertTrue(overhead < budget,
+                        'overhead of @timed: {:.0f} ns, budget {:.0f} ns'
+                        .format(overhead * 1e9, budget * 1e9))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Folded stacks from 'perf script' output and SVG flame graphs.
+
+A folded stack is one line per unique call stack, from the root to the leaf,
+with the number of samples: 'postmark;sys_write;ext4_write 42'.
+"""
+
+from __future__ import division
+from xml.sax.saxutils import escape
+import colorsys
+import zlib
+
+
+class FoldedStacks(object):
+    """A hash-aggregated table of call stacks.
+
+    Frame names are interned into integer ids, and each unique stack is a
+    tuple of frame ids (root first) mapped to its count. The memory is bounded
+    by the number of unique stacks rather than by the number of samples, and
+    it can be bounded further by 'max_stacks'.
+    """
+    PRUNED = '[pruned]'
+
+    def __init__(self, max_stacks=0):
+        """@param max_stacks if it is positive, when the table grows beyond
+        it, the least frequent half of the stacks are merged into one
+        '[pruned]' stack so that the total count is preserved.
+        """
+        self.max_stacks = max_stacks
+        self.frames = []
+        self.frame_ids = {}
+        self.counts = {}
+
+    def intern(self, name):
+        """Returns the id of a frame name.
+        """
+        try:
+            return self.frame_ids[name]
+        except KeyError:
+            fid = len(self.frames)
+            self.frame_ids[name] = fid
+            self.frames.append(name)
+            return fid
+
+    def add(self, stack, count=1):
+        """Adds samples of one stack.
+
+        @param stack a sequence of frame names, from the root to the leaf.
+        @param count the number of samples (or their weight).
+        """
+        self.add_ids(tuple(self.intern(name) for name in stack), count)
+
+    def add_ids(self, key, count=1):
+        """Adds samples of one stack of frame ids.
+        """
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + count
+        if self.max_stacks and len(counts) > self.max_stacks:
+            self.prune()
+
+    def prune(self):
+        """Merges the least frequent half of the stacks into '[pruned]'.
+        """
+        pruned_key = (self.intern(self.PRUNED),)
+        ordered = sorted(self.counts.items(), key=lambda item: item[1])
+        pruned = self.counts.pop(pruned_key, 0)
+        for key, count in ordered[:len(ordered) // 2]:
+            if key != pruned_key:
+                pruned += self.counts.pop(key)
+        self.counts[pruned_key] = pruned
+
+    def merge(self, other):
+        """Adds all stacks of another FoldedStacks.
+        """
+        for key, count in other.counts.items():
+            self.add_ids(tuple(self.intern(other.frames[fid])
+                               for fid in key), count)
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def __len__(self):
+        return len(self.counts)
+
+    def items(self):
+        """Iterates (frame names, count), sorted by the stack names.
+        """
+        frames = self.frames
+        stacks = [([frames[fid] for fid in key], count)
+                  for key, count in self.counts.items()]
+        return iter(sorted(stacks))
+
+    def dump(self, outfile):
+        """Writes the stacks in the folded format.
+
+        @param outfile it can be a file object or a string file path.
+        """
+        if type(outfile) == str:
+            with open(outfile, 'w') as fobj:
+                self.dump(fobj)
+            return
+        for stack, count in self.items():
+            outfile.write('{} {}\n'.format(';'.join(stack), count))
+
+
+def load_folded(filename, **kwargs):
+    """Loads stacks in the folded format.
+
+    Optional parameters:
+    @param max_stacks see FoldedStacks.
+    """
+    stacks = FoldedStacks(kwargs.get('max_stacks', 0))
+    with open(filename) as fobj:
+        for line in fobj:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks.add(stack.split(';'), float(count)
+                           if '.' in count else int(count))
+    return stacks
+
+
+def _frame_name(line, with_offset):
+    """Extracts the symbol from a 'perf script' frame line:
+    '  ffffffff8107b7c8 try_to_wake_up+0x88 ([kernel.kallsyms])'
+    """
+    fields = line.strip().split(None, 1)
+    if len(fields) < 2:
+        return fields[0] if fields else ''
+    symbol = fields[1]
+    if symbol.endswith(')'):
+        dso_start = symbol.rfind(' (')
+        if dso_start >= 0:
+            dso = symbol[dso_start + 2:-1]
+            symbol = symbol[:dso_start]
+            if symbol == '[unknown]':
+                symbol = '[{}]'.format(dso.rsplit('/', 1)[-1])
+    if not with_offset:
+        plus = symbol.rfind('+0x')
+        if plus > 0:
+            symbol = symbol[:plus]
+    return symbol
+
+
+def parse_perf_script(filename, **kwargs):
+    """Aggregates the samples of 'perf script' output into folded stacks.
+
+    The file is streamed, and only the table of unique stacks is kept in
+    memory.
+
+    @param filename the output of 'perf script'.
+
+    Optional parameters:
+    @param event only aggregates the samples of this event.
+    @param comm sets to False to not use the command name as the root frame.
+    (default: True)
+    @param weight 'samples' (default) counts each sample as one, 'period'
+    counts the sample period.
+    @param max_depth only keeps the N frames nearest to the leaf.
+    @param offsets sets to True to keep '+0x..' offsets in frame names.
+    @param max_stacks see FoldedStacks.
+    @return a FoldedStacks.
+    """
+    event = kwargs.get('event', None)
+    use_comm = kwargs.get('comm', True)
+    by_period = kwargs.get('weight', 'samples') == 'period'
+    max_depth = kwargs.get('max_depth', 0)
+    with_offset = kwargs.get('offsets', False)
+    stacks = FoldedStacks(kwargs.get('max_stacks', 0))
+    intern = stacks.intern
+
+    header = None
+    frames = []
+
+    def _flush():
+        if header is None:
+            return
+        comm, count, sample_event = header
+        if event and sample_event != event:
+            return
+        ids = frames[::-1]
+        if max_depth:
+            ids = ids[-max_depth:]
+        if use_comm:
+            ids.insert(0, intern(comm))
+        if ids:
+            stacks.add_ids(tuple(ids), count)
+
+    with open(filename) as fobj:
+        for line in fobj:
+            if not line.strip():
+                _flush()
+                header = None
+                frames = []
+                continue
+            if line[0].isspace():
+                if header is not None:
+                    frames.append(intern(_frame_name(line, with_offset)))
+                continue
+            if line.startswith('#'):
+                continue
+            # A sample header: 'comm pid [cpu] time: period event:'.
+            _flush()
+            frames = []
+            header = _parse_header(line, by_period)
+    _flush()
+    return stacks
+
+
+def _parse_header(line, by_period):
+    """Returns (comm, count, event) of a 'perf script' sample header.
+    """
+    head, _, tail = line.partition(': ')
+    # The command name may contain spaces, the pid/tid is the first numeric
+    # field after it.
+    fields = head.split()
+    comm = fields[0]
+    for i, field in enumerate(fields[1:], 1):
+        if field.split('/')[0].isdigit():
+            comm = ' '.join(fields[:i])
+            break
+    tail = tail.split()
+    count = 1
+    sample_event = ''
+    if tail:
+        if tail[0].isdigit():
+            if by_period:
+                count = int(tail[0])
+            tail = tail[1:]
+        if tail:
+            sample_event = tail[0].rstrip(':')
+    return comm, count, sample_event
+
+
+def _frame_color(name):
+    """A stable warm color for a frame name.
+    """
+    value = zlib.crc32(name.encode('utf-8')) & 0xffffffff
+    hue = 0.0 + (value % 1000) / 1000.0 * 0.12
+    red, green, blue = colorsys.hsv_to_rgb(
+        hue, 0.6 + (value >> 10) % 100 / 400.0, 0.95)
+    return 'rgb({},{},{})'.format(int(red * 255), int(green * 255),
+                                  int(blue * 255))
+
+
+def _build_tree(stacks):
+    """Builds a prefix tree: node = [count, {name: node}].
+    """
+    root = [0, {}]
+    for stack, count in stacks.items():
+        node = root
+        node[0] += count
+        for name in stack:
+            children = node[1]
+            if name not in children:
+                children[name] = [0, {}]
+            node = children[name]
+            node[0] += count
+    return root
+
+
+def write_flamegraph(stacks, outfile, **kwargs):
+    """Writes a self-contained SVG flame graph.
+
+    @param stacks a FoldedStacks.
+    @param outfile it can be a file object or a string file path.
+
+    Optional parameters:
+    @param title the title of the graph (default: 'Flame Graph').
+    @param width the width in pixels (default: 1200).
+    @param frame_height the height of each frame in pixels (default: 16).
+    @param min_width omits frames narrower than this in pixels (default: 0.1).
+    @param font_size (default: 11).
+    """
+    if type(outfile) == str:
+        with open(outfile, 'w') as fobj:
+            write_flamegraph(stacks, fobj, **kwargs)
+        return
+
+    title = kwargs.get('title', 'Flame Graph')
+    width = kwargs.get('width', 1200)
+    frame_height = kwargs.get('frame_height', 16)
+    min_width = kwargs.get('min_width', 0.1)
+    font_size = kwargs.get('font_size', 11)
+    pad_top = font_size * 3
+    pad_side = 10
+
+    root = _build_tree(stacks)
+    total = root[0] or 1
+    scale = (width - 2 * pad_side) / total
+
+    # Lay out the frames without recursion: (name, node, depth, x).
+    rects = []
+    max_depth = 0
+    todo = []
+
+    def _push_children(node, depth, start):
+        for child_name, child in sorted(node[1].items()):
+            todo.append((child_name, child, depth, start))
+            start += child[0]
+
+    _push_children(root, 0, 0.0)
+    while todo:
+        name, node, depth, start = todo.pop()
+        if node[0] * scale < min_width:
+            continue
+        rects.append((name, node[0], depth, start))
+        max_depth = max(max_depth, depth)
+        _push_children(node, depth + 1, start)
+
+    height = pad_top + (max_depth + 1) * frame_height + 2 * font_size
+    out = outfile
+    out.write('<?xml version="1.0" standalone="no"?>\n')
+    out.write('<svg version="1.1" width="{}" height="{}" '
+              'xmlns="http://www.w3.org/2000/svg">\n'.format(width, height))
+    out.write('<style>text {{ font-family: monospace; font-size: {}px; }}'
+              '</style>\n'.format(font_size))
+    out.write('<rect x="0" y="0" width="{}" height="{}" fill="#f8f8f8"/>\n'
+              .format(width, height))
+    out.write('<text x="{}" y="{}" text-anchor="middle">{}</text>\n'.format(
+        width / 2, font_size * 2, escape(title)))
+    char_width = font_size * 0.6
+    for name, count, depth, start in rects:
+        rect_x = pad_side + start * scale
+        rect_w = count * scale
+        rect_y = height - font_size - (depth + 1) * frame_height
+        label = escape(name)
+        out.write('<g><title>{} ({} samples, {:.2f}%)</title>'.format(
+            label, count, 100.0 * count / total))
+        out.write('<rect x="{:.2f}" y="{}" width="{:.2f}" height="{}" '
+                  'fill="{}" rx="2"/>'.format(rect_x, rect_y, rect_w,
+                                              frame_height - 1,
+                                              _frame_color(name)))
+        chars = int(rect_w / char_width)
+        if chars >= 3:
+            text = name if len(name) <= chars else name[:chars - 2] + '..'
+            out.write('<text x="{:.2f}" y="{}">{}</text>'.format(
+                rect_x + 3, rect_y + frame_height - 4, escape(text)))
+        out.write('</g>\n')
+    out.write('</svg>\n')
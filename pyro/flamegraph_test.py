@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.flamegraph
+"""
+
+from pyro import flamegraph, synthetic
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import xml.dom.minidom
+
+PERF_SCRIPT = """\
+postmark  1234 [002] 12345.678901:     250000 cycles: 
+\tffffffff8107b7c8 _raw_spin_lock+0x18 ([kernel.kallsyms])
+\tffffffff8106b43d ext4_write+0x5d ([kernel.kallsyms])
+\tffffffff8106c000 sys_write+0x10 ([kernel.kallsyms])
+
+postmark  1234 [003] 12345.679901:     100000 cycles: 
+\tffffffff8106b43d ext4_write+0x5d ([kernel.kallsyms])
+\tffffffff8106c000 sys_write+0x10 ([kernel.kallsyms])
+
+postmark  1235 [003] 12345.680901:     250000 cycles: 
+\tffffffff8107b7c8 _raw_spin_lock+0x20 ([kernel.kallsyms])
+\tffffffff8106b43d ext4_write+0x5d ([kernel.kallsyms])
+\tffffffff8106c000 sys_write+0x10 ([kernel.kallsyms])
+
+kworker/0:1    40 [000] 12345.681901:      5000 cache-misses: 
+\t          4005d0 [unknown] (/usr/bin/worker)
+"""
+
+
+class TestFlameGraph(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'perf.script')
+        with open(self.path, 'w') as fobj:
+            fobj.write(PERF_SCRIPT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def folded(self, stacks):
+        buf = io.StringIO()
+        stacks.dump(buf)
+        return buf.getvalue()
+
+    def test_parse_perf_script(self):
+        stacks = flamegraph.parse_perf_script(self.path)
+        self.assertEqual('kworker/0:1;[worker] 1\n'
+                         'postmark;sys_write;ext4_write 1\n'
+                         'postmark;sys_write;ext4_write;_raw_spin_lock 2\n',
+                         self.folded(stacks))
+
+    def test_parse_options(self):
+        stacks = flamegraph.parse_perf_script(
+            self.path, event='cycles', weight='period', comm=False,
+            max_depth=2)
+        self.assertEqual(['ext4_write', '_raw_spin_lock'],
+                         list(stacks.items())[0][0])
+        self.assertEqual(600000, stacks.total())
+
+    def test_prune(self):
+        stacks = flamegraph.FoldedStacks(max_stacks=4)
+        for i in range(10):
+            stacks.add(['main', 'f{}'.format(i)], i + 1)
+        self.assertTrue(len(stacks) <= 4)
+        self.assertEqual(55, stacks.total())
+
+    def test_merge_and_load(self):
+        stacks = flamegraph.parse_perf_script(self.path)
+        stacks.merge(flamegraph.parse_perf_script(self.path))
+        path = os.path.join(self.tmpdir, 'folded.txt')
+        stacks.dump(path)
+        loaded = flamegraph.load_folded(path)
+        self.assertEqual(8, loaded.total())
+        self.assertEqual(self.folded(stacks), self.folded(loaded))
+
+    def test_write_flamegraph(self):
+        stacks = flamegraph.parse_perf_script(self.path)
+        stacks.add(['<main>', 'a&b'])
+        svg = io.StringIO()
+        flamegraph.write_flamegraph(stacks, svg, title='Test & Co')
+        doc = xml.dom.minidom.parseString(svg.getvalue())
+        titles = [node.firstChild.data
+                  for node in doc.getElementsByTagName('title')]
+        self.assertTrue('postmark (3 samples, 60.00%)' in titles)
+        self.assertTrue('a&b (1 samples, 20.00%)' in titles)
+        # One rect for the background and one for each frame.
+        self.assertEqual(9, len(doc.getElementsByTagName('rect')))
+
+    def test_synthetic(self):
+        path = os.path.join(self.tmpdir, 'synthetic.script')
+        with open(path, 'w') as fobj:
+            records = synthetic.generate_perf_script(fobj, 256 * 1024)
+        stacks = flamegraph.parse_perf_script(path)
+        self.assertEqual(records, stacks.total())
+        self.assertTrue(len(stacks) < records)
+        svg = os.path.join(self.tmpdir, 'flame.svg')
+        flamegraph.write_flamegraph(stacks, svg)
+        xml.dom.minidom.parse(svg)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""The input layer of the parsers.
+
+A source is a path, a file object (binary or text), bytes or an iterable of
+lines or chunks (str or bytes). Compressed sources (gzip, xz, bzip2 and, if
+the zstandard module is installed, zstd) are detected by their magic bytes
+and decompressed as a stream. Large uncompressed files are memory-mapped
+instead of read.
+
+The parsers get bytes and only decode the values they match.
+
+Usage:
+>>> for line in lines('lock_stat.txt.xz'):
+...     fields = line.split()
+>>> for block in blocks(sys.stdin.buffer):
+...     regex.finditer(block)
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+
+# Uncompressed files of at least this size are memory-mapped.
+MMAP_THRESHOLD = 64 * 1024 * 1024
+# Reads streams in blocks of about this size.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# The longest magic number.
+MAGIC_SIZE = 6
+
+
+def _zstd_reader(fobj):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Reading zstd input needs the zstandard module')
+    return zstandard.ZstdDecompressor().stream_reader(fobj)
+
+
+# [(magic, function that returns a decompressed reader of a binary reader)]
+MAGICS = [
+    (b'\x1f\x8b', lambda fobj: gzip.GzipFile(fileobj=fobj)),
+    (b'\xfd7zXZ\x00', lzma.LZMAFile),
+    (b'BZh', bz2.BZ2File),
+    (b'\x28\xb5\x2f\xfd', _zstd_reader),
+]
+
+
+def _decompressor(head):
+    for magic, func in MAGICS:
+        if head.startswith(magic):
+            return func
+    return None
+
+
+class _ChunkReader(io.RawIOBase):
+    """A binary reader of an iterator of bytes chunks, e.g. to decompress
+    them as a stream.
+    """
+    def __init__(self, chunks):
+        self.chunks_ = iter(chunks)
+        self.buffer_ = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self.buffer_:
+            try:
+                self.buffer_ = next(self.chunks_)
+            except StopIteration:
+                return 0
+        size = min(len(buf), len(self.buffer_))
+        buf[:size] = self.buffer_[:size]
+        self.buffer_ = self.buffer_[size:]
+        return size
+
+
+def _read_chunks(fobj, block_size):
+    """Yields the chunks of a reader as bytes.
+    """
+    while True:
+        chunk = fobj.read(block_size)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        yield chunk
+
+
+def _encoded(items):
+    for item in items:
+        if isinstance(item, str):
+            item = item.encode('utf-8')
+        yield item
+
+
+def _decompressed(chunks, block_size):
+    """Yields the chunks of a stream, decompressing it if needed.
+    """
+    chunks = iter(chunks)
+    head = b''
+    # Probes at least MAGIC_SIZE bytes, unless the stream is shorter.
+    while len(head) < MAGIC_SIZE:
+        try:
+            head += next(chunks)
+        except StopIteration:
+            break
+    func = _decompressor(head)
+    if func is None:
+        if head:
+            yield head
+        for chunk in chunks:
+            yield chunk
+        return
+    reader = func(io.BufferedReader(_ChunkReader(_prepend(head, chunks))))
+    try:
+        for chunk in _read_chunks(reader, block_size):
+            yield chunk
+    finally:
+        reader.close()
+
+
+def _prepend(head, chunks):
+    yield head
+    for chunk in chunks:
+        yield chunk
+
+
+def _whole_lines(chunks):
+    """Joins chunks into blocks that end at line ends.
+    """
+    remain = b''
+    for chunk in chunks:
+        block = remain + chunk if remain else chunk
+        last_newline = block.rfind(b'\n')
+        if last_newline < 0:
+            remain = block
+            continue
+        remain = block[last_newline + 1:]
+        yield block[:last_newline + 1]
+    if remain:
+        yield remain
+
+
+def _path_blocks(path, block_size):
+    with open(path, 'rb') as fobj:
+        func = _decompressor(fobj.read(MAGIC_SIZE))
+        fobj.seek(0)
+        if func is not None:
+            reader = func(fobj)
+            try:
+                for block in _whole_lines(_read_chunks(reader, block_size)):
+                    yield block
+            finally:
+                reader.close()
+            return
+        size = os.fstat(fobj.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # The caller still holds a slice of it.
+                    pass
+            return
+        for block in _whole_lines(_read_chunks(fobj, block_size)):
+            yield block
+
+
+def blocks(source, block_size=BLOCK_SIZE):
+    """Yields the content of a source as bytes-like blocks of whole lines.
+
+    A large uncompressed file is yielded as a single read-only mmap, which
+    supports regular expressions, find() and slicing like bytes.
+
+    @param source a path, a file object, bytes or an iterable of str or
+    bytes chunks (e.g. lines).
+    @param block_size reads streams in blocks of about this size.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        for block in _path_blocks(source, block_size):
+            yield block
+        return
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        if _decompressor(bytes(source[:MAGIC_SIZE])) is None:
+            # Zero-copy.
+            if len(source):
+                yield source
+            return
+        chunks = [bytes(source)]
+    elif hasattr(source, 'read'):
+        chunks = _read_chunks(source, block_size)
+    else:
+        chunks = _encoded(source)
+    for block in _whole_lines(_decompressed(chunks, block_size)):
+        yield block
+
+
+def lines(source, block_size=BLOCK_SIZE):
+    """Yields the lines of a source as bytes, with their line ends.
+
+    @param source see blocks().
+    """
+    for block in blocks(source, block_size):
+        if isinstance(block, memoryview):
+            block = block.tobytes()
+        start = 0
+        end = len(block)
+        find = block.find
+        while start < end:
+            newline = find(b'\n', start)
+            if newline < 0:
+                newline = end - 1
+            yield bytes(block[start:newline + 1])
+            start = newline + 1
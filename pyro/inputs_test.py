@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.inputs
+"""
+
+from pyro import inputs
+from unittest import mock
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+
+CONTENT = b'line 1\nline 2\n\nlast line without newline'
+LINES = [b'line 1\n', b'line 2\n', b'\n', b'last line without newline']
+
+
+class TestInputs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as fobj:
+            fobj.write(content)
+        return path
+
+    def test_sources(self):
+        path = self.write('plain.txt', CONTENT)
+        with open(path, 'rb') as fobj:
+            self.assertEqual(LINES, list(inputs.lines(fobj)))
+        with open(path) as fobj:
+            self.assertEqual(LINES, list(inputs.lines(fobj)))
+        self.assertEqual(LINES, list(inputs.lines(path)))
+        self.assertEqual(LINES, list(inputs.lines(CONTENT)))
+        self.assertEqual(LINES, list(inputs.lines(bytearray(CONTENT))))
+        self.assertEqual(LINES, list(inputs.lines(memoryview(CONTENT))))
+        self.assertEqual(LINES, list(inputs.lines(
+            line.decode('utf-8') for line in LINES)))
+        self.assertEqual([], list(inputs.lines(b'')))
+        # Bytes are not copied.
+        self.assertTrue(next(inputs.blocks(CONTENT)) is CONTENT)
+
+    def test_small_blocks(self):
+        blocks = list(inputs.blocks(io.BytesIO(CONTENT), block_size=3))
+        self.assertEqual(CONTENT, b''.join(blocks))
+        self.assertTrue(all(block.endswith(b'\n') for block in blocks[:-1]))
+        self.assertEqual(LINES, list(inputs.lines(io.BytesIO(CONTENT),
+                                                  block_size=5)))
+
+    def test_compressed(self):
+        for name, compress in [('gz', gzip.compress), ('xz', lzma.compress),
+                               ('bz2', bz2.compress)]:
+            data = compress(CONTENT)
+            path = self.write('data.' + name, data)
+            self.assertEqual(LINES, list(inputs.lines(path)), name)
+            self.assertEqual(LINES, list(inputs.lines(data)), name)
+            # A stream whose magic number is split across chunks.
+            chunks = [data[i:i + 2] for i in range(0, len(data), 2)]
+            self.assertEqual(LINES, list(inputs.lines(iter(chunks))), name)
+            with open(path, 'rb') as fobj:
+                self.assertEqual(LINES, list(inputs.lines(fobj, 4)), name)
+
+    def test_zstd(self):
+        try:
+            import zstandard
+        except ImportError:
+            self.assertRaises(ImportError, list,
+                              inputs.lines(b'\x28\xb5\x2f\xfd\x00\x00'))
+            self.skipTest('zstandard is not available')
+        data = zstandard.ZstdCompressor().compress(CONTENT)
+        self.assertEqual(LINES, list(inputs.lines(data)))
+
+    def test_mmap(self):
+        path = self.write('large.txt', CONTENT)
+        with mock.patch.object(inputs, 'MMAP_THRESHOLD', 10):
+            blocks = list(inputs.blocks(path))
+            self.assertEqual(1, len(blocks))
+            self.assertTrue(isinstance(blocks[0], mmap.mmap))
+            self.assertEqual(LINES, list(inputs.lines(path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Contention call sites from the detail sections of /proc/lock_stat.
+
+Under each contended lock class, lock_stat prints two sections separated by
+dashed lines: the contention points (the call sites that waited for the lock)
+and the contending points (the call sites that held the lock while others
+waited):
+
+     &rq->lock:    1302    1327    0.08 ...
+     ---------
+     &rq->lock     312    [<ffffffff8107b7c8>] try_to_wake_up+0x88/0x280
+     ---------
+     &rq->lock     370    [<ffffffff8106b43d>] task_rq_lock+0x5d/0xa0
+"""
+
+from array import array
+import numpy as np
+
+CONTENTION_POINT = 0
+CONTENDING_POINT = 1
+
+
+class CallSiteTable(object):
+    """An indexed table of the call sites of lock contentions.
+
+    Lock classes, call sites ('sym+off/len') and functions ('sym') are
+    interned into ids, and the rows of the table are kept in the NumPy arrays
+    row_class, row_kind (CONTENTION_POINT or CONTENDING_POINT), row_site,
+    row_address and row_count.
+    """
+    def __init__(self):
+        self.classes = []
+        self.class_ids = {}
+        self.sites = []
+        self.site_ids = {}
+        # The function of each site.
+        self.site_functions = []
+        self.functions = []
+        self.function_ids = {}
+        self.class_index_ = None
+        self.build([], [], [], [], [])
+
+    def intern_class(self, name):
+        cid = self.class_ids.get(name)
+        if cid is None:
+            cid = len(self.classes)
+            self.class_ids[name] = cid
+            self.classes.append(name)
+        return cid
+
+    def intern_site(self, site):
+        sid = self.site_ids.get(site)
+        if sid is None:
+            sid = len(self.sites)
+            self.site_ids[site] = sid
+            self.sites.append(site)
+            function = site.split('+', 1)[0]
+            fid = self.function_ids.get(function)
+            if fid is None:
+                fid = len(self.functions)
+                self.function_ids[function] = fid
+                self.functions.append(function)
+            self.site_functions.append(fid)
+        return sid
+
+    def build(self, class_ids, kinds, site_ids, addresses, counts):
+        """Sets the rows of the table.
+        """
+        self.row_class = np.asarray(class_ids, dtype=np.int32)
+        self.row_kind = np.asarray(kinds, dtype=np.int8)
+        self.row_site = np.asarray(site_ids, dtype=np.int32)
+        self.row_address = np.asarray(addresses, dtype=np.uint64)
+        self.row_count = np.asarray(counts, dtype=np.int64)
+        self.class_index_ = None
+
+    def __len__(self):
+        return len(self.row_count)
+
+    def _rows_of_class(self, cid):
+        """Returns the rows of a lock class, using an index sorted by class.
+        """
+        if self.class_index_ is None:
+            order = np.argsort(self.row_class, kind='stable')
+            self.class_index_ = (order, self.row_class[order])
+        order, keys = self.class_index_
+        return order[np.searchsorted(keys, cid, side='left'):
+                     np.searchsorted(keys, cid, side='right')]
+
+    def call_sites(self, lock_class, kind=CONTENTION_POINT):
+        """Returns the call sites of a lock class.
+
+        @param lock_class the name of the lock class.
+        @param kind CONTENTION_POINT or CONTENDING_POINT.
+        @return [(site, address, count), ...] in descending order of count.
+        """
+        if lock_class not in self.class_ids:
+            return []
+        rows = self._rows_of_class(self.class_ids[lock_class])
+        rows = rows[self.row_kind[rows] == kind]
+        rows = rows[np.argsort(-self.row_count[rows], kind='stable')]
+        return [(self.sites[self.row_site[r]], int(self.row_address[r]),
+                 int(self.row_count[r])) for r in rows]
+
+    def top_call_sites(self, topn=10, kind=CONTENTION_POINT, **kwargs):
+        """Returns the call sites with the most contentions across all lock
+        classes.
+
+        @param topn returns the top N call sites.
+        @param kind CONTENTION_POINT or CONTENDING_POINT.
+
+        Optional parameters:
+        @param by_function sets to True to aggregate the sites of the same
+        function (default: False).
+        @return [(site or function, count), ...] in descending order.
+        """
+        by_function = kwargs.get('by_function', False)
+        mask = self.row_kind == kind
+        keys = self.row_site[mask]
+        names = self.sites
+        if by_function:
+            keys = np.asarray(self.site_functions, dtype=np.int32)[keys]
+            names = self.functions
+        totals = np.bincount(keys, weights=self.row_count[mask],
+                             minlength=len(names))
+        nonzero = np.nonzero(totals)[0]
+        best = nonzero[np.argsort(-totals[nonzero], kind='stable')][:topn]
+        return [(names[i], int(totals[i])) for i in best]
+
+    def classes_of_site(self, site, kind=CONTENTION_POINT):
+        """Returns the lock classes contended at a call site.
+
+        @return [(lock class, count), ...] in descending order.
+        """
+        if site not in self.site_ids:
+            return []
+        mask = (self.row_site == self.site_ids[site]) & \
+            (self.row_kind == kind)
+        totals = np.bincount(self.row_class[mask],
+                             weights=self.row_count[mask],
+                             minlength=len(self.classes))
+        nonzero = np.nonzero(totals)[0]
+        best = nonzero[np.argsort(-totals[nonzero], kind='stable')]
+        return [(self.classes[i], int(totals[i])) for i in best]
+
+
+def parse_lockstat_callsites(filename):
+    """Parses the contention points and contending points of all lock classes
+    in a lock_stat file.
+
+    @param filename the lock_stat file path.
+    @return a CallSiteTable.
+    """
+    table = CallSiteTable()
+    class_ids = array('i')
+    kinds = array('b')
+    site_ids = array('i')
+    addresses = array('Q')
+    counts = array('q')
+    # The number of dashed separators seen under the current class.
+    section = 0
+    with open(filename) as fobj:
+        for line in fobj:
+            bracket = line.find('[<')
+            if bracket < 0:
+                stripped = line.strip()
+                if stripped and stripped.strip('-') == '':
+                    section += 1
+                elif ':' in line or not stripped or \
+                        stripped.strip('.') == '':
+                    # A new lock class, or the end of one.
+                    section = 0
+                continue
+            if section not in (1, 2):
+                continue
+            name, count = line[:bracket].rsplit(None, 1)
+            end = line.find('>]', bracket)
+            fields = line[end + 2:].split()
+            if not fields:
+                continue
+            try:
+                address = int(line[bracket + 2:end], 16)
+            except ValueError:
+                # e.g. '[<          (null)>]'
+                address = 0
+            class_ids.append(table.intern_class(name.strip()))
+            kinds.append(CONTENTION_POINT if section == 1
+                         else CONTENDING_POINT)
+            site_ids.append(table.intern_site(fields[0]))
+            addresses.append(address)
+            counts.append(int(count))
+    table.build(class_ids, kinds, site_ids, addresses, counts)
+    return table
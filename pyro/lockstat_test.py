@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.lockstat
+"""
+
+from pyro import lockstat, synthetic
+import os
+import shutil
+import tempfile
+import unittest
+
+LOCKSTAT = """\
+lock_stat version 0.3
+-------------------------------------------------------------------------
+                              class name    con-bounces    contentions
+-------------------------------------------------------------------------
+
+                               &rq->lock:          1302           1327 \
+          0.08          11.81         469.29          18738        1016655 \
+          0.05          23.69     1053640.75
+                               ---------
+                               &rq->lock            312          \
+[<ffffffff8107b7c8>] try_to_wake_up+0x88/0x280
+                               &rq->lock            544          \
+[<ffffffff8106b43d>] task_rq_lock+0x5d/0xa0
+                               ---------
+                               &rq->lock            370          \
+[<ffffffff8106b43d>] task_rq_lock+0x5d/0xa0
+                               &rq->lock              2          \
+[<          (null)>] 0x0
+
+.........................................................................
+
+                    &(&dentry->d_lock)->rlock:     10     20 \
+          0.10           1.00          20.00              5            100 \
+          0.05           2.00          50.00
+                    -------------------------
+                    &(&dentry->d_lock)->rlock     15          \
+[<ffffffff811b1234>] dput+0x34/0x1d0
+                    &(&dentry->d_lock)->rlock      5          \
+[<ffffffff8107b7c8>] try_to_wake_up+0x88/0x280
+                    -------------------------
+                    &(&dentry->d_lock)->rlock     20          \
+[<ffffffff811b1280>] dput+0x80/0x1d0
+
+.........................................................................
+
+                              &sb->s_lock:      0      0 \
+          0.00           0.00           0.00              5            100 \
+          0.05           2.00          50.00
+"""
+
+
+class TestCallSites(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'lock_stat')
+        with open(path, 'w') as fobj:
+            fobj.write(LOCKSTAT)
+        self.table = lockstat.parse_lockstat_callsites(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse(self):
+        table = self.table
+        self.assertEqual(7, len(table))
+        self.assertEqual(['&rq->lock', '&(&dentry->d_lock)->rlock'],
+                         table.classes)
+        self.assertEqual(['try_to_wake_up', 'task_rq_lock', '0x0', 'dput'],
+                         table.functions)
+
+    def test_call_sites(self):
+        table = self.table
+        self.assertEqual(
+            [('task_rq_lock+0x5d/0xa0', 0xffffffff8106b43d, 544),
+             ('try_to_wake_up+0x88/0x280', 0xffffffff8107b7c8, 312)],
+            table.call_sites('&rq->lock'))
+        self.assertEqual(
+            [('dput+0x80/0x1d0', 0xffffffff811b1280, 20)],
+            table.call_sites('&(&dentry->d_lock)->rlock',
+                             lockstat.CONTENDING_POINT))
+        self.assertEqual([], table.call_sites('&sb->s_lock'))
+
+    def test_top_call_sites(self):
+        table = self.table
+        self.assertEqual([('task_rq_lock+0x5d/0xa0', 544),
+                          ('try_to_wake_up+0x88/0x280', 317)],
+                         table.top_call_sites(2))
+        self.assertEqual([('task_rq_lock', 370), ('dput', 20)],
+                         table.top_call_sites(
+                             2, lockstat.CONTENDING_POINT, by_function=True))
+        self.assertEqual([('&rq->lock', 312),
+                          ('&(&dentry->d_lock)->rlock', 5)],
+                         table.classes_of_site('try_to_wake_up+0x88/0x280'))
+
+    def test_synthetic(self):
+        path = os.path.join(self.tmpdir, 'synthetic')
+        with open(path, 'w') as fobj:
+            synthetic.generate_lockstat(fobj, 64 * 1024)
+        table = lockstat.parse_lockstat_callsites(path)
+        self.assertTrue(len(table) > 0)
+        self.assertTrue((table.row_count > 0).all())
+        self.assertEqual(set([lockstat.CONTENTION_POINT,
+                              lockstat.CONTENDING_POINT]),
+                         set(table.row_kind.tolist()))
+
+
+if __name__ == '__main__':
+    unittest.main()
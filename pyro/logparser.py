@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Declarative parsers for the text outputs of benchmark tools.
+
+A parser is a set of named fields. Each field is a regular expression with a
+'value' group and an optional 'unit' group, matched at the beginning of a line
+after its indentation. All fields are combined into one compiled regular
+expression anchored at line starts, so each file is scanned only once and the
+regular expression engine only tries the fields where lines begin.
+
+Usage:
+>>> parser = LogParser('mytool', [
+...     Field('iops', r'IOPS: (?P<value>[0-9]+)', int),
+...     Field('bw', r'BW: (?P<value>[0-9.]+) (?P<unit>[KMG]B)/s',
+...           units=SIZE_UNITS_KB)])
+>>> register(parser)
+>>> get_parser('mytool').parse('output.txt')
+{'iops': 1000, 'bw': 2048.0}
+"""
+
+from collections import namedtuple
+from pyro import inputs
+import re
+
+# Converts sizes to kilobytes.
+SIZE_UNITS_KB = {
+    'bytes': 1.0 / 1024, 'kilobytes': 1, 'megabytes': 1024,
+    'gigabytes': 1024 ** 2, 'B': 1.0 / 1024, 'KB': 1, 'MB': 1024,
+    'GB': 1024 ** 2,
+}
+
+Record = namedtuple('Record', ['field', 'value'])
+
+_PARSERS = {}
+
+
+class Field(object):
+    """A named value in the output of a tool.
+    """
+    def __init__(self, name, pattern, value_type=float, units=None):
+        """@param name the name of the field.
+        @param pattern a regular expression matching the beginning of a line
+        (after the indentation), with a group named 'value' and, if units is
+        given, a group named 'unit'. Use '.*' to match in the middle of lines.
+        @param value_type converts the matched value (default: float).
+        @param units a dict {unit: factor} to normalize the value.
+        """
+        self.name = name
+        self.pattern = pattern
+        self.value_type = value_type
+        self.units = units
+        if '(?P<value>' not in pattern:
+            raise ValueError('Field {} has no "value" group'.format(name))
+        if units and '(?P<unit>' not in pattern:
+            raise ValueError('Field {} has no "unit" group'.format(name))
+
+    def convert(self, value, unit=None):
+        """Converts the matched strings to a normalized value.
+        """
+        value = self.value_type(value)
+        if self.units:
+            try:
+                value *= self.units[unit]
+            except KeyError:
+                raise ValueError('Field {}: unknown unit {}'.format(
+                    self.name, unit))
+        return value
+
+
+class LogParser(object):
+    """Parses a file with several Fields in a single pass.
+    """
+    # Reads files in blocks of whole lines of about this size.
+    BLOCK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, name, fields):
+        """@param name the name of the parser in the registry.
+        @param fields a list of Field objects.
+        """
+        self.name = name
+        self.fields = list(fields)
+        alternatives = []
+        for i, field in enumerate(self.fields):
+            pattern = field.pattern.replace(
+                '(?P<value>', '(?P<f{}_value>'.format(i)).replace(
+                '(?P<unit>', '(?P<f{}_unit>'.format(i))
+            alternatives.append('(?P<f{}>{})'.format(i, pattern))
+        # Matches bytes, so that only the matched values are decoded.
+        self.regex = re.compile(
+            r'^[ \t]*(?:{})'.format('|'.join(alternatives)).encode('utf-8'),
+            re.MULTILINE)
+        # {group index of a field: (field, value group, unit group)}
+        self.groups_ = {}
+        for i, field in enumerate(self.fields):
+            self.groups_[self.regex.groupindex['f{}'.format(i)]] = (
+                field, 'f{}_value'.format(i),
+                'f{}_unit'.format(i) if field.units else None)
+
+    def records(self, filename):
+        """Yields a Record for each matched field, in the order of the file.
+
+        @param filename the output file path, or another source of
+        inputs.blocks(): a compressed file, a file object, bytes or an
+        iterable of lines.
+        """
+        groups = self.groups_
+        for block in inputs.blocks(filename, self.BLOCK_SIZE):
+            for match in self.regex.finditer(block):
+                # The group of a field encloses all its inner groups, so it
+                # is always the last closed group.
+                field, value, unit = groups[match.lastindex]
+                yield Record(field.name, field.convert(
+                    match.group(value).decode('utf-8'),
+                    match.group(unit).decode('utf-8') if unit else None))
+
+    def parse(self, filename):
+        """Parses a file, or another source of inputs.blocks().
+
+        @return {field name: value}. If a field occurs several times, the last
+        value is kept.
+        """
+        result = {}
+        for record in self.records(filename):
+            result[record.field] = record.value
+        return result
+
+
+def register(parser):
+    """Registers a LogParser by its name.
+
+    @return the parser.
+    """
+    _PARSERS[parser.name] = parser
+    return parser
+
+
+def get_parser(name):
+    """Returns a registered LogParser.
+    """
+    return _PARSERS[name]
+
+
+def registered_parsers():
+    """Returns the names of all registered parsers.
+    """
+    return sorted(_PARSERS)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.logparser
+"""
+
+from pyro import logparser, parserbench, perftest, synthetic
+import os
+import shutil
+import tempfile
+import unittest
+
+POSTMARK = """\
+Time:
+\t100 seconds total
+\t90 seconds of transactions (111 per second)
+
+Files:
+\t20000 created (200 per second)
+\t\tCreation alone: 10000 files (1000 per second)
+\t\tMixed with transactions: 10000 files (111 per second)
+\t20000 deleted (200 per second)
+\t\tDeletion alone: 10000 files (2000 per second)
+\t\tMixed with transactions: 10000 files (111 per second)
+
+Data:
+\t1.50 gigabytes read (15.36 megabytes per second)
+\t800.00 kilobytes written (8.00 kilobytes per second)
+"""
+
+
+class TestLogParser(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, content, name='output.txt'):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as fobj:
+            fobj.write(content)
+        return path
+
+    def test_postmark(self):
+        result = perftest.parse_postmark_data(self.write(POSTMARK))
+        self.assertEqual({'creation': 1000.0, 'deletion': 2000.0,
+                          'read': 15.36 * 1024, 'write': 8.0}, result)
+
+    def test_records(self):
+        parser = logparser.LogParser('tool', [
+            logparser.Field('iops', r'IOPS: (?P<value>[0-9]+)', int),
+            logparser.Field('bw', r'.*BW=(?P<value>[0-9.]+)(?P<unit>[KMG]B)/s',
+                            units=logparser.SIZE_UNITS_KB)])
+        path = self.write('IOPS: 10\n  read: BW=2MB/s\nIOPS: 20\nBW=1KB\n')
+        self.assertEqual([('iops', 10), ('bw', 2048.0), ('iops', 20)],
+                         list(parser.records(path)))
+        self.assertEqual({'iops': 20, 'bw': 2048.0}, parser.parse(path))
+        self.assertTrue(isinstance(parser.parse(path)['iops'], int))
+
+    def test_unknown_unit(self):
+        parser = logparser.LogParser('tool', [
+            logparser.Field('bw', r'BW=(?P<value>[0-9.]+)(?P<unit>[A-Z]+)',
+                            units=logparser.SIZE_UNITS_KB)])
+        self.assertRaises(ValueError, parser.parse, self.write('BW=1TB\n'))
+
+    def test_invalid_field(self):
+        self.assertRaises(ValueError, logparser.Field, 'a', r'([0-9]+)')
+        self.assertRaises(ValueError, logparser.Field, 'a',
+                          r'(?P<value>[0-9]+)', units={'KB': 1})
+
+    def test_block_boundaries(self):
+        path = os.path.join(self.tmpdir, 'postmark.txt')
+        with open(path, 'w') as fobj:
+            synthetic.generate_postmark(fobj, 64 * 1024)
+        parser = logparser.LogParser(
+            'small_blocks', perftest.POSTMARK_PARSER.fields)
+        parser.BLOCK_SIZE = 100
+        records = list(parser.records(path))
+        self.assertEqual(list(perftest.POSTMARK_PARSER.records(path)),
+                         records)
+        self.assertEqual(parserbench.scan_per_line(parser, path),
+                         parser.parse(path))
+
+    def test_registry(self):
+        self.assertEqual(perftest.POSTMARK_PARSER,
+                         logparser.get_parser('postmark'))
+        self.assertTrue('postmark' in logparser.registered_parsers())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""A local HTTP endpoint that exposes live profiling data in the Prometheus
+text format, e.g. to watch a long sweep while it runs.
+
+Metrics come from collectors, which are called on each scrape and only read
+the latest samples of profilers without locking them, and from values pushed
+with set(), inc() and observe().
+
+Usage:
+>>> server = MetricsServer(port=9100)
+>>> server.add_profiler(disk_profiler, 'disk')
+>>> server.add_checkpoint(checkpoint, total=len(configs))
+>>> server.start()
+>>> # curl http://127.0.0.1:9100/metrics
+>>> server.stop()
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pyro import profiler as pyro_profiler
+import math
+import os
+import re
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metric_name(name):
+    """Converts a name to a valid Prometheus metric name: 'r-iops' ->
+    'r_iops'.
+    """
+    name = re.sub('[^a-zA-Z0-9_:]', '_', name)
+    if name[:1].isdigit():
+        name = '_' + name
+    return name
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(metric_name(key), _escape(value))
+                          for key, value in sorted(labels.items())) + '}'
+
+
+def cpu_collector(procstat='/proc/stat'):
+    """Returns a collector of the CPU time of the whole system in each mode,
+    read from the first line of /proc/stat on each scrape.
+    """
+    modes = ['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq',
+             'steal']
+
+    def _collect():
+        with open(procstat) as fobj:
+            fields = fobj.readline().split()[1:]
+        ticks = float(os.sysconf('SC_CLK_TCK'))
+        return [('pyro_cpu_seconds_total', 'counter',
+                 'CPU time of the system in each mode.', {'mode': mode},
+                 int(value) / ticks)
+                for mode, value in zip(modes, fields)]
+    return _collect
+
+
+def checkpoint_collector(checkpoint, total=0):
+    """Returns a collector of the progress of a checkpoint.Checkpoint.
+
+    @param total the total number of steps, if it is known.
+    """
+    def _collect():
+        samples = [('pyro_checkpoint_steps_done', 'gauge',
+                    'Steps finished by the checkpoint.', {},
+                    checkpoint.steps)]
+        if total:
+            samples.append(('pyro_checkpoint_steps', 'gauge',
+                            'Total steps of the checkpoint.', {}, total))
+        return samples
+    return _collect
+
+
+def profiler_collector(prof, name):
+    """Returns a collector of the latest samples of a profiler. Other types
+    of profilers have no live samples to export.
+
+    @param prof a DiskStatsProfiler, ProcessProfiler, LockstatProfiler or a
+    CompositeProfiler of them.
+    @param name the value of the 'profiler' label.
+    """
+    def _collect():
+        return _profiler_samples(prof, name)
+    return _collect
+
+
+# The maximal number of lock classes to export, by contentions.
+LOCKSTAT_TOPN = 20
+
+
+def _profiler_samples(prof, name):
+    samples = []
+    if isinstance(prof, pyro_profiler.DiskStatsProfiler):
+        for dev, metrics in prof.latest().items():
+            for metric, value in metrics.items():
+                samples.append((
+                    'pyro_disk_' + metric_name(metric), 'gauge',
+                    'Disk {} in the last interval.'.format(metric),
+                    {'profiler': name, 'device': dev}, value))
+    elif isinstance(prof, pyro_profiler.ProcessProfiler):
+        for metric, value in prof.latest().items():
+            if metric in prof.COUNTERS:
+                samples.append((
+                    'pyro_process_' + metric_name(metric) + '_total',
+                    'counter', 'Process tree {}.'.format(metric),
+                    {'profiler': name}, value))
+            else:
+                samples.append((
+                    'pyro_process_' + metric_name(metric), 'gauge',
+                    'Process tree {}.'.format(metric),
+                    {'profiler': name}, value))
+    elif isinstance(prof, pyro_profiler.LockstatProfiler):
+        latest = prof.latest()
+        top = sorted(latest, key=lambda cls: -latest[cls]['contentions'])
+        for lock_class in top[:LOCKSTAT_TOPN]:
+            for field, value in latest[lock_class].items():
+                samples.append((
+                    'pyro_lockstat_' + metric_name(field), 'gauge',
+                    'Lock {} in the last interval.'.format(field),
+                    {'profiler': name, 'class': lock_class}, value))
+    elif isinstance(prof, pyro_profiler.CompositeProfiler):
+        for i, (child, overhead) in enumerate(zip(prof.profilers,
+                                                  list(prof.overhead))):
+            child_name = '{}.{}'.format(name, i)
+            for kind in ('cpu-time', 'wall-time'):
+                samples.append((
+                    'pyro_profiler_overhead_seconds_total', 'counter',
+                    'Time spent in the profilers.',
+                    {'profiler': child_name, 'kind': kind}, overhead[kind]))
+            samples.extend(_profiler_samples(child, child_name))
+    return samples
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(object):
+    """Serves metrics in the Prometheus text format from a background
+    thread.
+    """
+    def __init__(self, port=0, host='127.0.0.1'):
+        """@param port the TCP port. 0 picks a free port (see 'port' after
+        start()).
+        @param host the address to listen on (default: localhost only).
+        """
+        self.host = host
+        self.port = port
+        self.collectors = []
+        # {(name, labels): [type, help, value]}
+        self.values_ = {}
+        self.lock_ = threading.Lock()
+        self.server_ = None
+        self.thread_ = None
+
+    def add_collector(self, collector):
+        """Adds a callable that returns the samples of a scrape:
+        [(name, type, help, {label: value}, value), ...].
+        """
+        self.collectors.append(collector)
+
+    def add_profiler(self, prof, name=None):
+        self.add_collector(profiler_collector(
+            prof, name or type(prof).__name__))
+
+    def add_checkpoint(self, checkpoint, total=0):
+        self.add_collector(checkpoint_collector(checkpoint, total))
+
+    def _update(self, name, labels, metric_type, doc, func):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock_:
+            entry = self.values_.get(key)
+            if entry is None:
+                entry = self.values_[key] = [metric_type, doc, 0.0]
+            entry[2] = func(entry[2])
+
+    def set(self, name, value, labels=None, doc=''):
+        """Sets a gauge.
+        """
+        self._update(name, labels, 'gauge', doc, lambda _: value)
+
+    def inc(self, name, value=1, labels=None, doc=''):
+        """Increases a counter.
+        """
+        self._update(name, labels, 'counter', doc, lambda old: old + value)
+
+    def observe(self, name, seconds, labels=None, doc=''):
+        """Records one duration, e.g. of a benchmark iteration, as a summary
+        (name_count and name_sum) and the gauge name_last.
+        """
+        self._update(name + '_count', labels, 'summary', doc,
+                     lambda old: old + 1)
+        self._update(name + '_sum', labels, 'summary', doc,
+                     lambda old: old + seconds)
+        self._update(name + '_last', labels, 'gauge', doc,
+                     lambda _: seconds)
+
+    def _samples(self):
+        with self.lock_:
+            pushed = [(name, entry[0], entry[1], dict(labels), entry[2])
+                      for (name, labels), entry in self.values_.items()]
+        samples = pushed
+        errors = 0
+        for collector in list(self.collectors):
+            try:
+                samples.extend(collector())
+            except Exception:
+                errors += 1
+        samples.append(('pyro_collector_errors', 'gauge',
+                        'Collectors that failed in this scrape.', {},
+                        errors))
+        return samples
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format.
+        """
+        families = {}
+        order = []
+        for name, metric_type, doc, labels, value in self._samples():
+            family = name
+            if metric_type == 'summary':
+                family = name.rsplit('_', 1)[0]
+            if family not in families:
+                families[family] = (metric_type, doc, [])
+                order.append(family)
+            families[family][2].append(
+                '{}{} {}'.format(name, _format_labels(labels),
+                                 _format_value(value)))
+        lines = []
+        for family in order:
+            metric_type, doc, family_lines = families[family]
+            if doc:
+                lines.append('# HELP {} {}'.format(
+                    family, doc.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE {} {}'.format(family, metric_type))
+            lines.extend(family_lines)
+        return '\n'.join(lines) + '\n'
+
+    @property
+    def url(self):
+        return 'http://{}:{}/metrics'.format(self.host, self.port)
+
+    def start(self):
+        """Starts serving in a daemon thread.
+        """
+        self.server_ = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self.server_.daemon_threads = True
+        self.server_.metrics = self
+        self.port = self.server_.server_address[1]
+        self.thread_ = threading.Thread(target=self.server_.serve_forever)
+        self.thread_.daemon = True
+        self.thread_.start()
+
+    def stop(self):
+        if self.server_:
+            self.server_.shutdown()
+            self.server_.server_close()
+            self.thread_.join()
+            self.server_ = None
+            self.thread_ = None
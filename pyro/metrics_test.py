@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.metrics
+"""
+
+from pyro import checkpoint, decorator, metrics, profiler
+from pyro.profiler_test import DISKSTATS_AFTER, DISKSTATS_BEFORE, \
+    LOCKSTAT_SNAPSHOTS
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+
+class TestMetricsServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = metrics.MetricsServer()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as fobj:
+            fobj.write(content)
+        return path
+
+    def scrape(self):
+        response = urllib.request.urlopen(self.server.url, timeout=10)
+        self.assertEqual(metrics.CONTENT_TYPE,
+                         response.headers['Content-Type'])
+        return response.read().decode('utf-8')
+
+    def test_render(self):
+        self.server.set('pyro_temperature', float('nan'),
+                        {'sensor': 'a "b"\n'}, 'A gauge.')
+        self.server.inc('pyro_runs', labels={'fs': 'ext4'})
+        self.server.inc('pyro_runs', 2, {'fs': 'ext4'})
+        text = self.server.render()
+        self.assertTrue('# HELP pyro_temperature A gauge.\n'
+                        '# TYPE pyro_temperature gauge\n'
+                        'pyro_temperature{sensor="a \\"b\\"\\n"} NaN\n'
+                        in text)
+        self.assertTrue('# TYPE pyro_runs counter\n'
+                        'pyro_runs{fs="ext4"} 3.0\n' in text)
+        self.assertTrue('pyro_collector_errors 0.0' in text)
+
+    def test_scrape_profilers(self):
+        disk = profiler.DiskStatsProfiler(
+            ['sda'], diskstats=self.write('diskstats', DISKSTATS_BEFORE))
+        disk.sample(now=10.0)
+        self.write('diskstats', DISKSTATS_AFTER)
+        disk.sample(now=12.0)
+        lockstat = profiler.LockstatProfiler(interval=1)
+        for i, snapshot in enumerate(LOCKSTAT_SNAPSHOTS):
+            lockstat.series.add(float(i), snapshot)
+        chk = checkpoint.Checkpoint(os.path.join(self.tmpdir, 'chk.log'))
+        chk.done()
+        chk.done()
+
+        self.server.add_profiler(disk, 'disk')
+        self.server.add_profiler(lockstat, 'lock')
+        self.server.add_checkpoint(chk, total=5)
+        self.server.add_collector(metrics.cpu_collector(self.write(
+            'stat', 'cpu  100 0 50 1000 0 0 0 0 0 0\n')))
+        self.server.start()
+
+        text = self.scrape()
+        self.assertTrue('# TYPE pyro_disk_r_iops gauge\n'
+                        'pyro_disk_r_iops{device="sda",profiler="disk"} '
+                        '50.0\n' in text)
+        self.assertTrue('pyro_lockstat_contentions{class="&rq->lock",'
+                        'profiler="lock"} 5.0\n' in text)
+        self.assertTrue('pyro_checkpoint_steps_done 2.0\n' in text)
+        self.assertTrue('pyro_checkpoint_steps 5.0\n' in text)
+        ticks = float(os.sysconf('SC_CLK_TCK'))
+        self.assertTrue('pyro_cpu_seconds_total{{mode="user"}} {}\n'.format(
+            100 / ticks) in text)
+
+        # The next scrape sees new samples.
+        self.write('diskstats', DISKSTATS_BEFORE.replace('1000', '1400'))
+        disk.sample(now=13.0)
+        self.assertTrue('pyro_disk_r_iops{device="sda",profiler="disk"} '
+                        '300.0\n' in self.scrape())
+
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(self.server.url.replace(
+                '/metrics', '/other'), timeout=10)
+
+    def test_failing_collector(self):
+        def _broken():
+            raise IOError('gone')
+        self.server.add_collector(_broken)
+        self.assertTrue('pyro_collector_errors 1.0' in self.server.render())
+
+    def test_benchmark_iterations(self):
+        @decorator.benchmark(times=3, silence=True, metrics=self.server)
+        def nothing():
+            pass
+
+        nothing()
+        text = self.server.render()
+        self.assertTrue('# TYPE pyro_benchmark_iteration_seconds summary\n'
+                        'pyro_benchmark_iteration_seconds_count'
+                        '{benchmark="nothing"} 3.0\n' in text)
+        self.assertTrue('pyro_benchmark_iteration_seconds_sum'
+                        '{benchmark="nothing"}' in text)
+        self.assertTrue('pyro_benchmark_iteration_seconds_last'
+                        '{benchmark="nothing"}' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,11 +7,13 @@
 """
 
 from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import glob
 import os
 import platform
 import sys
-from subprocess import check_call
+import time
+from subprocess import CalledProcessError, PIPE, Popen, check_call
 
 
 def check_root_or_exit(exit_value=0):
@@ -42,6 +44,33 @@ def clear_cache():
     check_call('echo 3 > /proc/sys/vm/drop_caches', shell=True)
 
 
+class BatchError(RuntimeError):
+    """Some operations of a batch have failed.
+
+    @param errors {device or mount point: exception}
+    """
+    def __init__(self, message, errors):
+        super(BatchError, self).__init__('{}: {}'.format(message, ', '.join(
+            '{} ({})'.format(key, err) for key, err in sorted(
+                errors.items()))))
+        self.errors = errors
+
+
+# The default number of concurrent operations of mount_all() and umount_all().
+MAX_WORKERS = 16
+
+
+def _run(args):
+    """Runs a command without a shell and raises CalledProcessError with its
+    output if it fails.
+    """
+    proc = Popen(args, stdout=PIPE, stderr=PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise CalledProcessError(proc.returncode, args, stdout, stderr)
+    return stdout
+
+
 def mount(dev, mnt, **kwargs):
     """make a file system on a disk and then mount it
 
@@ -57,28 +86,104 @@ def mount(dev, mnt, **kwargs):
     no_journal = kwargs.get('no_journal', False)
     options = kwargs.get('options', '')
     if fs_format == 'xfs' or fs_format == 'btrfs':
-        check_call("mkfs.{} -f {}".format(fs_format, dev), shell=True)
+        _run(['mkfs.{}'.format(fs_format), '-f', dev])
     else:
-        check_call("mkfs.{} {}".format(fs_format, dev), shell=True)
+        _run(['mkfs.{}'.format(fs_format), dev])
         if no_journal and fs_format == 'ext4':
-            check_call('tune2fs -O ^has_journal {}'.format(dev), shell=True)
+            _run(['tune2fs', '-O', '^has_journal', dev])
 
-    opt_param = ''
+    opt_param = []
     if options:
-        opt_param = '-o {}'.format(options)
+        opt_param = ['-o', options]
+
+    _run(['mount', '-t', fs_format] + opt_param + [dev, mnt])
 
-    check_call("mount -t %s %s %s %s" % (fs_format, opt_param, dev, mnt),
-               shell=True)
 
+def _run_batch(func, items, workers, message):
+    """Calls func(item) for all items in a thread pool, and raises a
+    BatchError with the errors of all failed items.
+    """
+    items = list(items)
+    if not items:
+        return
+    errors = {}
+    with ThreadPoolExecutor(max(1, min(workers, len(items)))) as executor:
+        futures = dict((executor.submit(func, item), item) for item in items)
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as err:
+                item = futures[future]
+                errors[item[0] if type(item) == tuple else item] = err
+    if errors:
+        raise BatchError(message, errors)
+
+
+def mount_all(devices, **kwargs):
+    """Makes file systems on many devices and mounts them concurrently.
+
+    All devices are attempted even if some of them fail.
+
+    @param devices a list of (device, mount point) or a dict {device: mount
+    point}.
+
+    Optional parameters:
+    @param workers the maximal number of devices prepared at the same time
+    (default: MAX_WORKERS).
+    @param format, no_journal, options see mount().
+    @raise BatchError with the error of each failed device.
+    """
+    if type(devices) == dict:
+        devices = sorted(devices.items())
+    workers = kwargs.pop('workers', MAX_WORKERS)
+    _run_batch(lambda item: mount(item[0], item[1], **kwargs), devices,
+               workers, 'Failed to mount')
+
+
+def umount(mnt, retries=0, retry_delay=1.0):
+    """Unmounts a file system, retrying if it is busy.
+
+    @param mnt the mount point.
+    @param retries the number of retries when the target is busy.
+    @param retry_delay the seconds to wait before each retry.
+    """
+    for attempt in range(retries + 1):
+        try:
+            _run(['umount', mnt])
+            return
+        except CalledProcessError as err:
+            if attempt == retries or b'busy' not in (err.stderr or b''):
+                raise
+        time.sleep(retry_delay)
+
+
+def umount_batch(mount_points, **kwargs):
+    """Unmounts many file systems concurrently.
+
+    All mount points are attempted even if some of them fail.
+
+    Optional parameters:
+    @param workers the maximal number of concurrent umounts (default:
+    MAX_WORKERS).
+    @param retries, retry_delay see umount() (default: 3 retries after 1
+    second).
+    @raise BatchError with the error of each mount point that fails.
+    """
+    retries = kwargs.get('retries', 3)
+    retry_delay = kwargs.get('retry_delay', 1.0)
+    _run_batch(lambda mnt: umount(mnt, retries, retry_delay), mount_points,
+               kwargs.get('workers', MAX_WORKERS), 'Failed to umount')
 
-def umount_all(root_path):
+
+def umount_all(root_path, **kwargs):
     """Unmount all subdirectories under a given root path
+
+    Optional parameters:
+    @param workers, retries, retry_delay see umount_batch().
     """
-    subdirs = os.listdir(root_path)
-    for sub in subdirs:
-        sub_dir_path = os.path.join(root_path, sub)
-        if os.path.ismount(sub_dir_path):
-            check_call("umount %s" % sub_dir_path, shell=True)
+    mounts = [os.path.join(root_path, sub) for sub in
+              sorted(os.listdir(root_path))]
+    umount_batch([mnt for mnt in mounts if os.path.ismount(mnt)], **kwargs)
 
 
 def parse_cpus(cores):
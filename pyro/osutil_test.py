@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.osutil
+"""
+
+from pyro import osutil
+from unittest import mock
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# A stand-in of mkfs.*, tune2fs, mount and umount. It logs its arguments and
+# the time it ran. mkfs takes 0.2 seconds and fails on devices named 'bad'.
+# umount fails as busy on mount points named 'busy' for the first
+# FAKE_BUSY_TIMES calls.
+FAKE_COMMAND = """\
+#!{python}
+import os
+import sys
+import time
+
+name = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+start = time.time()
+status = 0
+if name.startswith('mkfs.'):
+    time.sleep(0.2)
+    if 'bad' in args[-1]:
+        sys.stderr.write('mkfs: can not open ' + args[-1] + '\\n')
+        status = 1
+elif name == 'umount' and 'busy' in args[-1]:
+    counter = os.path.join(os.environ['FAKE_STATE'], 'busy')
+    calls = int(open(counter).read()) if os.path.exists(counter) else 0
+    with open(counter, 'w') as fobj:
+        fobj.write(str(calls + 1))
+    if calls < int(os.environ['FAKE_BUSY_TIMES']):
+        sys.stderr.write('umount: ' + args[-1] + ': target is busy.\\n')
+        status = 32
+with open(os.environ['FAKE_LOG'], 'a') as fobj:
+    fobj.write('{{}}\\t{{}}\\t{{}}\\t{{}}\\t{{}}\\n'.format(
+        name, ' '.join(args), start, time.time(), status))
+sys.exit(status)
+"""
+
+
+class TestBatchMount(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        bindir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(bindir)
+        for name in ['mkfs.ext4', 'mkfs.xfs', 'tune2fs', 'mount', 'umount']:
+            path = os.path.join(bindir, name)
+            with open(path, 'w') as fobj:
+                fobj.write(FAKE_COMMAND.format(python=sys.executable))
+            os.chmod(path, 0o755)
+        self.log = os.path.join(self.tmpdir, 'log')
+        self.environ = mock.patch.dict(os.environ, {
+            'PATH': bindir + os.pathsep + os.environ.get('PATH', ''),
+            'FAKE_LOG': self.log, 'FAKE_STATE': self.tmpdir,
+            'FAKE_BUSY_TIMES': '2'})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def read_log(self):
+        """Returns [(command, args, start, end, status)].
+        """
+        with open(self.log) as fobj:
+            return [(name, args, float(start), float(end), int(status))
+                    for name, args, start, end, status in
+                    (line.rstrip('\n').split('\t') for line in fobj)]
+
+    def max_concurrency(self, command):
+        events = []
+        for name, _, start, end, _ in self.read_log():
+            if name == command:
+                events.extend([(start, 1), (end, -1)])
+        running = highest = 0
+        for _, delta in sorted(events):
+            running += delta
+            highest = max(highest, running)
+        return highest
+
+    def test_mount_all(self):
+        devices = dict(('/dev/sd' + c, '/mnt/sd' + c) for c in 'abcd')
+        osutil.mount_all(devices, no_journal=True, options='noatime')
+        log = self.read_log()
+        self.assertEqual(4, len([row for row in log
+                                 if row[0] == 'mkfs.ext4']))
+        self.assertTrue(('tune2fs', '-O ^has_journal /dev/sda')
+                        in [row[:2] for row in log])
+        self.assertTrue(('mount', '-t ext4 -o noatime /dev/sdb /mnt/sdb')
+                        in [row[:2] for row in log])
+        self.assertTrue(self.max_concurrency('mkfs.ext4') > 1)
+
+    def test_bounded_workers(self):
+        devices = [('/dev/sd' + c, '/mnt/sd' + c) for c in 'abcd']
+        osutil.mount_all(devices, format='xfs', workers=2)
+        self.assertEqual(2, self.max_concurrency('mkfs.xfs'))
+        self.assertTrue(('mkfs.xfs', '-f /dev/sdc')
+                        in [row[:2] for row in self.read_log()])
+
+    def test_device_errors(self):
+        devices = [('/dev/sda', '/mnt/a'), ('/dev/bad', '/mnt/b')]
+        with self.assertRaises(osutil.BatchError) as context:
+            osutil.mount_all(devices)
+        errors = context.exception.errors
+        self.assertEqual(['/dev/bad'], list(errors))
+        self.assertTrue(b'can not open /dev/bad' in errors['/dev/bad'].stderr)
+        # The other device is still mounted.
+        self.assertTrue(('mount', '-t ext4 /dev/sda /mnt/a')
+                        in [row[:2] for row in self.read_log()])
+
+    def test_umount_busy(self):
+        osutil.umount_batch(['/mnt/a', '/mnt/busy'], retries=3,
+                            retry_delay=0.01)
+        umounts = [row for row in self.read_log() if row[0] == 'umount']
+        self.assertEqual([32, 32, 0], [row[4] for row in umounts
+                                       if row[1] == '/mnt/busy'])
+        self.assertEqual([0], [row[4] for row in umounts
+                               if row[1] == '/mnt/a'])
+
+    def test_umount_busy_too_long(self):
+        with self.assertRaises(osutil.BatchError) as context:
+            osutil.umount_batch(['/mnt/busy'], retries=1, retry_delay=0.01)
+        self.assertEqual(['/mnt/busy'], list(context.exception.errors))
+
+    def test_umount_all(self):
+        root = os.path.join(self.tmpdir, 'mnt')
+        for name in ['a', 'b', 'not-mounted']:
+            os.makedirs(os.path.join(root, name))
+        with mock.patch('os.path.ismount',
+                        lambda path: not path.endswith('not-mounted')):
+            osutil.umount_all(root)
+        self.assertEqual(
+            [os.path.join(root, 'a'), os.path.join(root, 'b')],
+            sorted(row[1] for row in self.read_log()))
+
+
+if __name__ == '__main__':
+    unittest.main()
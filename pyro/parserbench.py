@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Benchmarks of pyro's own parsers and analysis functions.
+
+It measures the throughput and the peak (Python) memory of each parser on
+synthetic inputs from pyro.synthetic, and stores the results as JSON so that
+they can be compared across commits.
+
+Usage:
+    python -m pyro.parserbench --sizes 1K,1M,100M -o results.json
+    python -m pyro.parserbench --sizes 1M --compare results.json
+"""
+
+from __future__ import print_function
+from pyro import callgraph, flamegraph, lockstat, perftest, synthetic
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The approximate size of one value in the inputs of analysis functions, used
+# to convert a size in bytes to a number of values.
+ANALYSIS_VALUE_SIZE = 64
+
+# {name: (generator, parser)}. The generator writes a synthetic input file.
+FILE_BENCHMARKS = {
+    'lockstat': (synthetic.generate_lockstat, perftest.parse_lockstat_data),
+    'lockstat_callsites': (synthetic.generate_lockstat,
+                           lockstat.parse_lockstat_callsites),
+    'perf': (synthetic.generate_perf_report, perftest.parse_perf_data),
+    'oprofile': (synthetic.generate_oprofile, perftest.parse_oprofile_data),
+    'oprofile_callgraph': (synthetic.generate_oprofile,
+                           callgraph.parse_oprofile_callgraph),
+    'perf_script': (synthetic.generate_perf_script,
+                    flamegraph.parse_perf_script),
+    'postmark': (synthetic.generate_postmark, perftest.parse_postmark_data),
+    'postmark_per_line': (
+        synthetic.generate_postmark,
+        lambda path: scan_per_line(perftest.POSTMARK_PARSER, path)),
+}
+
+# {name: function}. The parsers of these benchmarks only return part of the
+# records of their inputs, e.g. the top N entries of each event of perf, so
+# the records of a benchmark are counted in the result of the parser instead
+# of the generated input. The function returns that count.
+PARSED_RECORDS = {
+    'perf': lambda data: sum(len(entries) for entries in data.values()),
+}
+
+# {name: (generator, function)}. The generator builds an in-memory input from
+# a number of values.
+ANALYSIS_BENCHMARKS = {
+    'top_curves': (
+        lambda n, seed: synthetic.generate_top_data(max(1, n // 7), seed),
+        lambda data: perftest.trans_top_data_to_curves(data, show_all=True)),
+    'result_collect': (
+        synthetic.generate_result_tree,
+        lambda result: result.collect()),
+}
+
+
+def scan_per_line(parser, filename):
+    """The baseline of a logparser.LogParser: searches each line with every
+    field pattern separately, as hand-written parsers do. It is kept to
+    measure the speedup of the single pass scan.
+    """
+    result = {}
+    with open(filename) as fobj:
+        for line in fobj:
+            for field in parser.fields:
+                matched = re.search(field.pattern, line)
+                if matched:
+                    result[field.name] = field.convert(
+                        matched.group('value'),
+                        matched.group('unit') if field.units else None)
+    return result
+
+
+def parse_size(size):
+    """Parses a size string like '1K', '10M' or '1G' into bytes.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def _measure(func, arg, repeat, memory):
+    """Returns the best wall time of func(arg), its peak traced memory and
+    the result of the last run.
+    """
+    best = float('inf')
+    output = None
+    for _ in range(repeat):
+        start = time.time()
+        output = func(arg)
+        best = min(best, time.time() - start)
+    peak = None
+    if memory:
+        # Tracing slows down the parser, so it is a separate run.
+        tracemalloc.start()
+        func(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak, output
+
+
+def run_benchmark(name, size, **kwargs):
+    """Runs one benchmark on a synthetic input.
+
+    @param name the name of a benchmark in FILE_BENCHMARKS or
+    ANALYSIS_BENCHMARKS.
+    @param size the input size in bytes.
+
+    Optional parameters:
+    @param seed the seed of the generator (default: 0).
+    @param repeat run the parser several times and keep the best (default: 3).
+    @param memory measure the peak memory (default: True).
+    @param workdir the directory of generated inputs (default: a temporary
+    directory, removed afterwards).
+    @return a dict of the results.
+    """
+    seed = kwargs.get('seed', 0)
+    repeat = kwargs.get('repeat', 3)
+    memory = kwargs.get('memory', True)
+    workdir = kwargs.get('workdir', None)
+
+    result = {'name': name, 'size': size, 'seed': seed}
+    if name in FILE_BENCHMARKS:
+        generate, parse = FILE_BENCHMARKS[name]
+        tmpdir = workdir or tempfile.mkdtemp(prefix='pyro-bench-')
+        try:
+            path = os.path.join(tmpdir, '{}-{}-{}.txt'.format(
+                name, size, seed))
+            with open(path, 'w') as fobj:
+                records = generate(fobj, size, seed)
+            nbytes = os.path.getsize(path)
+            seconds, peak, output = _measure(parse, path, repeat, memory)
+            if name in PARSED_RECORDS:
+                records = PARSED_RECORDS[name](output)
+        finally:
+            if not workdir:
+                shutil.rmtree(tmpdir)
+    elif name in ANALYSIS_BENCHMARKS:
+        generate, func = ANALYSIS_BENCHMARKS[name]
+        records = max(1, size // ANALYSIS_VALUE_SIZE)
+        data = generate(records, seed)
+        nbytes = None
+        seconds, peak, _ = _measure(func, data, repeat, memory)
+    else:
+        raise ValueError('Unknown benchmark: {}'.format(name))
+
+    result['bytes'] = nbytes
+    result['records'] = records
+    result['seconds'] = seconds
+    result['records_per_sec'] = records / seconds if seconds else None
+    result['mb_per_sec'] = nbytes / seconds / 1024 ** 2 \
+        if nbytes and seconds else None
+    result['peak_memory'] = peak
+    return result
+
+
+def _git_commit():
+    """Returns the current git commit of pyro, or None.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(names, sizes, **kwargs):
+    """Runs benchmarks for each name and size.
+
+    @return a dict with the environment ('commit', 'python', 'time') and the
+    list of results in 'results'.
+    """
+    results = []
+    for name in names:
+        for size in sizes:
+            results.append(run_benchmark(name, size, **kwargs))
+    return {'commit': _git_commit(), 'python': platform.python_version(),
+            'time': time.time(), 'results': results}
+
+
+def compare(old, new):
+    """Compares two outputs of run_all().
+
+    @return {(name, size): speedup of new over old}
+    """
+    old_seconds = dict(((r['name'], r['size']), r['seconds'])
+                       for r in old['results'])
+    speedups = {}
+    for res in new['results']:
+        key = (res['name'], res['size'])
+        if key in old_seconds and res['seconds']:
+            speedups[key] = old_seconds[key] / res['seconds']
+    return speedups
+
+
+def format_result(result):
+    """Formats one benchmark result as a line.
+    """
+    line = '{:<20} {:>12} {:>10.4f}s {:>14.1f} rec/s'.format(
+        result['name'], result['size'], result['seconds'],
+        result['records_per_sec'] or 0)
+    if result['mb_per_sec'] is not None:
+        line += ' {:>10.2f} MB/s'.format(result['mb_per_sec'])
+    if result['peak_memory'] is not None:
+        line += ' peak {:>10.2f} MB'.format(
+            result['peak_memory'] / 1024.0 ** 2)
+    return line
+
+
+def main(argv=None):
+    all_names = sorted(FILE_BENCHMARKS) + sorted(ANALYSIS_BENCHMARKS)
+    parser = argparse.ArgumentParser(
+        description='Benchmark the parsers and analysis functions of pyro.')
+    parser.add_argument('-s', '--sizes', default='1K,1M',
+                        help='comma-separated input sizes, e.g. 1K,1M,1G')
+    parser.add_argument('-b', '--benchmarks', default=','.join(all_names),
+                        help='comma-separated benchmarks ({})'.format(
+                            ', '.join(all_names)))
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure the peak memory')
+    parser.add_argument('-o', '--output', help='write results to a JSON file')
+    parser.add_argument('-c', '--compare',
+                        help='compare with a previous JSON result file')
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    names = args.benchmarks.split(',')
+    for name in names:
+        if name not in all_names:
+            parser.error('unknown benchmark: {}'.format(name))
+    output = run_all(names, sizes, seed=args.seed, repeat=args.repeat,
+                     memory=not args.no_memory)
+    for result in output['results']:
+        print(format_result(result))
+    if args.output:
+        with open(args.output, 'w') as fobj:
+            json.dump(output, fobj, indent=2)
+    if args.compare:
+        with open(args.compare) as fobj:
+            old = json.load(fobj)
+        for (name, size), speedup in sorted(compare(old, output).items()):
+            print('{:<20} {:>12} speedup {:.2f}x'.format(name, size, speedup))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,7 +11,7 @@ import platform
 import re
 import sys
 
-from pyro import osutil
+from pyro import inputs, logparser, osutil
 from pyro.analysis import are_all_zeros, sorted_by_value
 import pyro.plot as mfsplot
 
@@ -38,54 +38,51 @@ def clear_cache():
 
 def parse_procstat_data(filename):
     """ parse /proc/stat data, return system time, user time, etc.
-    @param filename
+    @param filename a path or another source of inputs.lines()
     @return delta value of sys time, user time, iowait in a dict
     """
     real_time_ratio = 100
     result = {}
     temp = 0
     temp_before = {}
-    with open(filename) as fobj:
-        for line in fobj:
-            items = line.split()
-            if temp == 0:
-                temp_before['user'] = float(items[1])
-                temp_before['system'] = float(items[3])
-                temp_before['idle'] = float(items[4])
-                temp_before['iowait'] = float(items[5])
-                temp += 1
-            else:
-                result['user'] = (float(items[1]) - temp_before['user']) \
-                    * real_time_ratio
-                result['system'] = (float(items[3]) - temp_before['system'])\
-                    * real_time_ratio
-                result['idle'] = (float(items[4]) - temp_before['idle']) \
-                    * real_time_ratio
-                result['iowait'] = (float(items[5]) - temp_before['iowait'])\
-                    * real_time_ratio
+    for line in inputs.lines(filename):
+        items = line.split()
+        if temp == 0:
+            temp_before['user'] = float(items[1])
+            temp_before['system'] = float(items[3])
+            temp_before['idle'] = float(items[4])
+            temp_before['iowait'] = float(items[5])
+            temp += 1
+        else:
+            result['user'] = (float(items[1]) - temp_before['user']) \
+                * real_time_ratio
+            result['system'] = (float(items[3]) - temp_before['system']) \
+                * real_time_ratio
+            result['idle'] = (float(items[4]) - temp_before['idle']) \
+                * real_time_ratio
+            result['iowait'] = (float(items[5]) - temp_before['iowait']) \
+                * real_time_ratio
 
     return result
 
 
 def parse_lockstat_data(filepath):
     """
-    @param before_file
-    @param after_file
+    @param filepath a lock_stat file, or another source of inputs.lines()
     @return delta values of each lock contetions
     """
     def _fetch_data(fname):
         """Read a lock stat file and extract data
         """
         result = {}
-        with open(fname) as fobj:
-            for line in fobj:
-                match = re.match(r'.+:', line)
-                if match:
-                    last_colon = line.rfind(':')
-                    key = line[:last_colon].strip(' \t&()')
-                    values = line[last_colon + 1:].strip()
-                    result[key] = np.array(
-                        [float(x) for x in values.split()])
+        for line in inputs.lines(fname):
+            match = re.match(br'.+:', line)
+            if match:
+                last_colon = line.rfind(b':')
+                key = line[:last_colon].strip(b' \t&()').decode('utf-8')
+                values = line[last_colon + 1:].strip()
+                result[key] = np.array(
+                    [float(x) for x in values.split()])
         return result
 
     results = {}
@@ -107,34 +104,34 @@ def parse_lockstat_data(filepath):
 def parse_perf_data(filename, **kwargs):
     """Parses data from linux perf tool.
 
-    @param filename the perf output file path.
+    @param filename the perf output file path, or another source of
+    inputs.lines().
     """
     top = kwargs.get('top', 10)
     result = {}
-    with open(filename) as fobj:
-        k = top
-        event = None
-        event_result = []
-        for line in fobj:
-            line = line.strip()
-            if not event:
-                if re.match(r'^# Samples:.*', line):
-                    # print('matched: {}'.format(line))
-                    event_name = line.split()[-1]
-                    event = event_name.strip("'")
-                continue
-            if event and line[0] == '#':
-                continue
-            fields = line.split()
-            percent = float(fields[0][:-1]) / 100
-            event_result.append((percent, fields[1], fields[-1]))
-            k -= 1
-            if not k:
-                result[event] = event_result
-                event_result = []
-                event = None
-                k = top
-                continue
+    k = top
+    event = None
+    event_result = []
+    for line in inputs.lines(filename):
+        line = line.strip()
+        if not event:
+            if re.match(br'^# Samples:.*', line):
+                event_name = line.split()[-1].decode('utf-8')
+                event = event_name.strip("'")
+            continue
+        if not line or line[:1] == b'#':
+            continue
+        fields = line.split()
+        percent = float(fields[0][:-1]) / 100
+        event_result.append((percent, fields[1].decode('utf-8'),
+                             fields[-1].decode('utf-8')))
+        k -= 1
+        if not k:
+            result[event] = event_result
+            event_result = []
+            event = None
+            k = top
+            continue
     return result
 
 
@@ -203,66 +200,55 @@ def plot_top_perf_functions(data, event, top_n, outfile, **kwargs):
 
 def parse_oprofile_data(filename):
     """Parse data from oprofile output
+
+    @param filename a path or another source of inputs.lines()
     """
     result = {}
-    with open(filename) as fobj:
-        events = []
-        for line in fobj:
-            if re.match('^[0-9]+', line):
-                data = line.split()
-                symname = data[-1]
-                result[symname] = {}
-                for i in xrange(len(events)):
-                    evt = events[i]
-                    abs_value = int(data[i * 2])
-                    percent = float(data[i * 2 + 1])
-                    result[symname][evt] = {
-                        'count': abs_value,
-                        '%': percent
-                    }
-                continue
-            if re.match('^Counted', line):
-                events.append(line.split()[1])
-                continue
+    events = []
+    for line in inputs.lines(filename):
+        if re.match(b'^[0-9]+', line):
+            data = line.split()
+            symname = data[-1].decode('utf-8')
+            result[symname] = {}
+            for i in range(len(events)):
+                evt = events[i]
+                abs_value = int(data[i * 2])
+                percent = float(data[i * 2 + 1])
+                result[symname][evt] = {
+                    'count': abs_value,
+                    '%': percent
+                }
+            continue
+        if re.match(b'^Counted', line):
+            events.append(line.split()[1].decode('utf-8'))
+            continue
     return result
 
 
+POSTMARK_PARSER = logparser.register(logparser.LogParser('postmark', [
+    logparser.Field(
+        'deletion',
+        r'Deletion alone: [0-9]+ files \((?P<value>[0-9]+) per second\)'),
+    logparser.Field(
+        'creation',
+        r'Creation alone: [0-9]+ files \((?P<value>[0-9]+) per second\)'),
+    logparser.Field(
+        'read', r'[0-9\.]+ [a-z]+ read \((?P<value>[0-9\.]+) '
+        r'(?P<unit>[a-z]+) per second\)', units=logparser.SIZE_UNITS_KB),
+    logparser.Field(
+        'write', r'[0-9\.]+ [a-z]+ written \((?P<value>[0-9\.]+) '
+        r'(?P<unit>[a-z]+) per second\)', units=logparser.SIZE_UNITS_KB),
+]))
+
+
 def parse_postmark_data(filename):
     """Parse postmark result data
+
+    @param filename a path or another source of inputs.blocks()
+    @return {'creation': files/s, 'deletion': files/s, 'read': KB/s,
+    'write': KB/s}
     """
-    result = {}
-    with open(filename) as fobj:
-        for line in fobj:
-            matched = re.search(
-                r'Deletion alone: [0-9]+ files \(([0-9]+) per second\)', line)
-            if matched:
-                result['deletion'] = float(matched.group(1))
-
-            matched = re.search(
-                r'Creation alone: [0-9]+ files \(([0-9]+) per second\)', line)
-            if matched:
-                result['creation'] = float(matched.group(1))
-
-            matched = re.search(
-                r'[0-9\.]+ [a-z]+ read \(([0-9\.]+) ([a-z]+) per second\)',
-                line)
-            if matched:
-                unit = matched.group(2)
-                read_speed = float(matched.group(1))
-                if unit == 'megabytes':
-                    read_speed *= 1024
-                result['read'] = read_speed
-
-            matched = re.search(
-                r'[0-9\.]+ [a-z]+ written \(([0-9\.]+) ([a-z]+) per second\)',
-                line)
-            if matched:
-                unit = matched.group(2)
-                write_speed = float(matched.group(1))
-                if unit == 'megabytes':
-                    write_speed *= 1024
-                result['write'] = write_speed
-    return result
+    return POSTMARK_PARSER.parse(filename)
 
 
 def get_top_n_funcs_in_oprofile(data, event, topn):
@@ -7,6 +7,9 @@
 """
 
 from pyro import perftest
+import gzip
+import io
+import lzma
 import unittest
 
 
@@ -29,6 +32,34 @@ class TestPerfTest(unittest.TestCase):
             self.assertTrue(curve in expected_curves)
         self.assertTrue(len(curves), len(expected_curves))
 
+    def test_parse_sources(self):
+        lockstat = (b'lock_stat version 0.3\n'
+                    b'   &(&sb->s_lock)->rlock:  1  10  0.1  1.0  20.0  5  '
+                    b'100  0.05  2.0  50.0\n')
+        expected = perftest.parse_lockstat_data(lockstat)
+        self.assertEqual(10, expected['sb->s_lock)->rlock']['contentions'])
+        self.assertEqual(expected, perftest.parse_lockstat_data(
+            gzip.compress(lockstat)))
+        self.assertEqual(expected, perftest.parse_lockstat_data(
+            io.BytesIO(lzma.compress(lockstat))))
+
+        perf = ('# Samples: 1K of event \'cycles\'\n#\n'
+                '    50.00%  postmark  [k] d_lookup\n'
+                '    20.00%  postmark  [k] memcpy\n')
+        self.assertEqual(
+            {'cycles': [(0.5, 'postmark', 'd_lookup'),
+                        (0.2, 'postmark', 'memcpy')]},
+            perftest.parse_perf_data(io.StringIO(perf), top=2))
+        self.assertEqual(
+            {'user': 1000.0, 'system': 500.0, 'idle': 0.0, 'iowait': 100.0},
+            perftest.parse_procstat_data(iter([
+                'cpu 10 0 5 100 1\n', 'cpu 20 0 10 100 2\n'])))
+        self.assertEqual(
+            {'read': 2.0, 'write': 1.0},
+            perftest.parse_postmark_data(gzip.compress(
+                b'\t2.00 kilobytes read (2.00 kilobytes per second)\n'
+                b'\t1.00 kilobytes written (1.00 kilobytes per second)\n')))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -37,6 +37,9 @@ def plot(curves, title, xlabel, ylabel, outfile, **kwargs):
     """A generic function to plot curves
 
     @param curves a list of curves. [ (xvalues, yvalues, label), ... ]
+    A curve can have error bars as its fourth item: (xvalues, yvalues, label,
+    yerr), where yerr is a list of symmetric errors or [lower, upper] lists
+    (e.g. from stats.GroupedSamples.errorbars()).
     @param title graph title
     @param xlabel x-axes label
     @param ylabel y-axes label
@@ -67,13 +70,17 @@ def plot(curves, title, xlabel, ylabel, outfile, **kwargs):
 
     plt.figure()
     style_iterator = line_style_iterator()
-    for xvalues, yvalues, label in curves:
+    for curve in curves:
+        xvalues, yvalues, label = curve[:3]
+        options = {'label': label}
         if color_theme == 'black':
             style, marker = style_iterator.__next__()
-            plt.plot(xvalues, yvalues, label=label, color='k', ls=style,
-                     marker=marker)
+            options.update(color='k', ls=style, marker=marker)
+        if len(curve) > 3:
+            plt.errorbar(xvalues, yvalues, yerr=curve[3], capsize=3,
+                         **options)
         else:
-            plt.plot(xvalues, yvalues, label=label)
+            plt.plot(xvalues, yvalues, **options)
 
     plt.title(title)
     plt.xlabel(xlabel)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Compares perf/oprofile profiles across configurations, e.g. core counts or
+kernels, to find the symbols that grow the most.
+
+Usage:
+>>> profiles = {8: parse_perf_data('perf-8.txt'),
+...             64: parse_perf_data('perf-64.txt')}
+>>> diff = align_profiles(profiles, 'cycles')
+>>> diff.rank(by='absolute', topn=5)
+>>> plot.plot(diff.curves(topn=5), 'cycles', '# of Cores', 'Samples', 'a.pdf')
+"""
+
+import numbers
+import numpy as np
+
+
+def profile_values(profile, event, field='%'):
+    """Extracts {symbol: value} of one event from a parsed profile.
+
+    @param profile the output of perftest.parse_perf_data() or
+    perftest.parse_oprofile_data(), or already a {symbol: value} dict.
+    @param event the event name. It is ignored for {symbol: value} dicts.
+    @param field for oprofile data, use '%' (default) or 'count'.
+    """
+    if any(type(value) == list for value in profile.values()):
+        # perf: {event: [(percent, command, symbol), ...]}
+        values = {}
+        for percent, _, symbol in profile.get(event, []):
+            values[symbol] = values.get(symbol, 0) + percent
+        return values
+    values = {}
+    for symbol, value in profile.items():
+        if type(value) == dict:
+            # oprofile: {symbol: {event: {'count': N, '%': P}}}
+            if event in value:
+                values[symbol] = value[event][field]
+        else:
+            values[symbol] = value
+    return values
+
+
+class ProfileMatrix(object):
+    """Values of symbols aligned across profiles.
+
+    @param labels the label of each profile, e.g. the number of cores.
+    @param symbols the symbol of each column.
+    @param values an array of shape (profiles, symbols). Symbols that do not
+    occur in a profile are 0.
+    """
+    def __init__(self, labels, symbols, values):
+        self.labels = list(labels)
+        self.symbols = list(symbols)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    def xvalues(self):
+        """Returns the labels as numbers, or their positions if the labels are
+        not numeric (e.g. kernel versions).
+        """
+        if all(isinstance(label, numbers.Number) for label in self.labels):
+            return np.array(self.labels, dtype=np.float64)
+        return np.arange(len(self.labels), dtype=np.float64)
+
+    def absolute_deltas(self, base=0, target=-1):
+        """Returns target - base for each symbol.
+
+        @param base the index of the base profile (default: the first).
+        @param target the index of the target profile (default: the last).
+        """
+        return self.values[target] - self.values[base]
+
+    def relative_deltas(self, base=0, target=-1):
+        """Returns (target - base) / base for each symbol. It is inf for the
+        symbols that do not occur in the base profile.
+        """
+        base_values = self.values[base]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            deltas = self.absolute_deltas(base, target) / base_values
+        deltas[(base_values == 0) & (self.values[target] == 0)] = 0
+        return deltas
+
+    def slopes(self, logx=False):
+        """Returns the least-squares slope of each symbol's value against the
+        labels, fitted for all symbols at once.
+
+        @param logx sets to True to fit against log2(labels), so that doubling
+        the cores counts as one step.
+        """
+        xvalues = self.xvalues()
+        if logx:
+            xvalues = np.log2(xvalues)
+        xvalues = xvalues - xvalues.mean()
+        denominator = np.dot(xvalues, xvalues)
+        if not denominator:
+            return np.zeros(len(self.symbols))
+        centered = self.values - self.values.mean(axis=0)
+        return np.dot(xvalues, centered) / denominator
+
+    def rank(self, by='slope', topn=10, **kwargs):
+        """Ranks the symbols that grow the fastest.
+
+        @param by 'slope', 'absolute' or 'relative'.
+        @param topn returns the top N symbols (all if it is 0).
+
+        Optional parameters:
+        @param logx see slopes().
+        @param base, target see absolute_deltas().
+        @return [(symbol, score), ...] in descending order of the score.
+        """
+        if by == 'slope':
+            scores = self.slopes(kwargs.get('logx', False))
+        elif by == 'absolute':
+            scores = self.absolute_deltas(kwargs.get('base', 0),
+                                          kwargs.get('target', -1))
+        elif by == 'relative':
+            scores = self.relative_deltas(kwargs.get('base', 0),
+                                          kwargs.get('target', -1))
+        else:
+            raise ValueError('Unknown ranking: {}'.format(by))
+        order = np.argsort(-scores, kind='stable')
+        if topn:
+            order = order[:topn]
+        return [(self.symbols[i], float(scores[i])) for i in order]
+
+    def curves(self, symbols=None, **kwargs):
+        """Returns curves that plot.plot() draws: [(labels, values, symbol)].
+
+        @param symbols the symbols to draw. If it is not given, draws the top
+        N symbols of rank(**kwargs).
+        """
+        if symbols is None:
+            symbols = [sym for sym, _ in self.rank(**kwargs)]
+        columns = dict((sym, i) for i, sym in enumerate(self.symbols))
+        return [(self.labels, self.values[:, columns[sym]].tolist(), sym)
+                for sym in symbols]
+
+
+def align_profiles(profiles, event=None, **kwargs):
+    """Aligns the symbols of several profiles into a ProfileMatrix.
+
+    @param profiles a dict {label: profile} (sorted by label), or a list of
+    profiles. Each profile is anything profile_values() accepts.
+    @param event the event name.
+
+    Optional parameters:
+    @param labels the labels of a list of profiles (default: 0, 1, ...).
+    @param field see profile_values().
+    """
+    field = kwargs.get('field', '%')
+    if type(profiles) == dict:
+        labels = sorted(profiles)
+        profiles = [profiles[label] for label in labels]
+    else:
+        labels = kwargs.get('labels', list(range(len(profiles))))
+    assert len(labels) == len(profiles)
+
+    per_profile = [profile_values(p, event, field) for p in profiles]
+    columns = {}
+    for values in per_profile:
+        for symbol in values:
+            if symbol not in columns:
+                columns[symbol] = len(columns)
+    matrix = np.zeros((len(profiles), len(columns)))
+    for row, values in enumerate(per_profile):
+        if values:
+            matrix[row, [columns[sym] for sym in values]] = \
+                list(values.values())
+    symbols = sorted(columns, key=columns.get)
+    return ProfileMatrix(labels, symbols, matrix)
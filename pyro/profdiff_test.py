@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.profdiff
+"""
+
+from pyro import profdiff
+import unittest
+
+PERF = {
+    8: {'cycles': [(0.30, 'postmark', 'ext4_write'),
+                   (0.10, 'postmark', '_raw_spin_lock'),
+                   (0.05, 'kworker', '_raw_spin_lock')]},
+    16: {'cycles': [(0.25, 'postmark', 'ext4_write'),
+                    (0.30, 'postmark', '_raw_spin_lock'),
+                    (0.05, 'postmark', 'dput')]},
+    64: {'cycles': [(0.10, 'postmark', 'ext4_write'),
+                    (0.60, 'postmark', '_raw_spin_lock'),
+                    (0.10, 'postmark', 'dput')]},
+}
+
+OPROFILE = [
+    {'sys_write': {'CYCLES': {'count': 100, '%': 10.0}},
+     'dput': {'CYCLES': {'count': 50, '%': 5.0}}},
+    {'sys_write': {'CYCLES': {'count': 100, '%': 8.0}},
+     'dput': {'CYCLES': {'count': 200, '%': 16.0}}},
+]
+
+
+class TestProfDiff(unittest.TestCase):
+    def test_align_perf(self):
+        diff = profdiff.align_profiles(PERF, 'cycles')
+        self.assertEqual([8, 16, 64], diff.labels)
+        self.assertEqual(['ext4_write', '_raw_spin_lock', 'dput'],
+                         diff.symbols)
+        self.assertAlmostEqual(0.15, diff.values[0, 1])
+        self.assertEqual(0, diff.values[0, 2])
+
+        deltas = diff.absolute_deltas()
+        self.assertAlmostEqual(-0.2, deltas[0])
+        self.assertAlmostEqual(0.45, deltas[1])
+        relative = diff.relative_deltas()
+        self.assertAlmostEqual(3.0, relative[1])
+        self.assertEqual(float('inf'), relative[2])
+
+        self.assertEqual('_raw_spin_lock', diff.rank(topn=1)[0][0])
+        self.assertEqual(['_raw_spin_lock', 'dput', 'ext4_write'],
+                         [sym for sym, _ in diff.rank(by='absolute')])
+        self.assertEqual('dput', diff.rank(by='relative')[0][0])
+
+    def test_slopes(self):
+        diff = profdiff.ProfileMatrix([1, 2, 4], ['a', 'b'],
+                                      [[1, 5], [2, 5], [3, 5]])
+        self.assertEqual([1.0, 0.0], list(diff.slopes(logx=True)))
+        diff = profdiff.ProfileMatrix([1, 2, 3], ['a', 'b'],
+                                      [[0, 6], [2, 4], [4, 2]])
+        self.assertEqual([2.0, -2.0], list(diff.slopes()))
+
+    def test_align_oprofile(self):
+        diff = profdiff.align_profiles(OPROFILE, 'CYCLES',
+                                       labels=['3.2', '3.14'], field='count')
+        self.assertEqual(['3.2', '3.14'], diff.labels)
+        self.assertEqual([('dput', 150.0)], diff.rank(topn=1))
+        self.assertEqual([0.0, 1.0], list(diff.xvalues()))
+
+    def test_curves(self):
+        diff = profdiff.align_profiles(PERF, 'cycles')
+        curves = diff.curves(topn=2, by='absolute')
+        self.assertEqual(2, len(curves))
+        labels, values, symbol = curves[0]
+        self.assertEqual([8, 16, 64], labels)
+        self.assertEqual('_raw_spin_lock', symbol)
+        self.assertEqual(3, len(values))
+        self.assertEqual([([8, 16, 64], [0.0, 0.05, 0.1], 'dput')],
+                         diff.curves(['dput']))
+
+
+if __name__ == '__main__':
+    unittest.main()
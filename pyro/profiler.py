@@ -6,8 +6,21 @@
 """
 
 from __future__ import print_function
-from subprocess import call, check_output
+from pyro import flamegraph, perftest, samplelog
+from subprocess import Popen, call, check_call, check_output
+import asyncio
+import concurrent.futures
+import functools
+import numpy as np
 import os
+import shlex
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 
 
 class Profiler(object):
@@ -28,6 +41,14 @@ class Profiler(object):
         """
         raise NotImplementedError
 
+    def results(self):
+        """Returns the results of profiling as data (dicts of numbers or
+        NumPy arrays), built from what the Profiler captured rather than by
+        parsing report(). Dumping the report is then only needed to keep the
+        raw output.
+        """
+        raise NotImplementedError
+
     def dump(self, outfile):
         """Dumps the report to the outfile.
         @param outfile it can be a file object or a string file path.
@@ -55,13 +76,425 @@ class NonProfiler(Profiler):
     def report(self):
         pass
 
+    def results(self):
+        return {}
+
+
+class SamplingProfiler(Profiler):
+    """The base of Profilers that periodically sample the system from a
+    background thread.
+
+    Subclasses implement sample(), which is called once at start(), every
+    'interval' seconds afterwards and once more at stop(). If a sample fails
+    in the background thread, sampling ends and stop() raises the error.
+
+    The samples are stored in a samplelog.SampleLog: each one is written
+    into a preallocated slot of its ring buffer, and the analysis reads them
+    back with samples(). The log is in memory unless a path is given, from
+    which from_log() restores the profiler, e.g. after the driver crashed.
+    Only the latest 'log_capacity' samples are kept.
+    """
+    # The default number of samples kept in the log.
+    LOG_CAPACITY = 1 << 16
+    # Whether CompositeProfiler can drive it with reset() and sample() only,
+    # without calling start() and stop().
+    SAMPLE_ONLY = True
+
+    def __init__(self, interval=1.0, **kwargs):
+        """@param interval the sampling interval in seconds.
+
+        Optional parameters:
+        @param log the path of the sample log, which is created at the first
+        sample (default: the samples are only kept in memory).
+        @param log_capacity the number of samples the log keeps (default:
+        LOG_CAPACITY).
+        """
+        self.interval = interval
+        self.thread_ = None
+        self.stop_event_ = threading.Event()
+        self.error_ = None
+        self.log_path = kwargs.get('log', '')
+        self.log_capacity = kwargs.get('log_capacity', self.LOG_CAPACITY)
+        self.log = None
+
+    def _log_meta(self):
+        """Returns the metadata of the log, which are passed to the
+        constructor by from_log().
+        """
+        return {}
+
+    def _create_log(self, fields):
+        """Creates the log of the samples.
+
+        @param fields the fields of the values of a sample besides 'time',
+        [(name, dtype, shape)].
+        """
+        self.log = samplelog.SampleLog(
+            self.log_path or None, [('time', np.float64)] + list(fields),
+            self.log_capacity, meta=self._log_meta())
+
+    def _store(self, now, values):
+        """Stores a sample whose values are one array. The log is created at
+        the first sample, with the shape and type of its values.
+        """
+        if self.log is None:
+            values = np.asarray(values)
+            self._create_log([('values', values.dtype, values.shape)])
+        self.log.append((now, values))
+
+    def samples(self, start=0):
+        """Returns the kept samples from the oldest to the latest.
+
+        @param start skips the samples before this sequence number.
+        @return a structured array with the field 'time' and the values of
+        the samples (e.g. 'values'). It is a copy, so it does not change
+        while sampling goes on.
+        """
+        if self.log is None:
+            return np.zeros(0, dtype=[('time', np.float64)])
+        return self.log.samples(start, copy=True)
+
+    def _latest_samples(self, count):
+        """Returns the last count samples, reading nothing else.
+        """
+        if self.log is None:
+            return self.samples()
+        return self.samples(max(0, self.log.count - count))
+
+    def _restore(self, log):
+        """Restores the state that is not in the samples from the log, e.g.
+        the names of the columns in its labels.
+        """
+        pass
+
+    @classmethod
+    def from_log(cls, path, **kwargs):
+        """Constructs a profiler that reads the samples of a log.
+
+        @param path the path of the log.
+        @param kwargs other parameters of the constructor.
+        """
+        log = samplelog.SampleLog(path)
+        params = dict(log.meta)
+        params.update(kwargs)
+        try:
+            prof = cls(**params)
+            prof.log = log
+            prof._restore(log)
+        except Exception:
+            log.close()
+            raise
+        return prof
+
+    def reset(self):
+        """Clears all samples.
+        """
+        self.close_log()
+
+    def sample(self, now=None):
+        """Takes one sample.
+
+        @param now the timestamp of this sample, defaults to time.time().
+        """
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            while not self.stop_event_.wait(self.interval):
+                self.sample()
+        except Exception as err:
+            self.error_ = err
+
+    def start(self):
+        """Takes the first sample and starts the sampling thread.
+        """
+        self.reset()
+        self.stop_event_.clear()
+        self.error_ = None
+        self.sample()
+        self.thread_ = threading.Thread(target=self._run)
+        self.thread_.daemon = True
+        self.thread_.start()
+
+    def stop(self):
+        """Stops the sampling thread and takes the last sample.
+
+        It raises the error of the sampling thread, if any.
+        """
+        self.stop_event_.set()
+        if self.thread_:
+            self.thread_.join()
+            self.thread_ = None
+        error, self.error_ = self.error_, None
+        if error:
+            if self.log is not None:
+                self.log.flush()
+            raise error
+        self.sample()
+        if self.log is not None:
+            self.log.flush()
+
+    def close_log(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
 
-class LockstatProfiler(Profiler):
+def parse_lockstat_snapshot(text):
+    """Parses the content of /proc/lock_stat.
+
+    @param text the content of lock_stat.
+    @return a tuple of ([field names], [lock class names], values), where
+    values is an array of shape (classes, fields).
+    """
+    fields = list(LockstatSeries.FIELDS)
+    names = []
+    rows = []
+    for line in text.splitlines():
+        if 'class name' in line:
+            # Newer kernels have more fields (e.g. waittime-avg).
+            fields = line.split('class name', 1)[1].split()
+            continue
+        name, sep, values = line.rpartition(':')
+        if not sep:
+            continue
+        try:
+            row = [float(x) for x in values.split()]
+        except ValueError:
+            continue
+        if not row:
+            continue
+        names.append(name.strip())
+        rows.append((row + [0] * len(fields))[:len(fields)])
+    return fields, names, np.array(rows).reshape((len(rows), len(fields)))
+
+
+class LockstatSeries(object):
+    """Snapshots of /proc/lock_stat stored by column.
+
+    Each lock class gets a stable row of a table of 'max_classes' rows when
+    it first occurs, so a snapshot is one fixed-size record of a
+    samplelog.SampleLog, and the values of a field form an array of shape
+    (snapshots, classes). Classes that have not occurred yet in a snapshot
+    are 0. The names of the classes are the labels of the log.
+    """
+    FIELDS = ['con-bounces', 'contentions',
+              'waittime-min', 'waittime-max', 'waittime-total',
+              'acq-bounces', 'acquisitions',
+              'holdtime-min', 'holdtime-max', 'holdtime-total']
+    # Cumulative fields, whose per-interval deltas are meaningful.
+    COUNTERS = ['con-bounces', 'contentions', 'waittime-total',
+                'acq-bounces', 'acquisitions', 'holdtime-total']
+    # The default number of lock classes that a series can hold.
+    MAX_CLASSES = 2048
+    # The default number of snapshots kept.
+    CAPACITY = 256
+
+    def __init__(self, **kwargs):
+        """Optional parameters:
+        @param path the path of the log (default: the snapshots are only
+        kept in memory).
+        @param capacity the number of snapshots kept (default: CAPACITY).
+        @param max_classes the number of lock classes that the series can
+        hold (default: MAX_CLASSES).
+        @param log the log of an earlier series to read, e.g. restored by
+        LockstatProfiler.from_log().
+        """
+        self.path = kwargs.get('path') or None
+        self.capacity = kwargs.get('capacity', self.CAPACITY)
+        self.max_classes = kwargs.get('max_classes', self.MAX_CLASSES)
+        self.fields = list(self.FIELDS)
+        self.classes = []
+        self.class_ids = {}
+        self.log = kwargs.get('log', None)
+        self.snapshots_ = None
+        self.columns_ = {}
+        if self.log is not None:
+            self.fields = list(self.log.meta['fields'])
+            self.max_classes = self.log.dtype['values'].shape[0]
+            for cid, name in enumerate(self.log.labels()):
+                self.class_ids[name] = cid
+                self.classes.append(name)
+
+    def __len__(self):
+        return len(self.log) if self.log is not None else 0
+
+    @property
+    def times(self):
+        """The timestamps of the kept snapshots.
+        """
+        return self.snapshots()['time']
+
+    def add(self, now, text):
+        """Adds a snapshot.
+
+        @param now the timestamp of the snapshot.
+        @param text the content of /proc/lock_stat.
+        """
+        fields, names, values = parse_lockstat_snapshot(text)
+        if fields != self.fields:
+            if len(self):
+                raise ValueError('The fields of lock_stat have changed')
+            self.fields = fields
+        if self.log is None:
+            self.log = samplelog.SampleLog(
+                self.path, [('time', np.float64),
+                            ('values', np.float64,
+                             (self.max_classes, len(self.fields)))],
+                self.capacity,
+                meta={'fields': self.fields, 'max_classes': self.max_classes})
+        ids = np.empty(len(names), dtype=np.intp)
+        for i, name in enumerate(names):
+            cid = self.class_ids.get(name)
+            if cid is None:
+                cid = len(self.classes)
+                if cid >= self.max_classes:
+                    raise ValueError(
+                        'More than {} lock classes in lock_stat'.format(
+                            self.max_classes))
+                self.log.add_label(name)
+                self.class_ids[name] = cid
+                self.classes.append(name)
+            ids[i] = cid
+        slot = self.log.reserve()
+        slot['time'] = now
+        # The rows past the known classes have never been written.
+        slot['values'][:len(self.classes)] = 0
+        slot['values'][ids] = values
+        self.log.publish()
+        self.snapshots_ = None
+        self.columns_ = {}
+
+    def snapshots(self):
+        """Returns the kept snapshots as a structured array of 'time' and
+        'values' of shape (max_classes, fields).
+        """
+        if self.log is None:
+            return np.zeros(0, dtype=[('time', np.float64)])
+        if self.snapshots_ is None:
+            self.snapshots_ = self.log.samples(copy=True)
+        return self.snapshots_
+
+    def column(self, field):
+        """Returns the values of a field, shape (snapshots, classes).
+        """
+        if field not in self.columns_:
+            col = self.fields.index(field)
+            snapshots = self.snapshots()
+            if len(snapshots):
+                values = snapshots['values'][:, :len(self.classes), col]
+            else:
+                values = np.zeros((0, len(self.classes)))
+            self.columns_[field] = values
+        return self.columns_[field]
+
+    def deltas(self, field):
+        """Returns the increase of a counter field in each interval, shape
+        (snapshots - 1, classes).
+        """
+        if field not in self.COUNTERS:
+            raise ValueError('{} is not a cumulative field'.format(field))
+        values = self.column(field)
+        deltas = np.diff(values, axis=0)
+        # The counters restart from 0 if lock_stat is cleared meanwhile.
+        return np.where(deltas < 0, values[1:], deltas)
+
+    def interval_stats(self):
+        """Returns the per-interval statistics of all lock classes.
+
+        @return a dict of arrays of shape (snapshots - 1, classes): the deltas
+        of all COUNTERS, and 'waittime-avg' (per contention) and
+        'holdtime-avg' (per acquisition) of each interval. 'time' is the end
+        of each interval.
+        """
+        stats = dict((field, self.deltas(field)) for field in self.COUNTERS)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stats['waittime-avg'] = np.where(
+                stats['contentions'] > 0,
+                stats['waittime-total'] / stats['contentions'], 0)
+            stats['holdtime-avg'] = np.where(
+                stats['acquisitions'] > 0,
+                stats['holdtime-total'] / stats['acquisitions'], 0)
+        stats['time'] = self.times[1:]
+        return stats
+
+    def latest(self):
+        """Returns the deltas of COUNTERS in the last interval, computed from
+        the last two snapshots only, e.g. for live monitoring.
+
+        @return {class: {field: value}} of all classes seen so far, with
+        'waittime-avg' and 'holdtime-avg' of the interval.
+        """
+        if self.log is None:
+            return {}
+        snapshots = self.log.samples(max(0, self.log.count - 2), copy=True)
+        if len(snapshots) < 2:
+            return {}
+        cols = [self.fields.index(field) for field in self.COUNTERS]
+        values = snapshots['values'][:, :len(self.classes)][..., cols]
+        previous, current = values
+        deltas = current - previous
+        deltas = np.where(deltas < 0, current, deltas)
+        result = {}
+        for cid, name in enumerate(self.classes):
+            stats = dict(zip(self.COUNTERS, deltas[cid].tolist()))
+            stats['waittime-avg'] = stats['waittime-total'] / \
+                stats['contentions'] if stats['contentions'] else 0.0
+            stats['holdtime-avg'] = stats['holdtime-total'] / \
+                stats['acquisitions'] if stats['acquisitions'] else 0.0
+            result[name] = stats
+        return result
+
+    def totals(self):
+        """Returns the statistics between the first and the last snapshots.
+
+        @return {class: {field: value}}, in the form of
+        perftest.parse_lockstat_data(). The min/max fields are the values of
+        the last snapshot.
+        """
+        if not len(self):
+            return {}
+        last = dict((field, self.column(field)[-1]) for field in self.fields)
+        for field in self.COUNTERS:
+            values = self.column(field)
+            last[field] = values[-1] - values[0]
+            last[field] = np.where(last[field] < 0, values[-1], last[field])
+        return dict((name, dict((field, last[field][cid])
+                                for field in self.fields))
+                    for cid, name in enumerate(self.classes))
+
+
+class LockstatProfiler(SamplingProfiler):
     """The Profiler to get /proc/lock_stat data
+
+    By default, it clears lock_stat at start() and reads it at stop(). If an
+    interval is given, it instead takes snapshots of lock_stat periodically
+    without clearing it, and 'series' holds the snapshots. Its log is the
+    log of the series.
     """
     LOCKSTAT = '/proc/lock_stat'
-    def __init__(self):
+    # A snapshot holds all lock classes, so fewer of them are kept.
+    LOG_CAPACITY = LockstatSeries.CAPACITY
+    # Stripped from the names of the lock classes by results(), as
+    # perftest.parse_lockstat_data().
+    KEY_CHARS = ' \t&()'
+
+    def __init__(self, interval=0, **kwargs):
+        """@param interval the snapshot interval in seconds. 0 disables the
+        interval mode.
+
+        Optional parameters:
+        @param lockstat the path of lock_stat.
+        @param max_classes the number of lock classes that the snapshots can
+        hold (default: LockstatSeries.MAX_CLASSES).
+        @param log, log_capacity see SamplingProfiler.
+        """
+        super(LockstatProfiler, self).__init__(interval, **kwargs)
+        self.lockstat = kwargs.get('lockstat', self.LOCKSTAT)
+        self.max_classes = kwargs.get('max_classes',
+                                      LockstatSeries.MAX_CLASSES)
         self.report_ = ""
+        self.series = self._new_series()
 
     @staticmethod
     def check_avail():
@@ -73,28 +506,102 @@ class LockstatProfiler(Profiler):
                 "kernel with 'CONFIG_LOCK_STAT' tuned on.")
 
     @staticmethod
-    def clear_lockstat():
+    def clear_lockstat(lockstat=LOCKSTAT):
         """Clear the statistics data of kernel lock
         """
-        with open(LockstatProfiler.LOCKSTAT, 'w') as fobj:
+        with open(lockstat, 'w') as fobj:
             fobj.write('0\n')
 
+    def _new_series(self, log=None):
+        return LockstatSeries(path=self.log_path, capacity=self.log_capacity,
+                              max_classes=self.max_classes, log=log)
+
+    def _restore(self, log):
+        self.series = self._new_series(log)
+
+    def close_log(self):
+        if self.series.log is not None:
+            self.series.log.close()
+        self.log = None
+        self.series = self._new_series()
+
+    def sample(self, now=None):
+        """Takes a snapshot of lock_stat.
+        """
+        if now is None:
+            now = time.time()
+        with open(self.lockstat, 'r') as fobj:
+            self.series.add(now, fobj.read())
+        self.log = self.series.log
+
+    def latest(self):
+        """Returns the lock statistics of the last interval (see
+        LockstatSeries.latest()).
+        """
+        return self.series.latest()
+
     def start(self):
         """Starts to monitor lock stat
         """
-        self.clear_lockstat()
+        if self.interval:
+            super(LockstatProfiler, self).start()
+        else:
+            self.clear_lockstat(self.lockstat)
 
     def stop(self):
         """Stops to monitor lock stats and gather the results.
         """
-        with open(self.LOCKSTAT, 'r') as fobj:
+        if self.interval:
+            super(LockstatProfiler, self).stop()
+            return
+        with open(self.lockstat, 'r') as fobj:
             self.report_ = fobj.read()
 
     def report(self):
-        return self.report_
+        """Returns lock_stat as read at stop(). In the interval mode, or when
+        run by a CompositeProfiler, it returns the statistics between the
+        first and last snapshots in the same format.
+        """
+        if not len(self.series):
+            return self.report_
+        series = self.series
+        lines = ['{:>40} '.format('class name') +
+                 ' '.join('{:>14}'.format(f) for f in series.fields)]
+        for name, values in sorted(series.totals().items()):
+            lines.append('{:>40}: '.format(name) + ' '.join(
+                '{:>14.2f}'.format(values[f]) for f in series.fields))
+        return '\n'.join(lines)
+
+    def results(self):
+        """Returns the statistics of report() without formatting them.
+
+        @return {class: {field: value}} in the form of
+        perftest.parse_lockstat_data(): the names of the classes are
+        stripped of ' \t&()' (e.g. 'sb->s_lock)->rlock' for
+        '&(&sb->s_lock)->rlock') and the classes whose values are all 0 are
+        skipped.
+        """
+        if len(self.series):
+            totals = self.series.totals()
+            return dict((name.strip(self.KEY_CHARS), values)
+                        for name, values in totals.items()
+                        if any(values.values()))
+        fields, names, values = parse_lockstat_snapshot(self.report_)
+        return dict((names[i].strip(self.KEY_CHARS),
+                     dict(zip(fields, values[i])))
+                    for i in np.flatnonzero(values.any(axis=1)).tolist())
 
 
 class ProcStatProfiler(Profiler):
+    """Measures the CPU time of the whole system from the first line of
+    /proc/stat.
+    """
+    # The fields of the 'cpu' line, in clock ticks.
+    FIELDS = ['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq',
+              'steal', 'guest', 'guest_nice']
+    # The scale of perftest.parse_procstat_data().
+    REAL_TIME_RATIO = 100
+
     def __init__(self):
         self.report_ = ""
         self.before = ""
@@ -117,9 +624,27 @@ class ProcStatProfiler(Profiler):
                          zip(after_fields, before_fields)]
         return 'cpu ' + ' '.join(return_fields) + '\n'
 
+    def results(self):
+        """Returns the CPU time between start() and stop().
+
+        @return {field: value} of FIELDS, scaled as
+        perftest.parse_procstat_data().
+        """
+        if not self.before or not self.after:
+            return {}
+        before = np.array(self.before.split()[1:], dtype=np.float64)
+        after = np.array(self.after.split()[1:], dtype=np.float64)
+        deltas = (after - before) * self.REAL_TIME_RATIO
+        return dict(zip(self.FIELDS, deltas))
+
 
 class PerfProfiler(Profiler):
     """Use linux's perf utility to measure the PMU.
+
+    Each PerfProfiler is an isolated session with its own working directory
+    and its own 'perf.data' in it, so that several sessions can record at the
+    same time, e.g. in a parallel sweep. Use collect_perf_reports() to run
+    'perf report' for many sessions at once.
     """
     EVENTS = '-e cycles,cache-misses,LLC-load-misses'
     # EVENTS = '-e cycles'
@@ -133,6 +658,14 @@ class PerfProfiler(Profiler):
         @param events the events to be recorded.
         @param vmlinux the kernel image to find symbols.
         @param kallsyms the kallsyms file.
+        @param callgraph sets to True to record call stacks ('-g'), which
+        are needed by script().
+        @param workdir the working directory of the session (default: a new
+        temporary directory, which cleanup() removes).
+        @param cpus only records the samples on these CPUs ('-C'), e.g. '0-3'
+        or [0, 2].
+        @param pid only records these processes ('-p') instead of the whole
+        system, e.g. 1234 or [1234, 1235].
         """
         self.perf = perf
         self.check_avail(perf)
@@ -140,7 +673,24 @@ class PerfProfiler(Profiler):
         self.kallsyms = kwargs.get('kallsyms', '')
         if kwargs.get('events', ''):
             self.EVENTS = '-e ' + kwargs.get('events')
+        if kwargs.get('callgraph', False):
+            self.EVENTS += ' -g'
+        self.cpus = _id_list(kwargs.get('cpus', ''))
+        self.pid = _id_list(kwargs.get('pid', ''))
+        self.workdir = kwargs.get('workdir', '')
+        self.own_workdir_ = not self.workdir
+        if self.own_workdir_:
+            self.workdir = tempfile.mkdtemp(prefix='pyro-perf-')
+        else:
+            # 'perf record' runs in the working directory, so a relative
+            # path would be resolved twice.
+            self.workdir = os.path.abspath(self.workdir)
+            if not os.path.isdir(self.workdir):
+                os.makedirs(self.workdir)
+        self.output = os.path.join(self.workdir, 'perf.data')
         self.report_ = ""
+        self.output_ = b''
+        self.record_ = None
 
     @staticmethod
     def check_avail(perf=''):
@@ -148,28 +698,117 @@ class PerfProfiler(Profiler):
             raise RuntimeError('PerfProfiler can not find perf binary: \'{}\'.'
                                .format(perf))
 
-    def start(self, cmd):
+    def _record_command(self):
+        command = '{} record -o {} {}'.format(
+            self.perf, shlex.quote(self.output), self.EVENTS)
+        if self.pid:
+            command += ' -p {}'.format(self.pid)
+        else:
+            command += ' -a'
+        if self.cpus:
+            command += ' -C {}'.format(self.cpus)
+        return command
+
+    def start(self, cmd=''):
         """Start recording perf events.
+
+        @param cmd the command to profile. It blocks until the command exits,
+        and the command runs in the current directory. If it is empty,
+        'perf record' runs in background in the working directory of the
+        session until stop().
         """
         print("Perf record events: {}".format(self.EVENTS))
-        return call('{} record {} -a {}'.format(self.perf, self.EVENTS, cmd),
-                    shell=True)
+        if cmd:
+            return call('{} {}'.format(self._record_command(), cmd),
+                        shell=True)
+        self.record_ = Popen(shlex.split(self._record_command()),
+                             cwd=self.workdir)
 
-    def stop(self):
-        """Collects reports from the previous running of 'perf record'
+    def stop(self, report=True):
+        """Stops the background 'perf record' and collects the report.
+
+        @param report sets to False to only stop recording, e.g. to collect
+        the reports of many sessions with collect_perf_reports().
         """
+        if self.record_:
+            self.record_.send_signal(signal.SIGINT)
+            self.record_.wait()
+            self.record_ = None
+        if report:
+            self.collect()
+
+    def collect(self):
+        """Runs 'perf report' on the recorded samples of this session.
+
+        @return the report.
+        """
+        self.output_ = check_output(
+            '{} report -i {} {} --stdio'.format(
+                self.perf, shlex.quote(self.output), self._symbol_options()),
+            shell=True, cwd=self.workdir)
+        self.report_ = self.output_.decode('utf-8')
+        return self.report_
+
+    def _symbol_options(self):
         options = ''
         if self.vmlinux:
             options += ' -k {}'.format(self.vmlinux)
         if self.kallsyms:
             options += ' --kallsyms={}'.format(self.kallsyms)
-        self.report_ = check_output(
-            '{} report {} --stdio'.format(self.perf, options),
-            shell=True).decode('utf-8')
+        return options
+
+    def script(self, outfile):
+        """Writes the samples with their call stacks ('perf script') to
+        outfile, which flamegraph.parse_perf_script() folds.
+
+        @param outfile the output file path.
+        """
+        with open(outfile, 'w') as fobj:
+            check_call('{} script -i {} {}'.format(
+                self.perf, shlex.quote(self.output), self._symbol_options()),
+                shell=True, stdout=fobj, cwd=self.workdir)
+
+    def cleanup(self):
+        """Removes the working directory if the session created it.
+        """
+        if self.own_workdir_ and os.path.isdir(self.workdir):
+            shutil.rmtree(self.workdir)
 
     def report(self):
         return self.report_
 
+    def results(self, **kwargs):
+        """Parses the output of 'perf report' collected by collect().
+
+        Optional parameters:
+        @param top see perftest.parse_perf_data().
+        @return {event: [(percent, command, symbol), ...]}, as
+        perftest.parse_perf_data().
+        """
+        return perftest.parse_perf_data(self.output_, **kwargs)
+
+
+def _id_list(ids):
+    """Formats a CPU or pid list for perf: [0, 2] -> '0,2'.
+    """
+    if isinstance(ids, (list, tuple, set)):
+        return ','.join(str(i) for i in sorted(ids))
+    return str(ids) if ids else ''
+
+
+def collect_perf_reports(profilers, workers=None):
+    """Runs 'perf report' for many PerfProfiler sessions in a pool of worker
+    threads. Each report is a separate perf process, so they run in parallel.
+
+    @param profilers the stopped PerfProfilers, e.g. stop(report=False).
+    @param workers the number of concurrent reports (default: the number of
+    CPUs).
+    @return the list of reports, in the order of profilers.
+    """
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(lambda prof: prof.collect(), profilers))
+
 
 class OProfiler(Profiler):
     """Use oprofiler
@@ -181,6 +820,7 @@ class OProfiler(Profiler):
         if events:
             self.events = events
         self.report_ = ""
+        self.output_ = b''
 
     def start(self):
         call('opcontrol --reset', shell=True)
@@ -194,7 +834,1211 @@ class OProfiler(Profiler):
     def stop(self):
         call('opcontrol --dump')
         call('opcontrol --stop')
-        self.report_ = check_output('opreport -cl', shell=True).decode('utf-8')
+        self.output_ = check_output('opreport -cl', shell=True)
+        self.report_ = self.output_.decode('utf-8')
 
     def report(self):
         return self.report_
+
+    def results(self):
+        """Parses the output of opreport, as perftest.parse_oprofile_data().
+        """
+        return perftest.parse_oprofile_data(self.output_)
+
+
+def read_diskstats(filename, devices=None):
+    """Read the counters from a /proc/diskstats file.
+
+    @param filename the path of diskstats file.
+    @param devices only returns these devices if given.
+    @return a tuple of ([device names], counters), where counters is an int64
+    array of shape (len(names), len(DiskStatsProfiler.FIELDS)).
+    """
+    nfields = len(DiskStatsProfiler.FIELDS)
+    rows = {}
+    with open(filename) as fobj:
+        for line in fobj:
+            items = line.split()
+            if len(items) < 3 + nfields:
+                continue
+            if devices and items[2] not in devices:
+                continue
+            rows[items[2]] = [int(x) for x in items[3:3 + nfields]]
+    if devices:
+        missing = [dev for dev in devices if dev not in rows]
+        if missing:
+            raise ValueError('Can not find devices in {}: {}'
+                             .format(filename, ', '.join(missing)))
+        names = list(devices)
+    else:
+        names = sorted(rows)
+    counters = np.array([rows[name] for name in names], dtype=np.int64)
+    return names, counters.reshape((len(names), nfields))
+
+
+class DiskStatsProfiler(SamplingProfiler):
+    """Samples /proc/diskstats to get per-device IOPS, throughput and latency.
+    """
+    DISKSTATS = '/proc/diskstats'
+    SECTOR_SIZE = 512
+    FIELDS = ['reads', 'reads-merged', 'sectors-read', 'read-ms',
+              'writes', 'writes-merged', 'sectors-written', 'write-ms',
+              'in-flight', 'io-ms', 'weighted-io-ms']
+    # read/write IOPS, read/write bandwidth (KB/s), average request size (KB),
+    # average latency (ms), average queue depth and utilization (0-1).
+    METRICS = ['r-iops', 'w-iops', 'r-kbps', 'w-kbps', 'avg-req-kb',
+               'await-ms', 'queue-depth', 'util']
+
+    def __init__(self, devices=None, interval=1.0, **kwargs):
+        """Constructs a DiskStatsProfiler
+
+        @param devices a list of device names (e.g. ['sda', 'sdb']). All
+        devices are sampled if it is not given.
+        @param interval the sampling interval in seconds.
+
+        Optional parameters:
+        @param diskstats the path of diskstats file.
+        @param log, log_capacity see SamplingProfiler.
+        """
+        super(DiskStatsProfiler, self).__init__(interval, **kwargs)
+        self.devices = list(devices) if devices else []
+        self.diskstats = kwargs.get('diskstats', self.DISKSTATS)
+        self.reset()
+
+    def sample(self, now=None):
+        if now is None:
+            now = time.time()
+        names, counters = read_diskstats(self.diskstats, self.devices)
+        if not self.devices:
+            self.devices = names
+        self._store(now, counters)
+
+    def _log_meta(self):
+        return {'devices': self.devices}
+
+    @classmethod
+    def _compute_metrics(cls, times, counters):
+        """Computes the metrics between consecutive samples.
+
+        @param times an array of timestamps, shape (N,).
+        @param counters an array of counters, shape (N, devices, fields).
+        @return an array of shape (N - 1, devices, len(METRICS)).
+        """
+        delta = np.diff(counters, axis=0).astype(np.float64)
+        # 32-bit kernels wrap the counters around.
+        delta[delta < 0] += 2 ** 32
+        elapsed = np.diff(np.asarray(times, dtype=np.float64))[:, np.newaxis]
+        elapsed[elapsed <= 0] = np.nan
+
+        field = dict((name, delta[:, :, i])
+                     for i, name in enumerate(cls.FIELDS))
+        ios = field['reads'] + field['writes']
+        sectors = field['sectors-read'] + field['sectors-written']
+        kb_per_sector = cls.SECTOR_SIZE / 1024.0
+
+        metrics = np.zeros(delta.shape[:2] + (len(cls.METRICS),))
+        metrics[:, :, 0] = field['reads'] / elapsed
+        metrics[:, :, 1] = field['writes'] / elapsed
+        metrics[:, :, 2] = field['sectors-read'] * kb_per_sector / elapsed
+        metrics[:, :, 3] = field['sectors-written'] * kb_per_sector / elapsed
+        with np.errstate(divide='ignore', invalid='ignore'):
+            metrics[:, :, 4] = np.where(ios > 0,
+                                        sectors * kb_per_sector / ios, 0)
+            metrics[:, :, 5] = np.where(
+                ios > 0, (field['read-ms'] + field['write-ms']) / ios, 0)
+        metrics[:, :, 6] = field['weighted-io-ms'] / (elapsed * 1000)
+        metrics[:, :, 7] = field['io-ms'] / (elapsed * 1000)
+        return metrics
+
+    def series(self):
+        """Returns the metrics of each sampling interval.
+
+        @return a structured array of shape (intervals, devices). Its fields
+        are 'time' (the end of the interval) and METRICS. The columns are
+        ordered as self.devices.
+        """
+        dtype = [('time', np.float64)] + \
+            [(name, np.float64) for name in self.METRICS]
+        samples = self.samples()
+        if len(samples) < 2:
+            return np.zeros((0, len(self.devices)), dtype=dtype)
+        metrics = self._compute_metrics(samples['time'], samples['values'])
+        result = np.zeros(metrics.shape[:2], dtype=dtype)
+        result['time'] = samples['time'][1:, np.newaxis]
+        for i, name in enumerate(self.METRICS):
+            result[name] = metrics[:, :, i]
+        return result
+
+    def latest(self):
+        """Returns the metrics of the last sampling interval. It only reads
+        the last two samples, so it is cheap to call while sampling.
+
+        @return {device: {metric: value}}
+        """
+        samples = self._latest_samples(2)
+        if len(samples) < 2:
+            return {}
+        metrics = self._compute_metrics(samples['time'],
+                                        samples['values'])[0]
+        return dict((dev, dict(zip(self.METRICS, metrics[i].tolist())))
+                    for i, dev in enumerate(self.devices))
+
+    def summary(self):
+        """Returns the metrics over the whole profiling period, or since the
+        oldest sample kept in the log.
+
+        @return {device: {metric: value}}
+        """
+        samples = self.samples()
+        if len(samples) < 2:
+            return {}
+        samples = samples[[0, -1]]
+        metrics = self._compute_metrics(samples['time'],
+                                        samples['values'])[0]
+        return dict((dev, dict(zip(self.METRICS, metrics[i])))
+                    for i, dev in enumerate(self.devices))
+
+    def report(self):
+        summary = self.summary()
+        lines = ['device ' + ' '.join(self.METRICS)]
+        for dev in self.devices:
+            if dev not in summary:
+                continue
+            lines.append(dev + ' ' + ' '.join(
+                '{:.2f}'.format(summary[dev][name]) for name in self.METRICS))
+        return '\n'.join(lines)
+
+    def results(self):
+        """Returns summary(), the metrics of report().
+        """
+        return self.summary()
+
+
+class ProcessProfiler(SamplingProfiler):
+    """Samples the resource usage of a process and all its descendants from
+    /proc/<pid>/{stat,status,io}.
+
+    Usage:
+    >>> prof = ProcessProfiler()
+    >>> prof.start('postmark config.pm')  # Launches the command and returns.
+    >>> prof.stop()  # Waits for the command to finish.
+    """
+    PROC = '/proc'
+    # Cumulative counters are kept for exited processes, so that the totals of
+    # the process tree never go backward.
+    COUNTERS = ['cpu-time', 'read-bytes', 'write-bytes', 'voluntary-ctxt',
+                'nonvoluntary-ctxt']
+    GAUGES = ['rss-kb', 'threads', 'processes']
+    METRICS = COUNTERS + GAUGES
+    RUSAGE_FIELDS = ['ru_utime', 'ru_stime', 'ru_maxrss', 'ru_minflt',
+                     'ru_majflt', 'ru_inblock', 'ru_oublock', 'ru_nvcsw',
+                     'ru_nivcsw']
+
+    def __init__(self, interval=1.0, **kwargs):
+        """Constructs a ProcessProfiler
+
+        @param interval the sampling interval in seconds.
+
+        Optional parameters:
+        @param pid attach to this process instead of launching a command.
+        @param proc the mount point of procfs.
+        @param log, log_capacity see SamplingProfiler.
+        """
+        super(ProcessProfiler, self).__init__(interval, **kwargs)
+        self.pid = kwargs.get('pid', None)
+        self.proc = kwargs.get('proc', self.PROC)
+        self.clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+        self.popen_ = None
+        self.returncode = None
+        self.rusage = None
+        self.reset()
+
+    def reset(self):
+        super(ProcessProfiler, self).reset()
+        # {(pid, starttime): [values of COUNTERS]}
+        self.counters_ = {}
+        self.peak_rss_ = 0
+
+    def _read_stat(self, pid):
+        """Returns (ppid, starttime, cpu seconds, threads) of a process.
+        """
+        with open(os.path.join(self.proc, str(pid), 'stat')) as fobj:
+            content = fobj.read()
+        # The command name can contain spaces and parentheses.
+        fields = content[content.rfind(')') + 2:].split()
+        return (int(fields[1]), int(fields[19]),
+                (int(fields[11]) + int(fields[12])) / self.clock_ticks,
+                int(fields[17]))
+
+    def _read_keys(self, pid, name, sep):
+        """Reads a 'key<sep> value' file under /proc/<pid> into a dict.
+        """
+        result = {}
+        try:
+            with open(os.path.join(self.proc, str(pid), name)) as fobj:
+                for line in fobj:
+                    key, _, value = line.partition(sep)
+                    fields = value.split()
+                    if fields and fields[0].isdigit():
+                        result[key.strip()] = int(fields[0])
+        except (IOError, OSError):
+            # /proc/<pid>/io is only readable by the owner or root.
+            pass
+        return result
+
+    def _process_tree(self, root):
+        """Returns the pids of root and all its descendants.
+        """
+        children = {}
+        for entry in os.listdir(self.proc):
+            if not entry.isdigit():
+                continue
+            try:
+                ppid = self._read_stat(entry)[0]
+            except (IOError, OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        pids = [root]
+        for pid in pids:
+            pids.extend(children.get(pid, []))
+        return pids
+
+    def sample(self, now=None):
+        if now is None:
+            now = time.time()
+        if self.pid is None:
+            return
+        gauges = np.zeros(len(self.GAUGES))
+        for pid in self._process_tree(self.pid):
+            try:
+                _, starttime, cpu_time, threads = self._read_stat(pid)
+            except (IOError, OSError):
+                # The process has just exited.
+                continue
+            status = self._read_keys(pid, 'status', ':')
+            io = self._read_keys(pid, 'io', ':')
+            self.counters_[(pid, starttime)] = [
+                cpu_time, io.get('read_bytes', 0), io.get('write_bytes', 0),
+                status.get('voluntary_ctxt_switches', 0),
+                status.get('nonvoluntary_ctxt_switches', 0)]
+            gauges += [status.get('VmRSS', 0), threads, 1]
+            self.peak_rss_ = max(self.peak_rss_, status.get('VmHWM', 0))
+        self.peak_rss_ = max(self.peak_rss_, gauges[0])
+        counters = np.sum(list(self.counters_.values()), axis=0) \
+            if self.counters_ else np.zeros(len(self.COUNTERS))
+        self._store(now, np.concatenate([counters, gauges]))
+
+    def start(self, cmd=''):
+        """Starts to sample the process tree.
+
+        @param cmd the command to launch. If it is empty, the profiler attaches
+        to the 'pid' given to the constructor.
+        """
+        self.returncode = None
+        self.rusage = None
+        if cmd:
+            self.popen_ = Popen(cmd, shell=True)
+            self.pid = self.popen_.pid
+        elif self.pid is None:
+            raise ValueError('ProcessProfiler needs either a command or a pid')
+        super(ProcessProfiler, self).start()
+
+    def stop(self):
+        """Waits for the launched command to finish and stops sampling.
+        """
+        if self.popen_:
+            _, status, rusage = os.wait4(self.popen_.pid, 0)
+            if os.WIFEXITED(status):
+                self.returncode = os.WEXITSTATUS(status)
+            else:
+                self.returncode = -os.WTERMSIG(status)
+            self.popen_.returncode = self.returncode
+            self.popen_ = None
+            self.rusage = dict((name, getattr(rusage, name))
+                               for name in self.RUSAGE_FIELDS)
+        super(ProcessProfiler, self).stop()
+
+    def series(self):
+        """Returns the totals of the process tree at each sample.
+
+        @return a structured array with fields 'time' and METRICS.
+        """
+        dtype = [('time', np.float64)] + \
+            [(name, np.float64) for name in self.METRICS]
+        samples = self.samples()
+        result = np.zeros(len(samples), dtype=dtype)
+        if len(samples):
+            result['time'] = samples['time']
+            for i, name in enumerate(self.METRICS):
+                result[name] = samples['values'][:, i]
+        return result
+
+    def latest(self):
+        """Returns the totals of the process tree at the last sample.
+
+        @return {metric: value}
+        """
+        samples = self._latest_samples(1)
+        if not len(samples):
+            return {}
+        return dict(zip(self.METRICS, samples['values'][-1].tolist()))
+
+    def summary(self):
+        """Returns the totals at the last sample, the peak RSS and the rusage
+        of the launched command.
+        """
+        result = {}
+        series = self.series()
+        if len(series):
+            result = dict((name, series[name][-1]) for name in self.COUNTERS)
+            result['threads'] = series['threads'].max()
+            result['processes'] = series['processes'].max()
+        result['peak-rss-kb'] = self.peak_rss_
+        if self.rusage:
+            result['rusage'] = self.rusage
+        return result
+
+    def report(self):
+        summary = self.summary()
+        lines = []
+        for name in self.COUNTERS + ['threads', 'processes', 'peak-rss-kb']:
+            if name in summary:
+                lines.append('{}: {}'.format(name, summary[name]))
+        for name, value in sorted(summary.get('rusage', {}).items()):
+            lines.append('{}: {}'.format(name, value))
+        return '\n'.join(lines)
+
+    def results(self):
+        """Returns summary(), the metrics of report().
+        """
+        return self.summary()
+
+
+def read_schedstat(filename, cpus=None):
+    """Reads the per-CPU counters of /proc/schedstat.
+
+    @param filename the path of schedstat file.
+    @param cpus only returns these CPUs (e.g. ['cpu0', 'cpu2']) if given.
+    @return a tuple of ([cpu names], counters), where counters is an int64
+    array of shape (len(names), 3): the time spent running tasks (ns), the
+    time tasks waited on the run queue (ns) and the number of timeslices.
+    """
+    rows = {}
+    with open(filename) as fobj:
+        for line in fobj:
+            items = line.split()
+            if not items or not items[0].startswith('cpu'):
+                continue
+            # The last three fields are the same in all versions.
+            rows[items[0]] = [int(x) for x in items[-3:]]
+    if cpus:
+        missing = [cpu for cpu in cpus if cpu not in rows]
+        if missing:
+            raise ValueError('Can not find CPUs in {}: {}'
+                             .format(filename, ', '.join(missing)))
+        names = list(cpus)
+    else:
+        names = sorted(rows, key=lambda name: int(name[3:]))
+    counters = np.array([rows[name] for name in names], dtype=np.int64)
+    return names, counters.reshape((len(names), 3))
+
+
+def _schedstat_metrics(deltas):
+    """Computes METRICS of SchedStatProfiler from the deltas of schedstat
+    counters, shape (..., 3).
+    """
+    run = deltas[..., 0] / 1e9
+    wait = deltas[..., 1] / 1e9
+    timeslices = deltas[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(run + wait > 0, wait / (run + wait), 0)
+        latency = np.where(timeslices > 0, wait * 1000 / timeslices, 0)
+    return np.stack([run, wait, timeslices, ratio, latency], axis=-1)
+
+
+class SchedStatProfiler(SamplingProfiler):
+    """Samples the scheduler statistics of each CPU from /proc/schedstat and
+    of each thread of a process from /proc/<pid>/task/*/schedstat, to tell
+    the time spent waiting on run queues apart from other waits (e.g. locks
+    or I/O).
+
+    The kernel needs CONFIG_SCHEDSTATS, and on recent kernels the
+    kernel.sched_schedstats sysctl.
+
+    Usage:
+    >>> prof = SchedStatProfiler(pid=workload.pid, interval=0.5)
+    >>> prof.start()
+    >>> ...
+    >>> prof.stop()
+    >>> data[threads] = prof.summary()
+    >>> curves = perftest.trans_top_data_to_curves(data)
+    """
+    SCHEDSTAT = '/proc/schedstat'
+    PROC = '/proc'
+    FIELDS = ['run-ns', 'wait-ns', 'timeslices']
+    # Per interval: seconds running, seconds waiting on the run queue, the
+    # number of timeslices, the fraction of the runnable time spent waiting
+    # and the average wait before each timeslice (ms).
+    METRICS = ['run-time', 'wait-time', 'timeslices', 'wait-ratio',
+               'latency-ms']
+    # The default number of threads of the process that can be sampled.
+    MAX_THREADS = 256
+    # A sample holds the counters of all threads, so fewer of them are kept.
+    LOG_CAPACITY = 1 << 12
+
+    def __init__(self, interval=1.0, **kwargs):
+        """Constructs a SchedStatProfiler
+
+        @param interval the sampling interval in seconds.
+
+        Optional parameters:
+        @param pid samples the threads of this process as well.
+        @param cpus a list of CPU names (e.g. ['cpu0', 'cpu1']). All CPUs are
+        sampled if it is not given.
+        @param schedstat the path of schedstat file.
+        @param proc the mount point of procfs.
+        @param max_threads the number of threads of the process that can be
+        sampled (default: MAX_THREADS).
+        @param log, log_capacity see SamplingProfiler. The names of the
+        threads are the labels of the log.
+        """
+        super(SchedStatProfiler, self).__init__(interval, **kwargs)
+        self.pid = kwargs.get('pid', None)
+        self.max_threads = kwargs.get('max_threads', self.MAX_THREADS)
+        self.cpus = list(kwargs.get('cpus', []))
+        self.schedstat = kwargs.get('schedstat', self.SCHEDSTAT)
+        self.proc = kwargs.get('proc', self.PROC)
+        self.reset()
+
+    @staticmethod
+    def check_avail(schedstat=SCHEDSTAT):
+        return os.path.exists(schedstat)
+
+    def reset(self):
+        super(SchedStatProfiler, self).reset()
+        # Each thread gets a stable column when it first occurs.
+        self.tids = []
+        self.tid_ids_ = {}
+        self.thread_names = {}
+
+    def _add_thread(self, tid, name):
+        self.tid_ids_[tid] = len(self.tids)
+        self.tids.append(tid)
+        self.thread_names[tid] = name
+
+    def _read_tasks(self):
+        """Returns the column ids and the counters of the threads of pid.
+        """
+        taskdir = os.path.join(self.proc, str(self.pid), 'task')
+        ids = []
+        counters = []
+        try:
+            tasks = sorted((entry for entry in os.listdir(taskdir)
+                            if entry.isdigit()), key=int)
+        except OSError:
+            # The process has exited.
+            tasks = []
+        for entry in tasks:
+            try:
+                with open(os.path.join(taskdir, entry, 'schedstat')) as fobj:
+                    values = [int(x) for x in fobj.read().split()[:3]]
+            except (IOError, OSError, ValueError):
+                continue
+            tid = int(entry)
+            cid = self.tid_ids_.get(tid)
+            if cid is None:
+                cid = len(self.tids)
+                if cid >= self.max_threads:
+                    raise ValueError(
+                        'More than {} threads in process {}'.format(
+                            self.max_threads, self.pid))
+                try:
+                    with open(os.path.join(taskdir, entry, 'comm')) as fobj:
+                        name = fobj.read().strip()
+                except (IOError, OSError):
+                    name = str(tid)
+                self.log.add_label([tid, name])
+                self._add_thread(tid, name)
+            ids.append(cid)
+            counters.append(values)
+        return (np.array(ids, dtype=np.intp),
+                np.array(counters, dtype=np.int64).reshape((len(ids), 3)))
+
+    def sample(self, now=None):
+        if now is None:
+            now = time.time()
+        names, counters = read_schedstat(self.schedstat, self.cpus)
+        if not self.cpus:
+            self.cpus = names
+        if self.log is None:
+            fields = [('values', np.int64, counters.shape)]
+            if self.pid is not None:
+                # NaN for the threads that are not running.
+                fields.append(('tasks', np.float64, (self.max_threads, 3)))
+            self._create_log(fields)
+        if self.pid is not None:
+            ids, tasks = self._read_tasks()
+        slot = self.log.reserve()
+        slot['time'] = now
+        slot['values'] = counters
+        if self.pid is not None:
+            slot['tasks'] = np.nan
+            slot['tasks'][ids] = tasks
+        self.log.publish()
+
+    def _log_meta(self):
+        return {'cpus': self.cpus, 'pid': self.pid,
+                'max_threads': self.max_threads}
+
+    def _restore(self, log):
+        for tid, name in log.labels():
+            self._add_thread(tid, name)
+
+    def _series(self, samples, deltas):
+        dtype = [('time', np.float64)] + \
+            [(name, np.float64) for name in self.METRICS]
+        result = np.zeros(deltas.shape[:2], dtype=dtype)
+        if len(result):
+            metrics = _schedstat_metrics(deltas)
+            result['time'] = samples['time'][1:, np.newaxis]
+            for i, name in enumerate(self.METRICS):
+                result[name] = metrics[..., i]
+        return result
+
+    def cpu_deltas(self, samples=None):
+        """Returns the increase of the counters of each CPU in each interval,
+        shape (samples - 1, cpus, 3).
+
+        @param samples the samples to read (default: self.samples()).
+        """
+        if samples is None:
+            samples = self.samples()
+        if len(samples) < 2:
+            return np.zeros((0, len(self.cpus), 3))
+        return np.diff(samples['values'], axis=0).astype(np.float64)
+
+    def thread_deltas(self, samples=None):
+        """Returns the increase of the counters of each thread (ordered as
+        self.tids) in each interval, shape (samples - 1, threads, 3).
+
+        A thread that starts during an interval counts from 0, and a thread
+        that has exited does not increase.
+
+        @param samples the samples to read (default: self.samples()).
+        """
+        if samples is None:
+            samples = self.samples()
+        if len(samples) < 2 or self.pid is None:
+            return np.zeros((0, len(self.tids), 3))
+        values = samples['tasks'][:, :len(self.tids)]
+        previous, current = values[:-1], values[1:]
+        deltas = current - np.nan_to_num(previous)
+        # A reused tid restarts from 0.
+        deltas = np.where(deltas < 0, current, deltas)
+        return np.where(np.isnan(current), 0, deltas)
+
+    def cpu_series(self):
+        """Returns the metrics of each CPU in each interval.
+
+        @return a structured array of shape (intervals, cpus). Its fields are
+        'time' (the end of the interval) and METRICS. The columns are ordered
+        as self.cpus.
+        """
+        samples = self.samples()
+        return self._series(samples, self.cpu_deltas(samples))
+
+    def thread_series(self):
+        """Returns the metrics of each thread in each interval.
+
+        @return a structured array of shape (intervals, threads), ordered as
+        self.tids.
+        """
+        samples = self.samples()
+        return self._series(samples, self.thread_deltas(samples))
+
+    def _totals(self, deltas, names):
+        metrics = _schedstat_metrics(deltas.sum(axis=0))
+        return dict((name, dict(zip(self.METRICS, metrics[i].tolist())))
+                    for i, name in enumerate(names))
+
+    def cpu_summary(self):
+        """Returns the metrics over the whole profiling period.
+
+        @return {cpu: {metric: value}}
+        """
+        return self._totals(self.cpu_deltas(), self.cpus)
+
+    def thread_summary(self):
+        """Returns the metrics of each thread over the whole profiling
+        period.
+
+        @return {tid: {metric: value}}, with the name of the thread as
+        'name'.
+        """
+        totals = self._totals(self.thread_deltas(), self.tids)
+        for tid, metrics in totals.items():
+            metrics['name'] = self.thread_names.get(tid, str(tid))
+        return totals
+
+    def summary(self):
+        """Returns the metrics of the threads of the process, or of all CPUs
+        if there is no process, over the whole profiling period.
+
+        @return {metric: value}, e.g. a value of the {threads: data} dict
+        for perftest.trans_top_data_to_curves().
+        """
+        if self.pid is not None:
+            deltas = self.thread_deltas()
+        else:
+            deltas = self.cpu_deltas()
+        return dict(zip(self.METRICS, _schedstat_metrics(
+            deltas.sum(axis=(0, 1))).tolist()))
+
+    def report(self):
+        lines = ['cpu ' + ' '.join(self.METRICS)]
+        summary = self.cpu_summary()
+        for cpu in self.cpus:
+            lines.append(cpu + ' ' + ' '.join(
+                '{:.3f}'.format(summary[cpu][name]) for name in self.METRICS))
+        if self.pid is not None:
+            lines.append('thread ' + ' '.join(self.METRICS))
+            summary = self.thread_summary()
+            for tid in self.tids:
+                lines.append('{}/{} '.format(tid, summary[tid]['name']) +
+                             ' '.join('{:.3f}'.format(summary[tid][name])
+                                      for name in self.METRICS))
+        return '\n'.join(lines)
+
+    def results(self):
+        """Returns the metrics of report().
+
+        @return {'cpu': {cpu: {metric: value}}} and, if a process is
+        profiled, 'thread': {tid: {metric: value}}. The names of the threads
+        are in self.thread_names.
+        """
+        results = {'cpu': self.cpu_summary()}
+        if self.pid is not None:
+            results['thread'] = self._totals(self.thread_deltas(), self.tids)
+        return results
+
+
+def schedstat_top_data(profilers):
+    """Collects the summaries of SchedStatProfilers for
+    perftest.trans_top_data_to_curves().
+
+    @param profilers {threads: SchedStatProfiler}
+    @return {threads: {metric: value}}
+    """
+    return dict((threads, prof.summary())
+                for threads, prof in profilers.items())
+
+
+class AllocationProfiler(SamplingProfiler):
+    """Profiles the memory allocations of Python code in this process with
+    tracemalloc.
+
+    It takes snapshots at start() and stop(), and every 'interval' seconds
+    in between if an interval is given. The peak traced memory is tracked
+    across the whole run.
+
+    Usage:
+    >>> prof = AllocationProfiler()
+    >>> prof.start()
+    >>> result = build_result_tree()
+    >>> prof.stop()
+    >>> prof.diff(topn=5)
+    """
+    # Excludes the allocations of tracemalloc itself and of imports.
+    FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap_'
+                                         'external>'),
+               tracemalloc.Filter(False, '<unknown>')]
+    # start() and stop() turn tracing on and off.
+    SAMPLE_ONLY = False
+
+    def __init__(self, interval=0, **kwargs):
+        """@param interval the snapshot interval in seconds. 0 only takes
+        snapshots at start() and stop().
+
+        Optional parameters:
+        @param frames the number of frames to keep for each allocation
+        (default: 1). Use more frames to group by tracebacks.
+        """
+        super(AllocationProfiler, self).__init__(interval)
+        self.frames = kwargs.get('frames', 1)
+        self.tracing_ = False
+        self.reset()
+
+    def reset(self):
+        # [(time, tracemalloc.Snapshot)]
+        self.snapshots = []
+        # [(time, current traced bytes, peak traced bytes)]
+        self.memory = []
+        self.peak = 0
+
+    def sample(self, now=None):
+        """Takes a snapshot of the traced allocations.
+        """
+        if now is None:
+            now = time.time()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        self.snapshots.append((now, snapshot))
+        self.memory.append((now, current, peak))
+
+    def start(self):
+        """Starts tracing the allocations (if they are not traced yet) and
+        takes the first snapshot.
+        """
+        self.tracing_ = not tracemalloc.is_tracing()
+        if self.tracing_:
+            tracemalloc.start(self.frames)
+        else:
+            tracemalloc.reset_peak()
+        if self.interval:
+            super(AllocationProfiler, self).start()
+        else:
+            self.reset()
+            self.sample()
+
+    def stop(self):
+        """Takes the last snapshot and stops tracing if start() started it.
+        """
+        if self.interval:
+            super(AllocationProfiler, self).stop()
+        else:
+            self.sample()
+        if self.tracing_:
+            tracemalloc.stop()
+            self.tracing_ = False
+
+    def top_sites(self, snapshot=-1, by='size', topn=10, **kwargs):
+        """Returns the allocation sites that hold the most memory.
+
+        @param snapshot the index of the snapshot (default: the last).
+        @param by 'size' or 'count'.
+        @param topn returns the top N sites.
+
+        Optional parameters:
+        @param key_type 'lineno' (default), 'filename' or 'traceback'.
+        @return [(site, size in bytes, count), ...].
+        """
+        if by not in ('size', 'count'):
+            raise ValueError('Unknown order: {}'.format(by))
+        stats = self.snapshots[snapshot][1].statistics(
+            kwargs.get('key_type', 'lineno'))
+        if by == 'count':
+            stats.sort(key=lambda stat: -stat.count)
+        return [(_site_name(stat.traceback), stat.size, stat.count)
+                for stat in stats[:topn]]
+
+    def diff(self, first=0, second=-1, topn=10, **kwargs):
+        """Compares two snapshots.
+
+        @param first the index of the old snapshot (default: the first).
+        @param second the index of the new snapshot (default: the last).
+        @param topn returns the top N sites.
+
+        Optional parameters:
+        @param key_type see top_sites().
+        @return [(site, size diff, count diff, size, count), ...] in
+        descending order of the absolute size diff.
+        """
+        stats = self.snapshots[second][1].compare_to(
+            self.snapshots[first][1], kwargs.get('key_type', 'lineno'))
+        return [(_site_name(stat.traceback), stat.size_diff,
+                 stat.count_diff, stat.size, stat.count)
+                for stat in stats[:topn]]
+
+    def report(self):
+        if not self.snapshots:
+            return ''
+        lines = ['# peak: {} bytes, snapshots: {}'.format(
+            self.peak, len(self.snapshots))]
+        lines.append('# top sites by size: size count')
+        for site, size, count in self.top_sites():
+            lines.append('{} {} {}'.format(site, size, count))
+        lines.append('# growth from the first snapshot: size-diff '
+                     'count-diff size count')
+        for row in self.diff():
+            lines.append('{} {:+d} {:+d} {} {}'.format(*row))
+        return '\n'.join(lines)
+
+    def results(self, topn=10):
+        """Returns the data of report().
+
+        @param topn the number of sites.
+        @return {'peak': bytes, 'top-sites': top_sites(), 'growth': diff()},
+        or {} if there is no snapshot.
+        """
+        if not self.snapshots:
+            return {}
+        return {'peak': self.peak, 'top-sites': self.top_sites(topn=topn),
+                'growth': self.diff(topn=topn)}
+
+
+def _site_name(traceback):
+    """Formats a tracemalloc.Traceback: 'file.py:12' or, with several
+    frames, 'a.py:3;b.py:12' from the root to the allocation.
+    """
+    return ';'.join('{}:{}'.format(frame.filename, frame.lineno)
+                    for frame in reversed(traceback))
+
+
+class PythonProfiler(Profiler):
+    """A statistical profiler of Python code in this process.
+
+    A timer signal ('signal.setitimer') periodically interrupts the main
+    thread, which then captures the stacks of all threads with
+    sys._current_frames() and aggregates them into flamegraph.FoldedStacks.
+    Each code object is interned once, so a sample costs one tuple of frame
+    ids. The time spent in sampling is reported as 'overhead'.
+
+    It must be started and stopped from the main thread.
+
+    Usage:
+    >>> prof = PythonProfiler(rate=200)
+    >>> prof.start()
+    >>> run_analysis()
+    >>> prof.stop()
+    >>> flamegraph.write_flamegraph(prof.stacks, 'analysis.svg')
+    """
+    TIMERS = {'cpu': (signal.ITIMER_PROF, signal.SIGPROF),
+              'wall': (signal.ITIMER_REAL, signal.SIGALRM)}
+
+    def __init__(self, rate=100, **kwargs):
+        """@param rate the number of samples per second.
+
+        Optional parameters:
+        @param mode 'cpu' (default) samples every 1/rate seconds of CPU time
+        of the process, 'wall' every 1/rate seconds of wall time.
+        @param threads sets to False to only sample the main thread
+        (default: True).
+        @param max_stacks see flamegraph.FoldedStacks.
+        """
+        self.rate = rate
+        self.mode = kwargs.get('mode', 'cpu')
+        if self.mode not in self.TIMERS:
+            raise ValueError('Unknown mode: {}'.format(self.mode))
+        self.all_threads = kwargs.get('threads', True)
+        self.max_stacks = kwargs.get('max_stacks', 0)
+        self.stacks = flamegraph.FoldedStacks(self.max_stacks)
+        self.samples = 0
+        self.overhead = 0.0
+        self.duration = 0.0
+        self.code_ids_ = {}
+        self.thread_names_ = {}
+        self.previous_handler_ = None
+        self.start_time_ = None
+
+    def _frame_id(self, code):
+        fid = self.code_ids_.get(code)
+        if fid is None:
+            fid = self.stacks.intern('{} ({}:{})'.format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno))
+            self.code_ids_[code] = fid
+        return fid
+
+    def _thread_id(self, ident):
+        fid = self.thread_names_.get(ident)
+        if fid is None:
+            names = dict((thread.ident, thread.name)
+                         for thread in threading.enumerate())
+            fid = self.stacks.intern(names.get(ident, str(ident)))
+            self.thread_names_[ident] = fid
+        return fid
+
+    def _sample(self, signum, frame):
+        begin = time.perf_counter()
+        code_ids = self.code_ids_
+        frame_id = self._frame_id
+        main = threading.main_thread().ident
+        if self.all_threads:
+            frames = sys._current_frames()
+        else:
+            frames = {main: frame}
+        # The handler itself is on top of the interrupted main thread.
+        frames[main] = frame
+        for ident, top in frames.items():
+            ids = []
+            while top is not None:
+                code = top.f_code
+                fid = code_ids.get(code)
+                ids.append(frame_id(code) if fid is None else fid)
+                top = top.f_back
+            ids.append(self._thread_id(ident))
+            ids.reverse()
+            self.stacks.add_ids(tuple(ids))
+        self.samples += 1
+        self.overhead += time.perf_counter() - begin
+
+    def start(self):
+        """Starts sampling.
+        """
+        self.stacks = flamegraph.FoldedStacks(self.max_stacks)
+        self.samples = 0
+        self.overhead = 0.0
+        self.code_ids_ = {}
+        self.thread_names_ = {}
+        timer, signum = self.TIMERS[self.mode]
+        self.previous_handler_ = signal.signal(signum, self._sample)
+        self.start_time_ = time.perf_counter()
+        interval = 1.0 / self.rate
+        signal.setitimer(timer, interval, interval)
+
+    def stop(self):
+        """Stops sampling.
+        """
+        if self.start_time_ is None:
+            return
+        timer, signum = self.TIMERS[self.mode]
+        signal.setitimer(timer, 0)
+        signal.signal(signum, self.previous_handler_ or signal.SIG_DFL)
+        self.duration = time.perf_counter() - self.start_time_
+        self.start_time_ = None
+
+    def top_functions(self, topn=10):
+        """Returns the functions with the most samples on top of the stacks.
+
+        @return [(function, samples), ...] in descending order.
+        """
+        counts = {}
+        frames = self.stacks.frames
+        for key, count in self.stacks.counts.items():
+            leaf = frames[key[-1]]
+            counts[leaf] = counts.get(leaf, 0) + count
+        return sorted(counts.items(), key=lambda item: -item[1])[:topn]
+
+    def report(self):
+        total = self.stacks.total() or 1
+        lines = ['# samples: {} overhead: {:.6f}s ({:.2f}% of {:.3f}s)'
+                 .format(self.samples, self.overhead,
+                         100.0 * self.overhead / self.duration
+                         if self.duration else 0, self.duration)]
+        for function, count in self.top_functions(20):
+            lines.append('{:>8.2f}% {}'.format(100.0 * count / total,
+                                               function))
+        return '\n'.join(lines)
+
+    def results(self, topn=20):
+        """Returns the data of report().
+
+        @param topn the number of functions.
+        @return {'samples', 'overhead', 'duration', 'top-functions':
+        top_functions(), 'stacks': the flamegraph.FoldedStacks}.
+        """
+        return {'samples': self.samples, 'overhead': self.overhead,
+                'duration': self.duration,
+                'top-functions': self.top_functions(topn),
+                'stacks': self.stacks}
+
+    def dump(self, outfile):
+        """Dumps the stacks in the folded format, which
+        flamegraph.load_folded() reads.
+
+        @param outfile it can be a file object or a string file path.
+        """
+        self.stacks.dump(outfile)
+
+
+class CompositeProfiler(Profiler):
+    """Runs several Profilers around one run of a workload.
+
+    An asyncio event loop in a background thread starts and stops the child
+    profilers concurrently in a thread pool, launches the workload once and
+    samples all SamplingProfilers on one shared clock instead of their own
+    threads. ProcessProfilers are attached to the workload. The CPU time that
+    each child profiler consumes is recorded in 'overhead'.
+
+    SamplingProfilers whose SAMPLE_ONLY is False (e.g. AllocationProfiler)
+    are started and stopped like the other profilers instead. PythonProfiler
+    is not supported, since it must be started from the main thread.
+
+    Usage:
+    >>> prof = CompositeProfiler([LockstatProfiler(), DiskStatsProfiler()])
+    >>> prof.start('postmark config.pm')  # Returns once all have started.
+    >>> prof.stop()  # Waits for the workload to finish.
+    """
+    def __init__(self, profilers, interval=1.0):
+        """@param profilers a list of Profiler objects.
+        @param interval the sampling interval in seconds.
+        """
+        self.profilers = list(profilers)
+        for prof in self.profilers:
+            if isinstance(prof, PythonProfiler):
+                raise ValueError('PythonProfiler must be started from the '
+                                 'main thread, not by CompositeProfiler')
+        self.interval = interval
+        self.returncode = None
+        # [{'cpu-time': seconds, 'wall-time': seconds, 'calls': N}], one for
+        # each child profiler.
+        self.overhead = []
+        self.thread_ = None
+        self.loop_ = None
+        self.stop_event_ = None
+        self.started_ = threading.Event()
+        self.error_ = None
+
+    def _call(self, index, func, *args):
+        """Calls func() and accounts its cost to the index-th profiler.
+        """
+        wall_time = time.time()
+        cpu_time = time.thread_time()
+        try:
+            return func(*args)
+        finally:
+            overhead = self.overhead[index]
+            overhead['cpu-time'] += time.thread_time() - cpu_time
+            overhead['wall-time'] += time.time() - wall_time
+            overhead['calls'] += 1
+
+    async def _gather(self, indices, method, *args, **kwargs):
+        """Calls the method of the selected profilers concurrently. It waits
+        for all calls and then raises the first error, if any.
+
+        Optional parameters:
+        @param done a list to which the indices of the profilers whose calls
+        succeeded are appended.
+        """
+        done = kwargs.get('done', None)
+        calls = [self.loop_.run_in_executor(None, functools.partial(
+            self._call, i, getattr(self.profilers[i], method), *args))
+            for i in indices]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        errors = []
+        for i, result in zip(indices, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+            elif done is not None:
+                done.append(i)
+        if errors:
+            raise errors[0]
+
+    async def _main(self, cmd):
+        self.loop_ = asyncio.get_event_loop()
+        self.stop_event_ = asyncio.Event()
+        samplers = [i for i, prof in enumerate(self.profilers)
+                    if isinstance(prof, SamplingProfiler) and
+                    prof.SAMPLE_ONLY]
+        others = [i for i in range(len(self.profilers)) if i not in samplers]
+        started = []
+        workload = None
+        try:
+            try:
+                await self._gather(samplers, 'reset')
+                await self._gather(others, 'start', done=started)
+                if cmd:
+                    # In its own process group, to be killed as a whole.
+                    workload = await asyncio.create_subprocess_shell(
+                        cmd, start_new_session=True)
+                    for i in samplers:
+                        if isinstance(self.profilers[i], ProcessProfiler):
+                            self.profilers[i].pid = workload.pid
+                await self._gather(samplers, 'sample', time.time())
+            finally:
+                self.started_.set()
+
+            # Profiling ends when stop() is called and the workload has
+            # exited.
+            pending = [asyncio.ensure_future(self.stop_event_.wait())]
+            if workload:
+                pending.append(asyncio.ensure_future(workload.wait()))
+            next_tick = self.loop_.time() + self.interval
+            while pending:
+                _, pending = await asyncio.wait(
+                    pending, timeout=max(0, next_tick - self.loop_.time()))
+                if self.loop_.time() >= next_tick:
+                    await self._gather(samplers, 'sample', time.time())
+                    while next_tick <= self.loop_.time():
+                        next_tick += self.interval
+            if workload:
+                self.returncode = workload.returncode
+            await self._gather(samplers, 'sample', time.time())
+        except Exception as err:
+            self.error_ = err
+            raise
+        finally:
+            await self._cleanup(workload, started)
+
+    async def _cleanup(self, workload, started):
+        """Reaps the workload, which is killed if profiling failed, and stops
+        the other profilers that have started.
+        """
+        if workload is not None:
+            if workload.returncode is None:
+                try:
+                    os.killpg(workload.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            await workload.wait()
+        try:
+            await self._gather(started, 'stop')
+        except Exception as err:
+            # Does not hide the error that ended profiling.
+            if not self.error_:
+                self.error_ = err
+                raise
+
+    def _run(self, cmd):
+        try:
+            asyncio.run(self._main(cmd))
+        except Exception as err:
+            if not self.error_:
+                self.error_ = err
+
+    def start(self, cmd=''):
+        """Starts all profilers and then launches the workload.
+
+        @param cmd the workload command. It does not block.
+        """
+        self.returncode = None
+        self.error_ = None
+        self.overhead = [{'cpu-time': 0.0, 'wall-time': 0.0, 'calls': 0}
+                         for _ in self.profilers]
+        self.started_.clear()
+        self.thread_ = threading.Thread(target=self._run, args=(cmd,))
+        self.thread_.daemon = True
+        self.thread_.start()
+        self.started_.wait()
+        if self.error_:
+            self.thread_.join()
+            self.thread_ = None
+            raise self.error_
+
+    def stop(self):
+        """Waits for the workload to finish and stops all profilers.
+
+        It raises the first error of the profilers, if any. The workload is
+        then killed rather than waited for.
+        """
+        if not self.thread_:
+            return
+        # The loop has already ended if profiling failed.
+        if self.thread_.is_alive() and not self.loop_.is_closed():
+            try:
+                self.loop_.call_soon_threadsafe(self.stop_event_.set)
+            except RuntimeError:
+                # The loop closed meanwhile.
+                pass
+        self.thread_.join()
+        self.thread_ = None
+        if self.error_:
+            raise self.error_
+
+    def report(self):
+        sections = []
+        for prof, overhead in zip(self.profilers, self.overhead):
+            sections.append(
+                '# {}: cpu-time {:.6f}s wall-time {:.6f}s calls {}'.format(
+                    type(prof).__name__, overhead['cpu-time'],
+                    overhead['wall-time'], overhead['calls']))
+            sections.append(prof.report() or '')
+        return '\n'.join(sections)
+
+    def results(self):
+        """Returns the results of the child profilers, in their order.
+        """
+        return [prof.results() for prof in self.profilers]
@@ -0,0 +1,872 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.profiler
+"""
+
+from pyro import flamegraph, perftest, profiler
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+
+DISKSTATS_BEFORE = """\
+   8       0 sda 1000 10 8000 500 2000 20 16000 1500 0 1000 2000 0 0 0 0
+   8      16 sdb 100 0 800 50 0 0 0 0 0 50 50 0 0 0 0
+   7       0 loop0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+"""
+
+DISKSTATS_AFTER = """\
+   8       0 sda 1100 10 8800 600 2300 20 18400 2100 2 1500 2700 0 0 0 0
+   8      16 sdb 100 0 800 50 0 0 0 0 0 50 50 0 0 0 0
+   7       0 loop0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+"""
+
+DISKSTATS_LAST = """\
+   8       0 sda 1300 10 10400 800 2300 20 18400 2100 0 2000 3100 0 0 0 0
+   8      16 sdb 150 0 1200 100 0 0 0 0 0 100 100 0 0 0 0
+   7       0 loop0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+"""
+
+
+class TestDiskStatsProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.diskstats = os.path.join(self.tmpdir, 'diskstats')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def sample(self, prof, content, now):
+        with open(self.diskstats, 'w') as fobj:
+            fobj.write(content)
+        prof.sample(now=now)
+
+    def test_series(self):
+        prof = profiler.DiskStatsProfiler(['sda', 'sdb'],
+                                          diskstats=self.diskstats)
+        self.sample(prof, DISKSTATS_BEFORE, 10.0)
+        self.sample(prof, DISKSTATS_AFTER, 12.0)
+        self.sample(prof, DISKSTATS_LAST, 13.0)
+
+        series = prof.series()
+        self.assertEqual((2, 2), series.shape)
+        self.assertEqual([12.0, 13.0], list(series['time'][:, 0]))
+        sda = series[:, 0]
+        self.assertEqual([50.0, 200.0], list(sda['r-iops']))
+        self.assertEqual([150.0, 0.0], list(sda['w-iops']))
+        # 800 sectors in 2 seconds.
+        self.assertEqual(200.0, sda['r-kbps'][0])
+        self.assertEqual(600.0, sda['w-kbps'][0])
+        # 3200 sectors (1600 KB) in 400 requests.
+        self.assertEqual(4.0, sda['avg-req-kb'][0])
+        self.assertEqual(700.0 / 400, sda['await-ms'][0])
+        self.assertEqual(0.35, sda['queue-depth'][0])
+        self.assertEqual(0.25, sda['util'][0])
+
+        latest = prof.latest()
+        self.assertEqual(200.0, latest['sda']['r-iops'])
+        self.assertEqual(50.0, latest['sdb']['r-iops'])
+        # Idle intervals do not divide by zero.
+        self.assertEqual(0.0, series[0, 1]['avg-req-kb'])
+        self.assertEqual(0.0, series[0, 1]['await-ms'])
+
+    def test_summary(self):
+        prof = profiler.DiskStatsProfiler(diskstats=self.diskstats)
+        self.sample(prof, DISKSTATS_BEFORE, 0.0)
+        self.sample(prof, DISKSTATS_AFTER, 1.0)
+        self.sample(prof, DISKSTATS_LAST, 2.0)
+        self.assertEqual(['loop0', 'sda', 'sdb'], prof.devices)
+
+        summary = prof.summary()
+        self.assertEqual(150.0, summary['sda']['r-iops'])
+        self.assertEqual(150.0, summary['sda']['w-iops'])
+        self.assertEqual(25.0, summary['sdb']['r-iops'])
+        self.assertEqual(0.0, summary['loop0']['await-ms'])
+        self.assertEqual(summary, prof.results())
+        self.assertTrue(prof.report().startswith('device r-iops'))
+
+    def test_missing_device(self):
+        prof = profiler.DiskStatsProfiler(['nvme0n1'],
+                                          diskstats=self.diskstats)
+        self.assertRaises(ValueError, self.sample, prof,
+                          DISKSTATS_BEFORE, 0.0)
+
+    def test_start_stop(self):
+        with open(self.diskstats, 'w') as fobj:
+            fobj.write(DISKSTATS_BEFORE)
+        prof = profiler.DiskStatsProfiler(['sda'], interval=0.01,
+                                          diskstats=self.diskstats)
+        prof.start()
+        prof.stop()
+        self.assertTrue(len(prof.series()) >= 1)
+
+    def test_sampling_error(self):
+        with open(self.diskstats, 'w') as fobj:
+            fobj.write(DISKSTATS_BEFORE)
+        prof = profiler.DiskStatsProfiler(['sda'], interval=0.01,
+                                          diskstats=self.diskstats)
+        prof.start()
+        os.remove(self.diskstats)
+        prof.thread_.join(5)
+        self.assertFalse(prof.thread_.is_alive())
+        self.assertRaises(IOError, prof.stop)
+        # The error is only raised once.
+        with open(self.diskstats, 'w') as fobj:
+            fobj.write(DISKSTATS_AFTER)
+        prof.stop()
+        self.assertEqual(2, len(prof.samples()))
+
+    def test_recover_from_log(self):
+        log = os.path.join(self.tmpdir, 'disk.log')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                prof = profiler.DiskStatsProfiler(diskstats=self.diskstats,
+                                                  log=log)
+                self.sample(prof, DISKSTATS_BEFORE, 10.0)
+                self.sample(prof, DISKSTATS_AFTER, 12.0)
+                os.kill(os.getpid(), signal.SIGKILL)
+            finally:
+                os._exit(1)
+        os.waitpid(pid, 0)
+
+        prof = profiler.DiskStatsProfiler.from_log(
+            log, diskstats=self.diskstats)
+        self.assertEqual(['loop0', 'sda', 'sdb'], prof.devices)
+        self.assertEqual([10.0, 12.0], prof.samples()['time'].tolist())
+        self.assertEqual(50.0, prof.summary()['sda']['r-iops'])
+
+
+def write_fake_proc(root, pid, ppid, comm, utime, rss, **kwargs):
+    """Writes the /proc/<pid> files read by ProcessProfiler.
+    """
+    piddir = os.path.join(root, str(pid))
+    if not os.path.exists(piddir):
+        os.makedirs(piddir)
+    stat = [pid, '({})'.format(comm), 'S', ppid] + [0] * 9 + \
+        [utime, kwargs.get('stime', 0)] + [0] * 4 + \
+        [kwargs.get('threads', 1), 0, kwargs.get('starttime', 100)]
+    with open(os.path.join(piddir, 'stat'), 'w') as fobj:
+        fobj.write(' '.join(str(x) for x in stat) + '\n')
+    with open(os.path.join(piddir, 'status'), 'w') as fobj:
+        fobj.write('Name:\t{}\nVmHWM:\t{} kB\nVmRSS:\t{} kB\n'
+                   'voluntary_ctxt_switches:\t{}\n'
+                   'nonvoluntary_ctxt_switches:\t{}\n'.format(
+                       comm, kwargs.get('hwm', rss), rss,
+                       kwargs.get('vcsw', 0), kwargs.get('ivcsw', 0)))
+    with open(os.path.join(piddir, 'io'), 'w') as fobj:
+        fobj.write('read_bytes: {}\nwrite_bytes: {}\n'.format(
+            kwargs.get('read_bytes', 0), kwargs.get('write_bytes', 0)))
+
+
+LOCKSTAT_HEADER = """\
+lock_stat version 0.3
+-------------------------------------------------------------------------
+                              class name    con-bounces    contentions   \
+waittime-min   waittime-max waittime-total    acq-bounces   acquisitions   \
+holdtime-min   holdtime-max holdtime-total
+-------------------------------------------------------------------------
+"""
+
+LOCKSTAT_SNAPSHOTS = [
+    LOCKSTAT_HEADER + """
+                    &(&sb->s_lock)->rlock:    1    10    0.10    1.00    \
+20.00    5    100    0.05    2.00    50.00
+                    --------------------
+                    &(&sb->s_lock)->rlock    10    [<ffffffff811b1234>] dput+0x34/0x1d0
+""",
+    LOCKSTAT_HEADER + """
+                    &(&sb->s_lock)->rlock:    2    30    0.10    2.00    \
+80.00    6    300    0.05    2.00    150.00
+                                &rq->lock:    0     0    0.00    0.00    \
+ 0.00    1    50    0.10    1.00    10.00
+""",
+    LOCKSTAT_HEADER + """
+                    &(&sb->s_lock)->rlock:    2    30    0.10    2.00    \
+80.00    6    400    0.05    2.00    160.00
+                                &rq->lock:    0     5    0.00    3.00    \
+15.00    1    60    0.10    1.00    12.00
+""",
+]
+
+
+class TestLockstatProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lockstat = os.path.join(self.tmpdir, 'lock_stat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def take_snapshots(self, prof):
+        for i, snapshot in enumerate(LOCKSTAT_SNAPSHOTS):
+            with open(self.lockstat, 'w') as fobj:
+                fobj.write(snapshot)
+            prof.sample(now=float(i))
+
+    def test_parse_snapshot(self):
+        fields, names, values = profiler.parse_lockstat_snapshot(
+            LOCKSTAT_SNAPSHOTS[1])
+        self.assertEqual(profiler.LockstatSeries.FIELDS, fields)
+        self.assertEqual(['&(&sb->s_lock)->rlock', '&rq->lock'], names)
+        self.assertEqual((2, 10), values.shape)
+        self.assertEqual(300, values[0, 6])
+
+    def test_interval_stats(self):
+        prof = profiler.LockstatProfiler(interval=1, lockstat=self.lockstat)
+        self.take_snapshots(prof)
+        series = prof.series
+        self.assertEqual(['&(&sb->s_lock)->rlock', '&rq->lock'],
+                         series.classes)
+        self.assertEqual([[100, 0], [300, 50], [400, 60]],
+                         series.column('acquisitions').tolist())
+
+        stats = series.interval_stats()
+        self.assertEqual([1.0, 2.0], list(stats['time']))
+        self.assertEqual([[20, 0], [0, 5]], stats['contentions'].tolist())
+        self.assertEqual([[60, 0], [0, 15]],
+                         stats['waittime-total'].tolist())
+        self.assertEqual([[3.0, 0], [0, 3.0]],
+                         stats['waittime-avg'].tolist())
+        self.assertEqual([[0.5, 0.2], [0.1, 0.2]],
+                         stats['holdtime-avg'].tolist())
+        self.assertRaises(ValueError, series.deltas, 'waittime-max')
+
+        totals = series.totals()
+        self.assertEqual(20, totals['&(&sb->s_lock)->rlock']['contentions'])
+        self.assertEqual(60, totals['&rq->lock']['acquisitions'])
+        self.assertEqual(3.0, totals['&rq->lock']['waittime-max'])
+        results = prof.results()
+        self.assertEqual(['rq->lock', 'sb->s_lock)->rlock'], sorted(results))
+        self.assertEqual(totals['&rq->lock'], results['rq->lock'])
+        self.assertTrue('&rq->lock:' in prof.report())
+
+        latest = prof.latest()
+        self.assertEqual(0, latest['&(&sb->s_lock)->rlock']['contentions'])
+        self.assertEqual(5, latest['&rq->lock']['contentions'])
+        self.assertEqual(3.0, latest['&rq->lock']['waittime-avg'])
+        self.assertEqual(0.2, latest['&rq->lock']['holdtime-avg'])
+
+    def test_recover_from_log(self):
+        log = os.path.join(self.tmpdir, 'lockstat.log')
+        prof = profiler.LockstatProfiler(interval=1, lockstat=self.lockstat,
+                                         log=log)
+        self.take_snapshots(prof)
+        results = prof.results()
+        prof.close_log()
+
+        prof = profiler.LockstatProfiler.from_log(log)
+        self.assertEqual(['&(&sb->s_lock)->rlock', '&rq->lock'],
+                         prof.series.classes)
+        self.assertEqual([0.0, 1.0, 2.0], prof.series.times.tolist())
+        self.assertEqual(results, prof.results())
+        self.assertEqual(5, prof.latest()['&rq->lock']['contentions'])
+        prof.close_log()
+
+    def test_too_many_classes(self):
+        series = profiler.LockstatSeries(max_classes=1)
+        self.assertRaises(ValueError, series.add, 0,
+                          LOCKSTAT_SNAPSHOTS[1])
+        self.assertEqual(0, len(series))
+
+    def test_cleared_between_snapshots(self):
+        series = profiler.LockstatSeries()
+        text = LOCKSTAT_SNAPSHOTS[0]
+        series.add(0, text)
+        series.add(1, text.replace('    100    ', '    400    '))
+        series.add(2, text.replace('    100    ', '    40    '))
+        self.assertEqual([[300], [40]],
+                         series.deltas('acquisitions').tolist())
+
+    def test_clear_mode(self):
+        with open(self.lockstat, 'w') as fobj:
+            fobj.write(LOCKSTAT_SNAPSHOTS[0])
+        prof = profiler.LockstatProfiler(lockstat=self.lockstat)
+        prof.start()
+        with open(self.lockstat) as fobj:
+            self.assertEqual('0\n', fobj.read())
+        prof.stop()
+        self.assertEqual('0\n', prof.report())
+        self.assertEqual({}, prof.results())
+
+    def test_results(self):
+        prof = profiler.LockstatProfiler(lockstat=self.lockstat)
+        prof.start()
+        with open(self.lockstat, 'w') as fobj:
+            fobj.write(LOCKSTAT_SNAPSHOTS[0] + '&rq->lock:' +
+                       ' 0' * 10 + '\n')
+        prof.stop()
+        # The same as parsing the dumped report.
+        parsed = perftest.parse_lockstat_data(prof.report().encode('utf-8'))
+        self.assertEqual(parsed, prof.results())
+
+
+class TestProcStatProfiler(unittest.TestCase):
+    def test_results(self):
+        prof = profiler.ProcStatProfiler()
+        self.assertEqual({}, prof.results())
+        prof.before = 'cpu  100 5 50 1000 10 1 2 0 0 0\n'
+        prof.after = 'cpu  160 5 80 1400 30 2 2 0 0 0\n'
+        results = prof.results()
+        self.assertEqual(perftest.parse_procstat_data(
+            (prof.before + prof.after).encode('utf-8')),
+            dict((key, results[key])
+                 for key in ['user', 'system', 'idle', 'iowait']))
+        self.assertEqual(100, results['irq'])
+        self.assertEqual('cpu 60 0 30 400 20 1 0 0 0 0\n', prof.report())
+
+
+class TestProcessProfiler(unittest.TestCase):
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+
+    def test_process_tree(self):
+        ticks = os.sysconf('SC_CLK_TCK')
+        write_fake_proc(self.proc, 10, 1, 'bench (main)', ticks, 1000,
+                        threads=4, vcsw=5, read_bytes=4096)
+        write_fake_proc(self.proc, 11, 10, 'worker', 2 * ticks, 500,
+                        hwm=3000, ivcsw=7, write_bytes=8192)
+        write_fake_proc(self.proc, 12, 11, 'worker', 0, 100)
+        # Unrelated process.
+        write_fake_proc(self.proc, 20, 1, 'other', 100 * ticks, 9999)
+
+        prof = profiler.ProcessProfiler(pid=10, proc=self.proc)
+        prof.sample(now=1.0)
+        # The grandchild exits and its CPU time must not be lost.
+        write_fake_proc(self.proc, 12, 11, 'worker', ticks, 100)
+        prof.sample(now=2.0)
+        shutil.rmtree(os.path.join(self.proc, '12'))
+        prof.sample(now=3.0)
+
+        series = prof.series()
+        self.assertEqual([1.0, 2.0, 3.0], list(series['time']))
+        self.assertEqual([3.0, 4.0, 4.0], list(series['cpu-time']))
+        self.assertEqual([1600, 1600, 1500], list(series['rss-kb']))
+        self.assertEqual([6, 6, 5], list(series['threads']))
+        self.assertEqual([3, 3, 2], list(series['processes']))
+        self.assertEqual(4.0, prof.latest()['cpu-time'])
+        self.assertEqual(2, prof.latest()['processes'])
+
+        summary = prof.summary()
+        self.assertEqual(4096, summary['read-bytes'])
+        self.assertEqual(8192, summary['write-bytes'])
+        self.assertEqual(5, summary['voluntary-ctxt'])
+        self.assertEqual(7, summary['nonvoluntary-ctxt'])
+        self.assertEqual(3000, summary['peak-rss-kb'])
+
+    def test_launch_command(self):
+        prof = profiler.ProcessProfiler(interval=0.01)
+        prof.start('{} -c "import time; time.sleep(0.1)"'.format(
+            sys.executable))
+        prof.stop()
+        self.assertEqual(0, prof.returncode)
+        self.assertTrue(prof.rusage['ru_maxrss'] > 0)
+        self.assertTrue(len(prof.series()) >= 2)
+        self.assertTrue('ru_maxrss' in prof.report())
+
+    def test_no_target(self):
+        prof = profiler.ProcessProfiler()
+        self.assertRaises(ValueError, prof.start)
+
+
+SCHEDSTAT = """\
+version 15
+timestamp 4295000000
+cpu0 0 0 100 10 50 20 {} {} {}
+domain0 00000003 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+cpu1 0 0 100 10 50 20 {} {} {}
+domain0 00000003 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+"""
+
+
+class TestSchedStatProfiler(unittest.TestCase):
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        self.schedstat = os.path.join(self.proc, 'schedstat')
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+
+    def write_cpus(self, cpu0, cpu1):
+        with open(self.schedstat, 'w') as fobj:
+            fobj.write(SCHEDSTAT.format(*(cpu0 + cpu1)))
+
+    def write_task(self, tid, name, run, wait, timeslices):
+        taskdir = os.path.join(self.proc, '10', 'task', str(tid))
+        if not os.path.exists(taskdir):
+            os.makedirs(taskdir)
+        with open(os.path.join(taskdir, 'comm'), 'w') as fobj:
+            fobj.write(name + '\n')
+        with open(os.path.join(taskdir, 'schedstat'), 'w') as fobj:
+            fobj.write('{} {} {}\n'.format(run, wait, timeslices))
+
+    def test_cpus(self):
+        prof = profiler.SchedStatProfiler(schedstat=self.schedstat)
+        self.write_cpus((10 ** 9, 0, 100), (0, 0, 0))
+        prof.sample(now=1.0)
+        self.write_cpus((2 * 10 ** 9, 10 ** 9, 200), (10 ** 9, 0, 50))
+        prof.sample(now=2.0)
+        self.assertEqual(['cpu0', 'cpu1'], prof.cpus)
+
+        series = prof.cpu_series()
+        self.assertEqual((1, 2), series.shape)
+        self.assertEqual([1.0, 1.0], series['run-time'][0].tolist())
+        self.assertEqual([1.0, 0.0], series['wait-time'][0].tolist())
+        self.assertEqual([0.5, 0.0], series['wait-ratio'][0].tolist())
+        self.assertEqual([10.0, 0.0], series['latency-ms'][0].tolist())
+        summary = prof.summary()
+        self.assertEqual(2.0, summary['run-time'])
+        self.assertEqual(150, summary['timeslices'])
+        self.assertAlmostEqual(1.0 / 3, summary['wait-ratio'])
+        self.assertEqual(50, prof.cpu_summary()['cpu1']['timeslices'])
+
+    def test_threads(self):
+        self.write_cpus((0, 0, 0), (0, 0, 0))
+        prof = profiler.SchedStatProfiler(pid=10, proc=self.proc,
+                                          schedstat=self.schedstat)
+        self.write_task(10, 'main', 100, 0, 1)
+        self.write_task(11, 'worker', 1000, 500, 5)
+        prof.sample(now=1.0)
+        # A new thread starts and another one exits.
+        self.write_task(10, 'main', 300, 100, 2)
+        self.write_task(12, 'worker', 400, 400, 4)
+        shutil.rmtree(os.path.join(self.proc, '10', 'task', '11'))
+        prof.sample(now=2.0)
+        self.write_task(10, 'main', 500, 100, 3)
+        prof.sample(now=3.0)
+
+        self.assertEqual([10, 11, 12], prof.tids)
+        deltas = prof.thread_deltas()
+        self.assertEqual([[200, 100, 1], [0, 0, 0], [400, 400, 4]],
+                         deltas[0].tolist())
+        self.assertEqual([[200, 0, 1], [0, 0, 0], [0, 0, 0]],
+                         deltas[1].tolist())
+        self.assertEqual((2, 3), prof.thread_series().shape)
+
+        threads = prof.thread_summary()
+        self.assertEqual('worker', threads[12]['name'])
+        self.assertAlmostEqual(1e-4, threads[12]['latency-ms'])
+        summary = prof.summary()
+        self.assertEqual(800 / 1e9, summary['run-time'])
+        self.assertEqual(6, summary['timeslices'])
+        self.assertTrue('12/worker' in prof.report())
+
+        results = prof.results()
+        self.assertEqual(prof.cpu_summary(), results['cpu'])
+        self.assertEqual([10, 11, 12], sorted(results['thread']))
+        self.assertEqual(threads[12]['run-time'],
+                         results['thread'][12]['run-time'])
+
+    def test_recover_threads(self):
+        self.write_cpus((0, 0, 0), (0, 0, 0))
+        log = os.path.join(self.proc, 'schedstat.log')
+        prof = profiler.SchedStatProfiler(pid=10, proc=self.proc,
+                                          schedstat=self.schedstat, log=log)
+        self.write_task(10, 'main', 100, 0, 1)
+        prof.sample(now=1.0)
+        self.write_task(10, 'main', 300, 100, 2)
+        self.write_task(11, 'worker', 400, 400, 4)
+        prof.sample(now=2.0)
+        prof.close_log()
+
+        prof = profiler.SchedStatProfiler.from_log(
+            log, proc=self.proc, schedstat=self.schedstat)
+        self.assertEqual(10, prof.pid)
+        self.assertEqual(['cpu0', 'cpu1'], prof.cpus)
+        self.assertEqual([10, 11], prof.tids)
+        self.assertEqual([[[200, 100, 1], [400, 400, 4]]],
+                         prof.thread_deltas().tolist())
+        self.assertEqual('worker', prof.thread_summary()[11]['name'])
+        prof.close_log()
+
+    def test_too_many_threads(self):
+        self.write_cpus((0, 0, 0), (0, 0, 0))
+        prof = profiler.SchedStatProfiler(pid=10, proc=self.proc,
+                                          schedstat=self.schedstat,
+                                          max_threads=1)
+        self.write_task(10, 'main', 100, 0, 1)
+        prof.sample(now=1.0)
+        self.write_task(11, 'worker', 400, 400, 4)
+        self.assertRaises(ValueError, prof.sample, 2.0)
+        self.assertEqual(1, len(prof.samples()))
+
+    def test_top_data(self):
+        profs = {}
+        for threads in (1, 2):
+            profs[threads] = profiler.SchedStatProfiler(
+                schedstat=self.schedstat)
+            self.write_cpus((0, 0, 0), (0, 0, 0))
+            profs[threads].sample(now=0.0)
+            self.write_cpus((10 ** 9, threads * 10 ** 9, 10), (0, 0, 0))
+            profs[threads].sample(now=1.0)
+        curves = perftest.trans_top_data_to_curves(
+            profiler.schedstat_top_data(profs))
+        wait = [curve for curve in curves if curve[2] == 'wait-time'][0]
+        self.assertEqual(([1, 2], [1.0, 2.0]), wait[:2])
+
+    def test_missing_cpu(self):
+        self.write_cpus((0, 0, 0), (0, 0, 0))
+        prof = profiler.SchedStatProfiler(cpus=['cpu7'],
+                                          schedstat=self.schedstat)
+        self.assertRaises(ValueError, prof.sample)
+
+
+# A stand-in of 'perf': 'record' writes its arguments into the output file and
+# runs the command or waits for SIGINT, 'report' prints the recorded arguments
+# and its working directory.
+FAKE_PERF = """\
+#!{python}
+import os
+import signal
+import subprocess
+import sys
+
+args = sys.argv[1:]
+if args[0] == 'record':
+    signal.signal(signal.SIGINT, lambda signum, frame: sys.exit(0))
+    options = {{}}
+    i = 1
+    while i < len(args) and args[i].startswith('-'):
+        if args[i] in ('-o', '-e', '-C', '-p'):
+            options[args[i]] = args[i + 1]
+            i += 2
+        else:
+            options[args[i]] = ''
+            i += 1
+    with open(options['-o'], 'w') as fobj:
+        fobj.write(' '.join(args[1:i]))
+    if i < len(args):
+        sys.exit(subprocess.call(' '.join(args[i:]), shell=True))
+    while True:
+        signal.pause()
+elif args[0] in ('report', 'script'):
+    with open(args[args.index('-i') + 1]) as fobj:
+        print('# record: ' + fobj.read())
+    print('# cwd: ' + os.getcwd())
+    if args[0] == 'report':
+        print("# Samples: 1K of event 'cycles'")
+        print('    60.00%  postmark  [kernel.kallsyms]  [k] _raw_spin_lock')
+        print('    40.00%  postmark  postmark           [.] main')
+"""
+
+
+class TestPerfProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.perf = os.path.join(self.tmpdir, 'perf')
+        with open(self.perf, 'w') as fobj:
+            fobj.write(FAKE_PERF.format(python=sys.executable))
+        os.chmod(self.perf, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def wait_recording(self, prof):
+        for _ in range(500):
+            if os.path.exists(prof.output):
+                return
+            time.sleep(0.01)
+        self.fail('perf record did not start')
+
+    def test_concurrent_sessions(self):
+        cpu_prof = profiler.PerfProfiler(self.perf, cpus=[2, 0])
+        pid_prof = profiler.PerfProfiler(self.perf, pid=1234,
+                                         events='cycles')
+        try:
+            self.assertNotEqual(cpu_prof.workdir, pid_prof.workdir)
+            cpu_prof.start()
+            pid_prof.start()
+            self.wait_recording(cpu_prof)
+            self.wait_recording(pid_prof)
+            cpu_prof.stop(report=False)
+            pid_prof.stop(report=False)
+            reports = profiler.collect_perf_reports([cpu_prof, pid_prof],
+                                                    workers=2)
+            self.assertEqual(reports, [cpu_prof.report(), pid_prof.report()])
+
+            self.assertTrue('-a -C 0,2' in cpu_prof.report())
+            self.assertTrue('# cwd: {}'.format(cpu_prof.workdir) in
+                            cpu_prof.report())
+            self.assertTrue('-e cycles -p 1234' in pid_prof.report())
+            self.assertFalse('-a' in pid_prof.report())
+            self.assertTrue('# cwd: {}'.format(pid_prof.workdir) in
+                            pid_prof.report())
+        finally:
+            cpu_prof.cleanup()
+            pid_prof.cleanup()
+        self.assertFalse(os.path.exists(cpu_prof.workdir))
+        self.assertFalse(os.path.exists(pid_prof.workdir))
+
+    def test_profile_command(self):
+        workdir = os.path.join(self.tmpdir, 'session')
+        flag = os.path.join(self.tmpdir, 'ran')
+        prof = profiler.PerfProfiler(self.perf, workdir=workdir)
+        self.assertEqual(os.path.join(workdir, 'perf.data'), prof.output)
+        self.assertEqual(0, prof.start('touch {}'.format(flag)))
+        prof.stop()
+        self.assertTrue(os.path.exists(flag))
+        self.assertTrue(' -a' in prof.report())
+        self.assertEqual({'cycles': [(0.6, 'postmark', '_raw_spin_lock'),
+                                     (0.4, 'postmark', 'main')]},
+                         prof.results(top=2))
+        # The given working directory is kept.
+        prof.cleanup()
+        self.assertTrue(os.path.exists(prof.output))
+
+    def test_relative_workdir(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            prof = profiler.PerfProfiler(self.perf, workdir='session')
+            prof.start()
+            self.wait_recording(prof)
+            prof.stop()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(os.path.join(self.tmpdir, 'session', 'perf.data'),
+                         prof.output)
+        self.assertTrue('# cwd: {}'.format(prof.workdir) in prof.report())
+
+
+def allocate_blocks(count, size):
+    return [bytearray(size) for _ in range(count)]
+
+
+class TestAllocationProfiler(unittest.TestCase):
+    def test_start_stop(self):
+        self.assertFalse(tracemalloc.is_tracing())
+        prof = profiler.AllocationProfiler()
+        prof.start()
+        blocks = allocate_blocks(100, 10000)
+        prof.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+
+        self.assertEqual(2, len(prof.snapshots))
+        self.assertTrue(prof.peak >= 100 * 10000)
+        site, size, count = prof.top_sites(topn=1)[0]
+        self.assertTrue(site.endswith('profiler_test.py:{}'.format(
+            allocate_blocks.__code__.co_firstlineno + 1)))
+        self.assertTrue(size >= 100 * 10000)
+        self.assertTrue(count >= 100)
+        counts = [row[2] for row in prof.top_sites(by='count', topn=5)]
+        self.assertEqual(sorted(counts, reverse=True), counts)
+        self.assertTrue(counts[0] >= 100)
+
+        site_diff = prof.diff(topn=1)[0]
+        self.assertEqual(site, site_diff[0])
+        self.assertTrue(site_diff[1] >= 100 * 10000)
+        report = prof.report()
+        self.assertTrue(report.startswith('# peak: {} bytes'.format(
+            prof.peak)))
+        self.assertTrue(site in report)
+        results = prof.results(topn=1)
+        self.assertEqual(prof.peak, results['peak'])
+        self.assertEqual(site, results['top-sites'][0][0])
+        del blocks
+
+    def test_intervals(self):
+        prof = profiler.AllocationProfiler(interval=0.05, frames=3)
+        prof.start()
+        blocks = []
+        for _ in range(4):
+            blocks.extend(allocate_blocks(10, 10000))
+            time.sleep(0.05)
+        prof.stop()
+        self.assertTrue(len(prof.snapshots) >= 3)
+        currents = [current for _, current, _ in prof.memory]
+        self.assertTrue(currents[-1] > currents[0])
+        # Tracebacks of several frames, from the root to the allocation.
+        site = prof.top_sites(key_type='traceback', topn=1)[0][0]
+        self.assertTrue(';' in site)
+        self.assertRaises(ValueError, prof.top_sites, by='time')
+
+
+def busy_loop(seconds):
+    deadline = time.time() + seconds
+    total = 0
+    while time.time() < deadline:
+        total += sum(range(100))
+    return total
+
+
+class TestPythonProfiler(unittest.TestCase):
+    def test_sample_threads(self):
+        worker = threading.Thread(target=busy_loop, args=(0.5,),
+                                  name='worker')
+        prof = profiler.PythonProfiler(rate=200)
+        prof.start()
+        worker.start()
+        busy_loop(0.3)
+        worker.join()
+        prof.stop()
+
+        self.assertTrue(prof.samples > 0)
+        self.assertTrue(0 < prof.overhead < prof.duration)
+        stacks = [stack for stack, _ in prof.stacks.items()]
+        for thread in ['MainThread', 'worker']:
+            self.assertTrue(any(stack[0] == thread and
+                                stack[-1].startswith('busy_loop')
+                                for stack in stacks))
+        self.assertEqual(prof.samples, sum(
+            count for stack, count in prof.stacks.items()
+            if stack[0] == 'MainThread'))
+        report = prof.report()
+        self.assertTrue(report.startswith('# samples: {}'.format(
+            prof.samples)))
+        self.assertTrue('busy_loop (profiler_test.py:' in report)
+
+        # The handler is restored.
+        self.assertEqual(signal.SIG_DFL, signal.getsignal(signal.SIGPROF))
+
+    def test_dump_folded(self):
+        prof = profiler.PythonProfiler(rate=500, mode='wall', threads=False)
+        prof.start()
+        time.sleep(0.1)
+        prof.stop()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'python.folded')
+            prof.dump(outfile)
+            stacks = flamegraph.load_folded(outfile)
+            self.assertEqual(prof.stacks.total(), stacks.total())
+            self.assertTrue(stacks.total() > 0)
+            self.assertEqual(['MainThread'], list(set(
+                stack[0] for stack, _ in stacks.items())))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, profiler.PythonProfiler, mode='gpu')
+
+
+class RecordingProfiler(profiler.Profiler):
+    """A Profiler that records the calls on it.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def start(self):
+        self.calls.append('start')
+
+    def stop(self):
+        self.calls.append('stop')
+
+    def report(self):
+        return ' '.join(self.calls)
+
+    def results(self):
+        return {'calls': len(self.calls)}
+
+
+class FailingProfiler(RecordingProfiler):
+    def start(self):
+        raise RuntimeError('can not start')
+
+
+class FailingSampler(profiler.SamplingProfiler):
+    """A SamplingProfiler whose third sample fails.
+    """
+    def reset(self):
+        self.times_ = []
+
+    def sample(self, now=None):
+        if len(self.times_) == 2:
+            raise RuntimeError('can not sample')
+        self.times_.append(now)
+
+
+class TestCompositeProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.diskstats = os.path.join(self.tmpdir, 'diskstats')
+        with open(self.diskstats, 'w') as fobj:
+            fobj.write(DISKSTATS_BEFORE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_workload(self):
+        recorder = RecordingProfiler()
+        disk = profiler.DiskStatsProfiler(['sda'], diskstats=self.diskstats)
+        proc = profiler.ProcessProfiler()
+        prof = profiler.CompositeProfiler([recorder, disk, proc],
+                                          interval=0.02)
+        prof.start('{} -c "import time; time.sleep(0.2)"'.format(
+            sys.executable))
+        prof.stop()
+
+        self.assertEqual(0, prof.returncode)
+        self.assertEqual(['start', 'stop'], recorder.calls)
+        times = disk.samples()['time'].tolist()
+        self.assertTrue(len(times) >= 3)
+        # All samplers share the same clock.
+        self.assertEqual(times, proc.samples()['time'].tolist())
+        self.assertTrue(max(proc.series()['processes']) >= 1)
+        self.assertEqual(2, prof.overhead[0]['calls'])
+        self.assertEqual(len(times) + 1, prof.overhead[1]['calls'])
+        self.assertTrue(prof.overhead[2]['cpu-time'] > 0)
+        self.assertTrue('# ProcessProfiler: cpu-time' in prof.report())
+        results = prof.results()
+        self.assertEqual([{'calls': 2}, disk.summary()], results[:2])
+        self.assertEqual(proc.summary()['processes'],
+                         results[2]['processes'])
+
+    def test_without_workload(self):
+        recorder = RecordingProfiler()
+        prof = profiler.CompositeProfiler([recorder])
+        prof.start()
+        self.assertEqual(['start'], recorder.calls)
+        prof.stop()
+        self.assertEqual(['start', 'stop'], recorder.calls)
+        self.assertEqual(None, prof.returncode)
+
+    def test_allocation_profiler(self):
+        self.assertFalse(tracemalloc.is_tracing())
+        alloc = profiler.AllocationProfiler()
+        prof = profiler.CompositeProfiler([alloc], interval=0.01)
+        prof.start('true')
+        prof.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(2, len(alloc.snapshots))
+        self.assertEqual(2, prof.overhead[0]['calls'])
+
+    def test_python_profiler(self):
+        self.assertRaises(ValueError, profiler.CompositeProfiler,
+                          [profiler.PythonProfiler()])
+
+    def test_start_error(self):
+        recorder = RecordingProfiler()
+        prof = profiler.CompositeProfiler([recorder, FailingProfiler()])
+        self.assertRaises(RuntimeError, prof.start, 'true')
+        # The profilers that have started are stopped.
+        self.assertEqual(['start', 'stop'], recorder.calls)
+
+    def test_sampling_error(self):
+        recorder = RecordingProfiler()
+        prof = profiler.CompositeProfiler([recorder, FailingSampler()],
+                                          interval=0.01)
+        begin = time.time()
+        prof.start('sleep 30')
+        prof.thread_.join(10)
+        self.assertEqual(['start', 'stop'], recorder.calls)
+        with self.assertRaises(RuntimeError) as context:
+            prof.stop()
+        self.assertEqual('can not sample', str(context.exception))
+        # The workload was killed.
+        self.assertTrue(time.time() - begin < 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
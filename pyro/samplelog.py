@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""A memory-mapped ring buffer of fixed-width samples on disk.
+
+The file is a header of HEADER_SIZE bytes followed by 'capacity' records of a
+NumPy structured dtype. The writer announces each record by increasing the
+'started' count in the header, writes it into its slot of the mapping and
+then publishes it by increasing the record count, so the samples survive a
+crash of the writer, and other processes can read them while they are
+written. A log without a path lives in anonymous memory, e.g. as the storage
+of a profiler that does not keep its samples on disk.
+
+Labels that appear while sampling, e.g. the names of new lock classes, are
+appended as JSON lines to '<path>.labels'.
+
+Layout of the header (little endian):
+    0  8s  magic 'PYROSLOG'
+    8  u32 version
+    12 u32 header size
+    16 u64 capacity (records)
+    24 u64 count (records ever published)
+    32 u64 started (records ever started; count + 1 during a write)
+    40 u32 record size (bytes)
+    44 u32 length of the metadata
+    48 ... metadata: JSON of {'dtype': descr, 'meta': {...}}
+
+Usage:
+>>> log = SampleLog('disk.log', [('time', 'f8'), ('iops', 'f8', (2,))], 1024)
+>>> log.append((time.time(), [100, 200]))
+>>> # In another process:
+>>> samples = SampleLog('disk.log').samples()
+>>> samples['iops'].mean(axis=0)
+"""
+
+import json
+import mmap
+import numpy as np
+import os
+import struct
+
+MAGIC = b'PYROSLOG'
+VERSION = 2
+HEADER_SIZE = 4096
+HEADER = struct.Struct('<8sIIQQQII')
+COUNT_OFFSET = 24
+STARTED_OFFSET = 32
+
+
+def _descr(dtype):
+    """Returns the dtype of a JSON-decoded dtype.descr.
+    """
+    fields = []
+    for field in dtype:
+        field = list(field)
+        if isinstance(field[1], list):
+            field[1] = _descr(field[1])
+        if len(field) > 2:
+            field[2] = tuple(field[2])
+        fields.append(tuple(field))
+    return np.dtype(fields)
+
+
+class SampleLog(object):
+    """A ring buffer of samples in a memory-mapped file.
+
+    @ivar dtype the structured dtype of the records.
+    @ivar capacity the number of records that the log keeps.
+    @ivar meta the metadata given at creation.
+    """
+    def __init__(self, path, dtype=None, capacity=0, **kwargs):
+        """Creates a new log if a dtype is given, otherwise opens an existing
+        one.
+
+        @param path the path of the log file, or None for a new log in
+        memory.
+        @param dtype the dtype of the records.
+        @param capacity the number of records to keep. Older records are
+        overwritten.
+
+        Optional parameters:
+        @param meta a JSON-serializable dict stored in the header, e.g. the
+        names of the sampled devices.
+        @param writable opens an existing log for appending (default: False).
+        """
+        self.path = path
+        self.labels_ = []
+        self.labels_file_ = None
+        if dtype is not None:
+            self._create(np.dtype(dtype), capacity, kwargs.get('meta', {}))
+        else:
+            self._open(kwargs.get('writable', False))
+        self.records_ = np.ndarray((self.capacity,), self.dtype,
+                                   buffer=self.mmap_, offset=HEADER_SIZE)
+        self.count_ = np.ndarray((), '<u8', buffer=self.mmap_,
+                                 offset=COUNT_OFFSET)
+        self.started_ = np.ndarray((), '<u8', buffer=self.mmap_,
+                                   offset=STARTED_OFFSET)
+
+    def _create(self, dtype, capacity, meta):
+        if capacity <= 0:
+            raise ValueError('The capacity must be positive')
+        if dtype.fields is None:
+            raise ValueError('The dtype of records must be structured')
+        metadata = json.dumps({'dtype': dtype.descr,
+                               'meta': meta}).encode('utf-8')
+        if HEADER.size + len(metadata) > HEADER_SIZE:
+            raise ValueError('The metadata is too large')
+        size = HEADER_SIZE + capacity * dtype.itemsize
+        if self.path is None:
+            self.mmap_ = mmap.mmap(-1, size)
+        else:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                         0o644)
+            try:
+                os.ftruncate(fd, size)
+                self.mmap_ = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            self.labels_file_ = open(self.path + '.labels', 'w')
+        self.mmap_[:HEADER.size] = HEADER.pack(
+            MAGIC, VERSION, HEADER_SIZE, capacity, 0, 0, dtype.itemsize,
+            len(metadata))
+        self.mmap_[HEADER.size:HEADER.size + len(metadata)] = metadata
+        self.dtype = dtype
+        self.capacity = capacity
+        self.meta = meta
+        self.writable = True
+
+    def _open(self, writable):
+        with open(self.path, 'r+b' if writable else 'rb') as fobj:
+            header = fobj.read(HEADER_SIZE)
+            if len(header) < HEADER.size:
+                raise ValueError('{} is not a sample log'.format(self.path))
+            magic, version, header_size, capacity, _, _, record_size, \
+                meta_size = HEADER.unpack_from(header)
+            if magic != MAGIC:
+                raise ValueError('{} is not a sample log'.format(self.path))
+            if version != VERSION or header_size != HEADER_SIZE:
+                raise ValueError('Unsupported sample log version {}'.format(
+                    version))
+            metadata = json.loads(
+                header[HEADER.size:HEADER.size + meta_size].decode('utf-8'))
+            self.dtype = _descr(metadata['dtype'])
+            self.capacity = capacity
+            self.meta = metadata['meta']
+            if self.dtype.itemsize != record_size:
+                raise ValueError('Corrupted header of {}'.format(self.path))
+            size = HEADER_SIZE + capacity * record_size
+            if os.fstat(fobj.fileno()).st_size < size:
+                raise ValueError('{} is truncated'.format(self.path))
+            self.mmap_ = mmap.mmap(
+                fobj.fileno(), size,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.writable = writable
+        self.labels_ = self._read_labels()
+        if writable:
+            self.labels_file_ = open(self.path + '.labels', 'a')
+
+    @property
+    def count(self):
+        """The number of records ever appended.
+        """
+        return int(self.count_)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def reserve(self):
+        """Starts to write the next record in place, e.g. to fill it without
+        building it first. publish() ends the write.
+
+        @return the slot of the record. Its old content is overwritten by
+        the writer.
+        """
+        count = int(self.count_)
+        self.started_[...] = count + 1
+        return self.records_[count % self.capacity]
+
+    def publish(self):
+        """Publishes the record written since reserve().
+        """
+        self.count_[...] = int(self.started_)
+
+    def append(self, record):
+        """Appends a record, e.g. a tuple of the values of all fields.
+        """
+        count = int(self.count_)
+        self.started_[...] = count + 1
+        self.records_[count % self.capacity] = record
+        # Publishes the record after it is written.
+        self.count_[...] = count + 1
+
+    def extend(self, records):
+        """Appends a structured array (or a sequence of records) of the
+        dtype of the log.
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        # Only the last 'capacity' records are kept.
+        count = int(self.count_) + max(0, len(records) - self.capacity)
+        records = records[-self.capacity:]
+        slot = count % self.capacity
+        first = min(len(records), self.capacity - slot)
+        self.started_[...] = count + len(records)
+        self.records_[slot:slot + first] = records[:first]
+        self.records_[:len(records) - first] = records[first:]
+        self.count_[...] = count + len(records)
+
+    def _read_labels(self):
+        labels = []
+        try:
+            with open(self.path + '.labels') as fobj:
+                for line in fobj:
+                    if not line.endswith('\n'):
+                        # Torn by a crash of the writer.
+                        break
+                    labels.append(json.loads(line))
+        except IOError:
+            pass
+        return labels
+
+    def add_label(self, label):
+        """Appends a label, e.g. the name of a column of the records that
+        appeared while sampling. It is written out before the records that
+        use it, so it survives a crash of the writer as well.
+
+        @param label a JSON-serializable value.
+        @return the index of the label.
+        """
+        self.labels_.append(label)
+        if self.labels_file_:
+            self.labels_file_.write(json.dumps(label) + '\n')
+            self.labels_file_.flush()
+        return len(self.labels_) - 1
+
+    def labels(self):
+        """Returns the labels in the order they were added. A reader of a
+        log file also sees the labels added since it was opened.
+        """
+        if self.path is not None and not self.writable:
+            self.labels_ = self._read_labels()
+        return self.labels_
+
+    def records(self):
+        """Returns a zero-copy view of all slots, in the order of the slots
+        rather than of the records. Slots that were never written are zero.
+        """
+        return self.records_
+
+    def samples(self, start=0, copy=False):
+        """Returns the kept records from the oldest to the latest.
+
+        @param start skips the records before this sequence number (see
+        count), e.g. the ones that a live reader has already seen.
+        @param copy if False, returns a zero-copy view of the file when the
+        records are contiguous in the ring, which changes if the writer
+        overwrites them. Otherwise returns a copy that only contains the
+        records that were neither overwritten nor being written while
+        copying.
+        @return a structured array.
+        """
+        count = self.count
+        first = max(start, count - self.capacity, 0)
+        if first >= count:
+            return self.records_[:0].copy() if copy else self.records_[:0]
+        begin = first % self.capacity
+        end = begin + count - first
+        if end <= self.capacity:
+            result = self.records_[begin:end]
+            if not copy:
+                return result
+            result = result.copy()
+        else:
+            result = np.concatenate([self.records_[begin:],
+                                     self.records_[:end - self.capacity]])
+        # The writer, maybe in another process, might have overwritten the
+        # oldest records since the count was read, or be writing the slot of
+        # the oldest one (e.g. it crashed during the write).
+        overwritten = int(self.started_) - self.capacity - first
+        if overwritten > 0:
+            result = result[overwritten:]
+        return result
+
+    def flush(self):
+        """Writes the mapped pages back to the file, e.g. to survive a crash
+        of the machine rather than of the process.
+        """
+        if self.writable and self.path is not None:
+            self.mmap_.flush()
+
+    def close(self):
+        if self.mmap_ is None:
+            return
+        self.flush()
+        if self.labels_file_:
+            self.labels_file_.close()
+            self.labels_file_ = None
+        self.records_ = self.count_ = self.started_ = None
+        try:
+            self.mmap_.close()
+        except BufferError:
+            # Views returned by samples() still use the mapping, which is
+            # unmapped when they are released.
+            pass
+        self.mmap_ = None
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.samplelog
+"""
+
+from pyro import samplelog
+import numpy as np
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+DTYPE = [('time', np.float64), ('seq', np.int64), ('cpu', np.uint64, (2, 3))]
+
+
+class TestSampleLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'samples.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_append_and_read(self):
+        log = samplelog.SampleLog(self.path, DTYPE, 8, meta={'cpus': 2})
+        for i in range(5):
+            log.append((i * 0.5, i, np.full((2, 3), i)))
+        self.assertEqual(5, len(log))
+
+        reader = samplelog.SampleLog(self.path)
+        self.assertEqual(np.dtype(DTYPE), reader.dtype)
+        self.assertEqual({'cpus': 2}, reader.meta)
+        samples = reader.samples()
+        self.assertEqual(list(range(5)), samples['seq'].tolist())
+        self.assertEqual([[3] * 3] * 2, samples['cpu'][3].tolist())
+        # A zero-copy view of the file sees new samples in place.
+        view = reader.records()
+        log.append((3.0, 5, np.zeros((2, 3))))
+        self.assertEqual(5, view['seq'][5])
+        self.assertEqual([5], reader.samples(start=5)['seq'].tolist())
+        self.assertEqual(0, len(reader.samples(start=6)))
+        self.assertRaises(ValueError, reader.append, (0, 0, 0))
+        reader.close()
+        log.close()
+
+    def test_wrap_around(self):
+        log = samplelog.SampleLog(self.path, DTYPE, 4)
+        for i in range(6):
+            log.append((i, i, 0))
+        self.assertEqual(6, log.count)
+        self.assertEqual([2, 3, 4, 5], log.samples()['seq'].tolist())
+        self.assertEqual([4, 5], log.samples(start=4)['seq'].tolist())
+
+        batch = np.zeros(7, dtype=DTYPE)
+        batch['seq'] = np.arange(6, 13)
+        log.extend(batch)
+        self.assertEqual(13, log.count)
+        self.assertEqual([9, 10, 11, 12], log.samples()['seq'].tolist())
+        log.extend(batch[:2])
+        self.assertEqual([11, 12, 6, 7], log.samples()['seq'].tolist())
+        self.assertEqual([11, 12, 6, 7],
+                         log.samples(copy=True)['seq'].tolist())
+        log.close()
+
+    def test_write_in_place(self):
+        log = samplelog.SampleLog(None, DTYPE, 4)
+        for i in range(4):
+            log.append((i, i, 0))
+        slot = log.reserve()
+        slot['seq'] = 4
+        slot['cpu'][1] = 7
+        # The oldest record is being overwritten.
+        self.assertEqual([1, 2, 3], log.samples(copy=True)['seq'].tolist())
+        log.publish()
+        samples = log.samples(copy=True)
+        self.assertEqual([1, 2, 3, 4], samples['seq'].tolist())
+        self.assertEqual([[0] * 3, [7] * 3], samples['cpu'][-1].tolist())
+        log.close()
+
+    def test_labels(self):
+        log = samplelog.SampleLog(self.path, DTYPE, 4)
+        self.assertEqual(0, log.add_label('&rq->lock'))
+        self.assertEqual(1, log.add_label([12, 'worker']))
+        reader = samplelog.SampleLog(self.path)
+        self.assertEqual(['&rq->lock', [12, 'worker']], reader.labels())
+        log.add_label('new')
+        self.assertEqual(3, len(reader.labels()))
+        reader.close()
+        log.close()
+        # A line torn by a crash is ignored.
+        with open(self.path + '.labels', 'a') as fobj:
+            fobj.write('"tor')
+        self.assertEqual(3, len(samplelog.SampleLog(self.path).labels()))
+
+        memory = samplelog.SampleLog(None, DTYPE, 4)
+        memory.add_label('a')
+        self.assertEqual(['a'], memory.labels())
+        memory.close()
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as fobj:
+            fobj.write(b'not a log' * 10)
+        self.assertRaises(ValueError, samplelog.SampleLog, self.path)
+        self.assertRaises(ValueError, samplelog.SampleLog, self.path,
+                          np.float64, 4)
+
+    def test_recover_after_kill(self):
+        log = samplelog.SampleLog(self.path, DTYPE, 1 << 20)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                seq = 0
+                while True:
+                    log.append((time.time(), seq, seq))
+                    seq += 1
+            finally:
+                os._exit(1)
+        reader = samplelog.SampleLog(self.path)
+        deadline = time.time() + 30
+        while reader.count < 1000 and time.time() < deadline:
+            time.sleep(0.01)
+        # Watches the samples while they are written.
+        live = reader.samples(copy=True)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        log.close()
+
+        self.assertTrue(len(live) >= 1000)
+        samples = samplelog.SampleLog(self.path).samples()
+        self.assertTrue(len(samples) >= len(live))
+        self.assertEqual(list(range(len(samples))), samples['seq'].tolist())
+        self.assertTrue(np.all(samples['cpu'] ==
+                               samples['seq'][:, np.newaxis, np.newaxis]))
+        self.assertTrue(np.all(np.diff(samples['time']) >= 0))
+
+    def test_recover_full_ring(self):
+        log = samplelog.SampleLog(self.path, DTYPE, 4)
+        for i in range(6):
+            log.append((i, i, 0))
+        log.close()
+        samples = samplelog.SampleLog(self.path).samples(copy=True)
+        self.assertEqual([2, 3, 4, 5], samples['seq'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Fits the Universal Scalability Law (USL) and Amdahl's law to throughput
+measured at several concurrency levels (e.g. threads or cores).
+
+USL models the throughput at concurrency N as
+
+    X(N) = lambda * N / (1 + sigma * (N - 1) + kappa * N * (N - 1))
+
+where sigma is the contention (serialized fraction) and kappa the coherency
+delay. Amdahl's law is USL with kappa = 0. Since
+
+    N / X(N) = 1 / lambda + sigma / lambda * (N - 1) +
+               kappa / lambda * N * (N - 1)
+
+is linear in its coefficients, all series are fitted at once by solving
+their normal equations as one stack of small linear systems.
+
+Usage:
+>>> result = analysis.Result('fs.threads.run')
+>>> result['ext4', 1, 0] = 100 ...
+>>> fit = fit_result(result, by='threads')
+>>> fit.peak()
+>>> plot.plot(fit.data_curves() + fit.curves(), 'Scalability',
+...           '# of Threads', 'IOPS', 'usl.pdf')
+"""
+
+from pyro import stats
+import numpy as np
+
+MODELS = {'usl': 3, 'amdahl': 2}
+
+
+class ScalabilityFit(object):
+    """The fitted models of several series.
+
+    @ivar keys the key of each series.
+    @ivar concurrency the concurrency levels, shape (points,).
+    @ivar throughput the measured throughput, shape (series, points). It is
+    NaN where a series has no measurement.
+    @ivar lam, sigma, kappa the fitted parameters of each series. They are
+    NaN if a series has fewer points than the parameters of the model.
+    @ivar r2 the coefficient of determination of the linearized fit.
+    """
+    def __init__(self, keys, concurrency, throughput, model='usl'):
+        if model not in MODELS:
+            raise ValueError('Unknown model: {}'.format(model))
+        self.model = model
+        self.keys = list(keys)
+        self.concurrency = np.asarray(concurrency, dtype=np.float64)
+        self.throughput = np.asarray(throughput, dtype=np.float64).reshape(
+            (len(self.keys), len(self.concurrency)))
+        self._fit()
+
+    def _design(self, n):
+        n = np.asarray(n, dtype=np.float64)
+        return np.stack([np.ones_like(n), n - 1, n * (n - 1)],
+                        axis=-1)[..., :MODELS[self.model]]
+
+    def _fit(self):
+        params = MODELS[self.model]
+        design = self._design(self.concurrency)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            target = self.concurrency / self.throughput
+        weights = (np.isfinite(target) & (self.throughput > 0)) \
+            .astype(np.float64)
+        target = np.where(weights > 0, target, 0)
+        self.counts = weights.sum(axis=1).astype(int)
+        valid = self.counts >= params
+
+        # Normal equations of all series: (series, params, params).
+        normal = np.einsum('sp,pi,pj->sij', weights, design, design)
+        normal[~valid] = np.eye(params)
+        rhs = np.einsum('sp,pi,sp->si', weights, design, target)
+        coef = np.linalg.solve(normal, rhs[..., np.newaxis])[..., 0]
+        coef[~valid] = np.nan
+
+        residuals = weights * (target - coef.dot(design.T))
+        rss = np.sum(residuals ** 2, axis=1)
+        dof = self.counts - params
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.sum(weights * target, axis=1) / self.counts
+            tss = np.sum(weights * (target - means[:, np.newaxis]) ** 2,
+                         axis=1)
+            self.r2 = np.where(tss > 0, 1 - rss / tss, 1.0)
+            variance = np.where(dof > 0, rss / dof, np.nan)
+        self.r2[~valid] = np.nan
+        # The covariance of the linear coefficients.
+        self.cov_ = np.linalg.inv(normal) * variance[:, np.newaxis,
+                                                     np.newaxis]
+        self.cov_[~valid] = np.nan
+        self.coef_ = np.zeros((len(self.keys), 3))
+        self.coef_[:, :params] = coef
+        self.lam, self.sigma, self.kappa = _parameters(self.coef_)
+
+    def predict(self, concurrency):
+        """Returns the throughput of each series at the given concurrency,
+        shape (series, len(concurrency)).
+        """
+        design = self._design(np.asarray(concurrency, dtype=np.float64))
+        params = MODELS[self.model]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.asarray(concurrency) / \
+                self.coef_[:, :params].dot(design.T)
+
+    def peak(self):
+        """Returns the concurrency with the highest predicted throughput and
+        that throughput, for each series.
+
+        The concurrency is inf if the throughput never drops (e.g. Amdahl's
+        law); the throughput is then its limit lambda / sigma, or inf.
+        @return (concurrency, throughput) arrays of series.
+        """
+        return _peak(self.coef_)
+
+    def peak_ci(self, confidence=0.95, **kwargs):
+        """Computes the confidence intervals of the peak by drawing the
+        coefficients of the linearized fit from their estimated normal
+        distribution. They are NaN for series with no residual degree of
+        freedom.
+
+        @param confidence the confidence level (default: 0.95).
+
+        Optional parameters:
+        @param draws the number of draws (default: 1000).
+        @param seed the seed of the random generator.
+        @return {'concurrency': (lower, upper), 'throughput': (lower,
+        upper)}, each bound an array of series.
+        """
+        draws = kwargs.get('draws', 1000)
+        rng = np.random.RandomState(kwargs.get('seed', None))
+        params = MODELS[self.model]
+        cov = np.nan_to_num(self.cov_)
+        # cov = V diag(w) V^T, so V sqrt(w) maps standard normal draws.
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        scale = eigvecs * np.sqrt(np.maximum(eigvals, 0))[:, np.newaxis]
+        noise = rng.standard_normal((len(self.keys), draws, params))
+        coef = self.coef_[:, np.newaxis, :].repeat(draws, axis=1)
+        coef[..., :params] += np.einsum('sij,sdj->sdi', scale, noise)
+        concurrency, throughput = _peak(coef)
+
+        alpha = (1.0 - confidence) / 2
+        lower = int(np.floor(alpha * (draws - 1)))
+        upper = int(np.ceil((1 - alpha) * (draws - 1)))
+        missing = np.isnan(self.cov_).any(axis=(1, 2))
+        result = {}
+        for name, values in [('concurrency', concurrency),
+                             ('throughput', throughput)]:
+            # Sorting keeps inf, which percentile interpolation turns to NaN.
+            values = np.sort(values, axis=1)
+            bounds = (values[:, lower], values[:, upper])
+            for bound in bounds:
+                bound[missing] = np.nan
+            result[name] = bounds
+        return result
+
+    def summary(self, confidence=0.95, **kwargs):
+        """Returns {key: {'lambda', 'sigma', 'kappa', 'r2', 'peak-concurrency',
+        'peak-throughput', and their '-lower' and '-upper' bounds}}.
+
+        @param confidence, draws, seed see peak_ci().
+        """
+        concurrency, throughput = self.peak()
+        ci = self.peak_ci(confidence, **kwargs)
+        results = {}
+        for i, key in enumerate(self.keys):
+            results[key] = {
+                'lambda': self.lam[i], 'sigma': self.sigma[i],
+                'kappa': self.kappa[i], 'r2': self.r2[i],
+                'peak-concurrency': concurrency[i],
+                'peak-concurrency-lower': ci['concurrency'][0][i],
+                'peak-concurrency-upper': ci['concurrency'][1][i],
+                'peak-throughput': throughput[i],
+                'peak-throughput-lower': ci['throughput'][0][i],
+                'peak-throughput-upper': ci['throughput'][1][i]}
+        return results
+
+    def data_curves(self):
+        """Returns the measurements as curves of plot.plot().
+        """
+        curves = []
+        for i, key in enumerate(self.keys):
+            mask = ~np.isnan(self.throughput[i])
+            curves.append((self.concurrency[mask].tolist(),
+                           self.throughput[i][mask].tolist(), _label(key)))
+        return curves
+
+    def curves(self, concurrency=None, label='{} ({})'):
+        """Returns the fitted models as curves of plot.plot().
+
+        @param concurrency where to evaluate the models (default: 50 points
+        from 1 to the highest measured concurrency).
+        @param label the format of the labels, with the key of the series and
+        the name of the model.
+        """
+        if concurrency is None:
+            concurrency = np.linspace(1, max(self.concurrency.max(), 1), 50)
+        concurrency = np.asarray(concurrency, dtype=np.float64)
+        predicted = self.predict(concurrency)
+        return [(concurrency.tolist(), predicted[i].tolist(),
+                 label.format(_label(key), self.model.upper()))
+                for i, key in enumerate(self.keys)]
+
+
+def _label(key):
+    if isinstance(key, tuple):
+        return ' '.join(str(k) for k in key)
+    return str(key)
+
+
+def _parameters(coef):
+    """Returns (lambda, sigma, kappa) of the linear coefficients (..., 3).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1 / coef[..., 0], coef[..., 1] / coef[..., 0], \
+            coef[..., 2] / coef[..., 0]
+
+
+def _peak(coef):
+    lam, sigma, kappa = _parameters(coef)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        has_peak = (kappa > 0) & (sigma < 1)
+        concurrency = np.where(
+            has_peak, np.sqrt(np.where(has_peak, (1 - sigma) / kappa, 1)),
+            np.inf)
+        at_peak = lam * concurrency / (
+            1 + sigma * (concurrency - 1) +
+            kappa * concurrency * (concurrency - 1))
+        limit = np.where(sigma > 0, lam / sigma, np.inf)
+        throughput = np.where(has_peak, at_peak, limit)
+    invalid = np.isnan(coef).any(axis=-1)
+    concurrency[invalid] = np.nan
+    throughput[invalid] = np.nan
+    return concurrency, throughput
+
+
+def fit_dict(data, model='usl'):
+    """Fits the {threads: value} data of plot.plot_dict(), where a value is a
+    throughput, a list of repeated runs (averaged) or a {label: throughput}
+    dict of several series.
+
+    @return a ScalabilityFit. The series of plain values has the key ''.
+    """
+    concurrency = sorted(data)
+    series = {}
+    for i, level in enumerate(concurrency):
+        values = data[level]
+        if type(values) != dict:
+            values = {'': values}
+        for key, value in values.items():
+            series.setdefault(key, np.full(len(concurrency), np.nan))[i] = \
+                np.mean(stats._leaf_samples(value))
+    keys = sorted(series)
+    return ScalabilityFit(keys, concurrency, [series[k] for k in keys], model)
+
+
+def fit_result(result, *index, **kwargs):
+    """Fits all series of a subtree of an analysis.Result at once.
+
+    A series is identified by the keys above the concurrency level, and its
+    throughput at each concurrency level is the mean of all leaves below it
+    (e.g. repeated runs).
+
+    @param result an analysis.Result.
+    @param index the path of the subtree.
+
+    Optional parameters:
+    @param by the name of the concurrency level in result.meta (e.g.
+    'threads').
+    @param level the depth of the concurrency keys below the subtree, if
+    'by' is not given (default: 0).
+    @param key only uses the leaves with this key, as Result.collect().
+    @param model 'usl' (default) or 'amdahl'.
+    @return a ScalabilityFit. The keys of the series are tuples of the keys
+    between the subtree and the concurrency level.
+    """
+    if 'by' in kwargs:
+        level = result.meta.index(kwargs['by']) - len(index)
+        if level < 0:
+            raise ValueError('{} is above the subtree'.format(kwargs['by']))
+    else:
+        level = kwargs.get('level', 0)
+    leaf_key = kwargs.get('key', None)
+    node = result[index] if index else result.data
+    # {(series key, concurrency): [samples]}
+    samples = {}
+    todo = [((), node)] if type(node) == dict else []
+    while todo:
+        path, tree = todo.pop()
+        for child_key, child in tree.items():
+            child_path = path + (child_key,)
+            if type(child) == dict:
+                todo.append((child_path, child))
+                continue
+            if len(child_path) <= level:
+                continue
+            if leaf_key is not None and child_key != leaf_key:
+                continue
+            samples.setdefault((child_path[:level], child_path[level]),
+                               []).extend(stats._leaf_samples(child))
+    keys = sorted(set(key for key, _ in samples))
+    concurrency = sorted(set(level for _, level in samples))
+    key_ids = dict((key, i) for i, key in enumerate(keys))
+    level_ids = dict((n, i) for i, n in enumerate(concurrency))
+    throughput = np.full((len(keys), len(concurrency)), np.nan)
+    for (key, n), values in samples.items():
+        throughput[key_ids[key], level_ids[n]] = np.mean(values)
+    return ScalabilityFit(keys, concurrency, throughput,
+                          kwargs.get('model', 'usl'))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.scalability
+"""
+
+from pyro import analysis, scalability
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def usl(n, lam, sigma, kappa):
+    n = np.asarray(n, dtype=np.float64)
+    return lam * n / (1 + sigma * (n - 1) + kappa * n * (n - 1))
+
+
+class TestScalabilityFit(unittest.TestCase):
+    def test_batch_fit(self):
+        rng = np.random.RandomState(0)
+        count = 2000
+        lam = rng.uniform(100, 1000, count)
+        sigma = rng.uniform(0.01, 0.2, count)
+        kappa = rng.uniform(0.0001, 0.01, count)
+        threads = [1, 2, 4, 8, 16, 32, 64]
+        throughput = usl(threads, lam[:, np.newaxis], sigma[:, np.newaxis],
+                         kappa[:, np.newaxis])
+        # Missing measurements.
+        throughput[::2, -1] = np.nan
+
+        fit = scalability.ScalabilityFit(range(count), threads, throughput)
+        np.testing.assert_allclose(lam, fit.lam, rtol=1e-6)
+        np.testing.assert_allclose(sigma, fit.sigma, rtol=1e-6)
+        np.testing.assert_allclose(kappa, fit.kappa, rtol=1e-6)
+        np.testing.assert_allclose(1.0, fit.r2)
+        concurrency, peak = fit.peak()
+        expected = np.sqrt((1 - sigma) / kappa)
+        np.testing.assert_allclose(expected, concurrency, rtol=1e-6)
+        np.testing.assert_allclose(usl(expected, lam, sigma, kappa), peak,
+                                   rtol=1e-6)
+        np.testing.assert_allclose(throughput[1], fit.predict(threads)[1])
+
+    def test_peak_ci(self):
+        rng = np.random.RandomState(1)
+        threads = np.arange(1, 49)
+        truth = usl(threads, 500, 0.05, 0.002)
+        noisy = truth * rng.normal(1, 0.02, size=(3, len(threads)))
+        fit = scalability.ScalabilityFit(['a', 'b', 'c'], threads, noisy)
+        ci = fit.peak_ci(draws=2000, seed=2)
+        expected = np.sqrt(0.95 / 0.002)
+        lower, upper = ci['concurrency']
+        self.assertTrue(np.all(lower < upper))
+        self.assertTrue(np.all((lower < expected * 1.1) &
+                               (upper > expected * 0.9)))
+        lower, upper = ci['throughput']
+        peak = usl(expected, 500, 0.05, 0.002)
+        self.assertTrue(np.all((lower < peak * 1.05) & (upper > peak * 0.95)))
+
+        summary = fit.summary(seed=2)
+        self.assertAlmostEqual(0.05, summary['a']['sigma'], delta=0.02)
+        self.assertTrue(summary['a']['peak-throughput-lower'] <=
+                        summary['a']['peak-throughput'] <=
+                        summary['a']['peak-throughput-upper'])
+
+    def test_amdahl(self):
+        threads = [1, 2, 4, 8]
+        fit = scalability.ScalabilityFit(
+            ['x'], threads, [usl(threads, 100, 0.25, 0)], model='amdahl')
+        self.assertAlmostEqual(0.25, fit.sigma[0])
+        self.assertEqual(0, fit.kappa[0])
+        concurrency, throughput = fit.peak()
+        self.assertEqual(np.inf, concurrency[0])
+        self.assertAlmostEqual(400, throughput[0])
+        # No degree of freedom is left for the confidence interval.
+        fit = scalability.ScalabilityFit(['x'], [1, 2], [[100, 150]],
+                                         model='amdahl')
+        self.assertTrue(np.isnan(fit.peak_ci()['throughput'][0][0]))
+        self.assertRaises(ValueError, scalability.ScalabilityFit, ['x'],
+                          [1], [[1]], 'linear')
+
+    def test_too_few_points(self):
+        fit = scalability.ScalabilityFit(['a', 'b'], [1, 2, 4],
+                                         [[100, 180, 300],
+                                          [100, np.nan, np.nan]])
+        self.assertFalse(np.isnan(fit.lam[0]))
+        self.assertTrue(np.isnan(fit.lam[1]))
+        self.assertTrue(np.isnan(fit.peak()[0][1]))
+
+
+class TestFitResult(unittest.TestCase):
+    def setUp(self):
+        self.result = analysis.Result('fs.disks.threads.run')
+        for fs, lam in [('ext4', 100), ('xfs', 200)]:
+            for disks in (1, 2):
+                for threads in (1, 2, 4, 8, 16):
+                    value = usl(threads, lam * disks, 0.1, 0.01)
+                    self.result[fs, disks, threads, 0] = value * 0.99
+                    self.result[fs, disks, threads, 1] = value * 1.01
+
+    def test_fit_tree(self):
+        fit = scalability.fit_result(self.result, by='threads')
+        self.assertEqual([('ext4', 1), ('ext4', 2), ('xfs', 1), ('xfs', 2)],
+                         fit.keys)
+        self.assertEqual([1, 2, 4, 8, 16], fit.concurrency.tolist())
+        np.testing.assert_allclose([100, 200, 200, 400], fit.lam)
+        np.testing.assert_allclose(0.1, fit.sigma)
+
+        fit = scalability.fit_result(self.result, 'xfs', by='threads',
+                                     model='amdahl')
+        self.assertEqual([(1,), (2,)], fit.keys)
+        fit = scalability.fit_result(self.result, 'xfs', 2, level=0)
+        self.assertEqual([()], fit.keys)
+        np.testing.assert_allclose([400], fit.lam)
+
+    def test_fit_dict(self):
+        data = dict((threads, {'ext4': usl(threads, 100, 0.1, 0.01),
+                               'xfs': [usl(threads, 50, 0.2, 0)] * 2})
+                    for threads in (1, 2, 4, 8))
+        fit = scalability.fit_dict(data)
+        self.assertEqual(['ext4', 'xfs'], fit.keys)
+        np.testing.assert_allclose([100, 50], fit.lam)
+        fit = scalability.fit_dict({1: 10, 2: 19, 4: 35})
+        self.assertEqual([''], fit.keys)
+
+    def test_plot_overlay(self):
+        try:
+            from pyro import plot
+        except ImportError:
+            self.skipTest('matplotlib is not available')
+        fit = scalability.fit_result(self.result, 'ext4', by='threads')
+        curves = fit.curves()
+        self.assertEqual('1 (USL)', curves[0][2])
+        self.assertEqual(50, len(curves[0][0]))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'usl.png')
+            plot.plot(fit.data_curves() + curves, 'Scalability',
+                      '# of Threads', 'IOPS', outfile)
+            self.assertTrue(os.path.getsize(outfile) > 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
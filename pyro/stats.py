@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Statistics over groups of benchmark samples, e.g. the repeated runs of each
+configuration in an analysis.Result tree.
+
+The samples of all groups are kept in one 2-D array (groups x samples), with
+each row sorted and padded with NaN, so that every statistic is computed for
+all groups at once.
+
+Usage:
+>>> result = analysis.Result('fs.threads.run')
+>>> result['ext4', 1, 0] = 100 ...
+>>> groups = group_result(result, 'ext4').filter_iqr()
+>>> plot.plot([groups.errorbars('ext4', error='ci')], 'IOPS', '# of Threads',
+...           'IOPS', 'iops.pdf')
+"""
+
+import numpy as np
+
+
+class GroupedSamples(object):
+    """The samples of several groups.
+
+    @param keys the key of each group.
+    @param samples a list of sequences of samples, one for each key. NaN
+    values are ignored.
+    """
+    # Bounds the temporary arrays of bootstrap_ci() to about this many values.
+    BOOTSTRAP_BATCH = 1 << 22
+
+    def __init__(self, keys, samples):
+        self.keys = list(keys)
+        assert len(self.keys) == len(samples)
+        width = max([len(s) for s in samples] + [0])
+        values = np.full((len(self.keys), width), np.nan)
+        for row, sample in enumerate(samples):
+            values[row, :len(sample)] = sample
+        # np.sort() puts NaN at the end of each row.
+        self.values = np.sort(values, axis=1)
+        self.counts = np.sum(~np.isnan(self.values), axis=1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def mean(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nansum(self.values, axis=1) / self.counts
+
+    def std(self, ddof=1):
+        """Returns the standard deviation of each group. It is NaN for the
+        groups with no more than ddof samples.
+        """
+        deviations = self.values - self.mean()[:, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variances = np.nansum(deviations ** 2, axis=1) / \
+                (self.counts - ddof)
+        variances[self.counts <= ddof] = np.nan
+        return np.sqrt(variances)
+
+    def percentile(self, q):
+        """Returns the q-th percentiles (linear interpolation) of each group.
+
+        @param q a percentile or a sequence of percentiles in [0, 100].
+        @return an array of shape (groups,), or (len(q), groups).
+        """
+        return _sorted_percentile(self.values, self.counts, q)
+
+    def median(self):
+        return self.percentile(50)
+
+    def summary(self):
+        """Returns {statistic: array of groups}.
+        """
+        p25, p50, p75 = self.percentile([25, 50, 75])
+        return {'count': self.counts, 'mean': self.mean(), 'std': self.std(),
+                'min': self.percentile(0), 'p25': p25, 'median': p50,
+                'p75': p75, 'max': self.percentile(100)}
+
+    def filter_iqr(self, factor=1.5):
+        """Removes the samples outside [Q1 - factor * IQR, Q3 + factor * IQR]
+        of their groups.
+
+        @return a new GroupedSamples.
+        """
+        q1, q3 = self.percentile([25, 75])
+        iqr = q3 - q1
+        return self._filter((q1 - factor * iqr)[:, np.newaxis],
+                            (q3 + factor * iqr)[:, np.newaxis])
+
+    def filter_mad(self, threshold=3.5):
+        """Removes the samples whose modified z-score
+        0.6745 * |x - median| / MAD exceeds the threshold. The groups whose
+        MAD is 0 are kept as they are.
+
+        @return a new GroupedSamples.
+        """
+        medians = self.median()[:, np.newaxis]
+        deviations = np.abs(self.values - medians)
+        mads = _sorted_percentile(np.sort(deviations, axis=1), self.counts,
+                                  50)[:, np.newaxis]
+        bound = np.where(mads > 0, threshold * mads / 0.6745, np.inf)
+        return self._filter(medians - bound, medians + bound)
+
+    def _filter(self, lower, upper):
+        with np.errstate(invalid='ignore'):
+            keep = (self.values >= lower) & (self.values <= upper)
+        return GroupedSamples(self.keys, np.where(keep, self.values, np.nan))
+
+    def bootstrap_ci(self, confidence=0.95, **kwargs):
+        """Computes the percentile bootstrap confidence intervals of a
+        statistic for all groups, resampling all groups in batches.
+
+        @param confidence the confidence level (default: 0.95).
+
+        Optional parameters:
+        @param statistic 'mean' (default) or 'median'.
+        @param resamples the number of bootstrap resamples (default: 1000).
+        @param seed the seed of the random generator.
+        @return (lower, upper) arrays of groups. They are NaN for empty
+        groups.
+        """
+        statistic = kwargs.get('statistic', 'mean')
+        resamples = kwargs.get('resamples', 1000)
+        if statistic not in ('mean', 'median'):
+            raise ValueError('Unknown statistic: {}'.format(statistic))
+        rng = np.random.RandomState(kwargs.get('seed', None))
+        groups, width = self.values.shape
+        counts = self.counts
+        estimates = np.empty((groups, resamples))
+        if width:
+            batch = max(1, self.BOOTSTRAP_BATCH // max(1, groups * width))
+            valid = np.arange(width) < counts[:, np.newaxis, np.newaxis]
+            rows = np.arange(groups)[:, np.newaxis, np.newaxis]
+            for start in range(0, resamples, batch):
+                size = min(batch, resamples - start)
+                # Draw the indices of each group among its own samples.
+                indices = (rng.random_sample((groups, size, width)) *
+                           counts[:, np.newaxis, np.newaxis]).astype(np.intp)
+                drawn = np.where(valid, self.values[rows, indices], np.nan)
+                if statistic == 'mean':
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        stats = np.nansum(drawn, axis=2) / \
+                            counts[:, np.newaxis]
+                else:
+                    stats = _sorted_percentile(
+                        np.sort(drawn, axis=2),
+                        np.broadcast_to(counts[:, np.newaxis],
+                                        (groups, size)), 50)
+                estimates[:, start:start + size] = stats
+        else:
+            estimates.fill(np.nan)
+        alpha = (1.0 - confidence) / 2 * 100
+        lower, upper = _sorted_percentile(
+            np.sort(estimates, axis=1),
+            np.where(counts > 0, resamples, 0), [alpha, 100 - alpha])
+        return lower, upper
+
+    def errorbars(self, label, **kwargs):
+        """Returns a curve with error bars that plot.plot() draws:
+        (keys, centers, label, yerr).
+
+        @param label the label of the curve.
+
+        Optional parameters:
+        @param center 'mean' (default) or 'median'.
+        @param error 'std' (default), 'ci' (bootstrap confidence interval of
+        the center), 'iqr' or 'minmax'.
+        @param confidence, resamples, seed see bootstrap_ci().
+        """
+        center = kwargs.get('center', 'mean')
+        error = kwargs.get('error', 'std')
+        if center == 'mean':
+            centers = self.mean()
+        elif center == 'median':
+            centers = self.median()
+        else:
+            raise ValueError('Unknown center: {}'.format(center))
+        if error == 'std':
+            yerr = np.nan_to_num(self.std())
+            return (self.keys, centers.tolist(), label, yerr.tolist())
+        if error == 'ci':
+            lower, upper = self.bootstrap_ci(
+                kwargs.get('confidence', 0.95), statistic=center,
+                resamples=kwargs.get('resamples', 1000),
+                seed=kwargs.get('seed', None))
+        elif error == 'iqr':
+            lower, upper = self.percentile([25, 75])
+        elif error == 'minmax':
+            lower, upper = self.percentile([0, 100])
+        else:
+            raise ValueError('Unknown error: {}'.format(error))
+        yerr = [np.nan_to_num(centers - lower).tolist(),
+                np.nan_to_num(upper - centers).tolist()]
+        return (self.keys, centers.tolist(), label, yerr)
+
+
+def _sorted_percentile(values, counts, q):
+    """Percentiles along the last axis of values, whose rows are sorted with
+    NaN at the end and have counts valid values each.
+    """
+    qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+    counts = np.asarray(counts)
+    if values.shape[-1] == 0:
+        results = np.full((len(qs),) + counts.shape, np.nan)
+        return results if np.ndim(q) else results[0]
+    last = np.maximum(counts - 1, 0)
+    # Shape (len(q),) + counts.shape.
+    positions = qs.reshape((-1,) + (1,) * counts.ndim) / 100.0 * last
+    low = np.floor(positions).astype(np.intp)
+    high = np.minimum(low + 1, last)
+    values = values[np.newaxis]
+    low_values = np.take_along_axis(values, low[..., np.newaxis], -1)[..., 0]
+    high_values = np.take_along_axis(values, high[..., np.newaxis],
+                                     -1)[..., 0]
+    results = low_values + (positions - low) * (high_values - low_values)
+    results[:, counts == 0] = np.nan
+    return results if np.ndim(q) else results[0]
+
+
+def _leaf_samples(node):
+    """Returns the numeric samples of a leaf: a number or a list of numbers.
+    """
+    if type(node) in (list, tuple, set):
+        return list(node)
+    return [node]
+
+
+def group_result(result, *index, **kwargs):
+    """Groups the samples of a subtree of an analysis.Result.
+
+    The samples of a group are all leaves under the group key. A leaf is a
+    number or a list of numbers (e.g. repeated runs).
+
+    @param result an analysis.Result.
+    @param index the path of the subtree.
+
+    Optional parameters:
+    @param level groups by the keys at this depth below the subtree
+    (default: 0, its children). E.g. for 'fs.threads.run', group_result(
+    result, level=1) groups by threads across all file systems.
+    @param key only collects the leaves with this key, as Result.collect().
+    @return a GroupedSamples, sorted by the group keys.
+    """
+    level = kwargs.get('level', 0)
+    leaf_key = kwargs.get('key', None)
+    node = result[index] if index else result.data
+    if type(node) != dict:
+        return GroupedSamples([], [])
+
+    groups = {}
+    # Walk the tree without recursion: (path below the subtree, node).
+    todo = [((), node)]
+    while todo:
+        path, tree = todo.pop()
+        for child_key, child in tree.items():
+            child_path = path + (child_key,)
+            if type(child) == dict:
+                todo.append((child_path, child))
+                continue
+            if len(child_path) <= level:
+                continue
+            if leaf_key is not None and child_key != leaf_key:
+                continue
+            groups.setdefault(child_path[level], []).extend(
+                _leaf_samples(child))
+    keys = sorted(groups)
+    return GroupedSamples(keys, [groups[k] for k in keys])
+
+
+def group_dict(data):
+    """Groups {key: [samples]} into a GroupedSamples, sorted by the keys.
+    """
+    keys = sorted(data)
+    return GroupedSamples(keys, [_leaf_samples(data[k]) for k in keys])
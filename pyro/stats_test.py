@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.stats
+"""
+
+from pyro import analysis, stats
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestGroupedSamples(unittest.TestCase):
+    def setUp(self):
+        self.groups = stats.GroupedSamples(
+            ['a', 'b', 'c'], [[4, 1, 3, 2, 100], [5, 6, 5], []])
+
+    def test_statistics(self):
+        self.assertEqual([5, 3, 0], list(self.groups.counts))
+        np.testing.assert_allclose([22, 16.0 / 3], self.groups.mean()[:2])
+        np.testing.assert_allclose([3, 5], self.groups.median()[:2])
+        np.testing.assert_allclose(
+            [np.std([1, 2, 3, 4, 100], ddof=1), np.std([5, 5, 6], ddof=1)],
+            self.groups.std()[:2])
+        self.assertTrue(np.isnan(self.groups.mean()[2]))
+        self.assertTrue(np.isnan(self.groups.median()[2]))
+
+    def test_percentile(self):
+        samples = np.random.RandomState(0).random_sample((6, 9))
+        groups = stats.GroupedSamples(range(6), samples)
+        np.testing.assert_allclose(
+            np.percentile(samples, [0, 10, 50, 99, 100], axis=1),
+            groups.percentile([0, 10, 50, 99, 100]))
+        summary = groups.summary()
+        np.testing.assert_allclose(samples.max(axis=1), summary['max'])
+        np.testing.assert_allclose(np.median(samples, axis=1),
+                                   summary['median'])
+
+    def test_filters(self):
+        filtered = self.groups.filter_iqr()
+        self.assertEqual([4, 3, 0], list(filtered.counts))
+        np.testing.assert_allclose([2.5, 16.0 / 3], filtered.mean()[:2])
+        self.assertEqual([4, 3, 0], list(self.groups.filter_mad().counts))
+        # The MAD of [5, 5, 6] is 0, so nothing is removed.
+        same = stats.GroupedSamples(['x'], [[5, 5, 6]]).filter_mad()
+        self.assertEqual([3], list(same.counts))
+
+    def test_bootstrap_ci(self):
+        rng = np.random.RandomState(1)
+        samples = rng.normal(100, 10, size=(3, 200))
+        groups = stats.GroupedSamples([1, 2, 3], samples)
+        lower, upper = groups.bootstrap_ci(resamples=500, seed=2)
+        means = samples.mean(axis=1)
+        self.assertTrue(np.all(lower < means))
+        self.assertTrue(np.all(means < upper))
+        # About 2 * 1.96 * 10 / sqrt(200).
+        np.testing.assert_allclose(upper - lower, 2.77, rtol=0.3)
+
+        # Resampling in small batches.
+        groups.BOOTSTRAP_BATCH = 1000
+        again = groups.bootstrap_ci(resamples=500, seed=2)
+        np.testing.assert_allclose(lower, again[0], rtol=0.01)
+
+        lower, upper = self.groups.bootstrap_ci(statistic='median', seed=0)
+        self.assertTrue(lower[1] >= 5 and upper[1] <= 6)
+        self.assertTrue(np.isnan(lower[2]))
+
+    def test_errorbars(self):
+        keys, centers, label, yerr = self.groups.errorbars('iops')
+        self.assertEqual(['a', 'b', 'c'], keys)
+        self.assertEqual('iops', label)
+        self.assertEqual(3, len(yerr))
+        keys, centers, label, yerr = self.groups.errorbars(
+            'iops', center='median', error='iqr')
+        self.assertEqual([3, 5], centers[:2])
+        self.assertEqual([[1, 0], [1, 0.5]], [yerr[0][:2], yerr[1][:2]])
+
+
+class TestGroupResult(unittest.TestCase):
+    def setUp(self):
+        self.result = analysis.Result('fs.threads.run')
+        self.result['ext4', 1] = [10, 12]
+        self.result['ext4', 2, 0] = 20
+        self.result['ext4', 2, 1] = 22
+        self.result['xfs', 1] = [14]
+        self.result['xfs', 2, 0] = 30
+
+    def test_group_subtree(self):
+        groups = stats.group_result(self.result, 'ext4')
+        self.assertEqual([1, 2], groups.keys)
+        np.testing.assert_allclose([11, 21], groups.mean())
+
+    def test_group_by_level(self):
+        groups = stats.group_result(self.result, level=1)
+        self.assertEqual([1, 2], groups.keys)
+        self.assertEqual([3, 3], list(groups.counts))
+        np.testing.assert_allclose([12, 24], groups.mean())
+
+    def test_group_dict(self):
+        groups = stats.group_dict({'b': [1, 3], 'a': 5})
+        self.assertEqual(['a', 'b'], groups.keys)
+        np.testing.assert_allclose([5, 2], groups.mean())
+
+    def test_plot_errorbars(self):
+        try:
+            from pyro import plot
+        except ImportError:
+            self.skipTest('matplotlib is not available')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tmpdir, 'errorbars.png')
+            groups = stats.group_result(self.result, 'ext4')
+            plot.plot([groups.errorbars('ext4', error='minmax')], 'IOPS',
+                      '# of Threads', 'IOPS', outfile)
+            self.assertTrue(os.path.getsize(outfile) > 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
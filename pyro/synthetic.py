@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD
+
+"""Seeded generators of synthetic profiler and benchmark outputs.
+
+The generated outputs follow the formats that the parsers in pyro.perftest
+accept, so they can be used to test and benchmark those parsers at any size.
+Each generate_* function writes to a file object until about 'size' bytes
+have been written, and returns the number of records it generated.
+"""
+
+from pyro.analysis import Result
+import random
+
+_STRUCTS = ['sb', 'inode', 'dentry', 'rq', 'mm', 'zone', 'journal', 'bdev',
+            'page', 'file', 'mnt', 'cgroup', 'sock', 'task', 'buffer_head']
+_FIELDS = ['lock', 'mutex', 'sem', 'list_lock', 'tree_lock', 'i_lock',
+           'd_lock', 'wait_lock', 'j_state_lock', 'lru_lock']
+_PREFIXES = ['ext4', 'btrfs', 'xfs', 'jbd2', 'vfs', 'generic', 'do', 'sys',
+             'blk', 'page', 'mem', 'd', 'iput', 'inode', '__find', 'native']
+_VERBS = ['lookup', 'write', 'read', 'alloc', 'free', 'get_block', 'commit',
+          'flush', 'sync', 'open', 'release', 'create', 'unlink', 'lock',
+          'unlock', 'queue', 'submit', 'wait', 'wake_up', 'copy']
+_COMMANDS = ['postmark', 'fio', 'filebench', 'kworker/0:1', 'jbd2/sda1-8',
+             'swapper', 'dd']
+_DSOS = ['[kernel.kallsyms]', 'libc-2.19.so', 'postmark', 'libpthread-2.19.so',
+         '[ext4]', '[btrfs]']
+_PERF_EVENTS = ['cycles', 'cache-misses', 'LLC-load-misses']
+_OPROFILE_EVENTS = ['CPU_CLK_UNHALTED', 'LLC_MISSES']
+_LOCKSTAT_FIELDS = ['con-bounces', 'contentions', 'waittime-min',
+                    'waittime-max', 'waittime-total', 'acq-bounces',
+                    'acquisitions', 'holdtime-min', 'holdtime-max',
+                    'holdtime-total']
+_LOCKSTAT_WIDTH = 40 + 15 * len(_LOCKSTAT_FIELDS)
+
+
+class _CountingWriter(object):
+    """Wraps a file object to count the bytes written.
+    """
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.written = 0
+
+    def write(self, text):
+        self.fobj.write(text)
+        self.written += len(text)
+
+
+def symbol_name(rng, index=None):
+    """Returns a kernel-like function name.
+
+    @param rng a random.Random object.
+    @param index appends '_<index>' to make the name unique.
+    """
+    name = '{}_{}'.format(rng.choice(_PREFIXES), rng.choice(_VERBS))
+    if index is not None:
+        name += '_{}'.format(index)
+    return name
+
+
+def call_site(rng):
+    """Returns a call site as printed by the kernel: [<address>] sym+off/len.
+    """
+    return '[<ffffffff81{:06x}>] {}+0x{:x}/0x{:x}'.format(
+        rng.randint(0, 0xffffff), symbol_name(rng), rng.randint(1, 0x1ff),
+        rng.randint(0x200, 0x800))
+
+
+def _zipf_weight(rng, rank):
+    """A skewed weight so that a few items dominate, as in real profiles.
+    """
+    return rng.uniform(0.5, 1.5) / (rank + 1) ** 1.1
+
+
+def generate_lockstat(fobj, size, seed=0):
+    """Generates /proc/lock_stat output, including the contention points and
+    contending call sites of each contended lock class.
+    """
+    rng = random.Random(seed)
+    out = _CountingWriter(fobj)
+    out.write('lock_stat version 0.3\n')
+    out.write('-' * _LOCKSTAT_WIDTH + '\n')
+    out.write('{:>40} '.format('class name') + ''.join(
+        '{:>15}'.format(name) for name in _LOCKSTAT_FIELDS) + '\n')
+    out.write('-' * _LOCKSTAT_WIDTH + '\n\n')
+    records = 0
+    while out.written < size:
+        name = '&({}->{})#{}'.format(rng.choice(_STRUCTS),
+                                     rng.choice(_FIELDS), records)
+        weight = _zipf_weight(rng, records % 1000)
+        acquisitions = int(10 ** 6 * weight) + 1
+        contentions = int(acquisitions * rng.uniform(0, 0.2))
+        wait_min = rng.uniform(0.01, 1)
+        hold_min = rng.uniform(0.01, 1)
+        values = [contentions // 2 + rng.randint(0, 3), contentions,
+                  wait_min if contentions else 0,
+                  wait_min * rng.uniform(1, 1000) if contentions else 0,
+                  contentions * wait_min * rng.uniform(1, 10),
+                  acquisitions // 3, acquisitions, hold_min,
+                  hold_min * rng.uniform(1, 1000),
+                  acquisitions * hold_min * rng.uniform(1, 5)]
+        out.write('{:>40}:'.format(name) + ''.join(
+            '{:>15}'.format(v) if isinstance(v, int) else
+            '{:>15.2f}'.format(v) for v in values) + '\n')
+        if contentions:
+            for _ in range(2):
+                out.write('{:>40}\n'.format('-' * len(name)))
+                for _ in range(rng.randint(1, 4)):
+                    out.write('{:>40} {:>14}          {}\n'.format(
+                        name, rng.randint(1, contentions), call_site(rng)))
+        out.write('\n' + '.' * _LOCKSTAT_WIDTH + '\n\n')
+        records += 1
+    return records
+
+
+def generate_perf_report(fobj, size, seed=0):
+    """Generates the output of 'perf report --stdio' with several events.
+    """
+    rng = random.Random(seed)
+    out = _CountingWriter(fobj)
+    records = 0
+    section = 0
+    while out.written < size:
+        event = _PERF_EVENTS[section % len(_PERF_EVENTS)]
+        out.write('# ========\n# captured on: Thu May 22 10:00:00 2014\n'
+                  '# ========\n#\n')
+        out.write("# Samples: {}K of event '{}'\n".format(
+            rng.randint(1, 999), event))
+        out.write('# Event count (approx.): {}\n#\n'.format(
+            rng.randint(10 ** 6, 10 ** 9)))
+        out.write('# Overhead  Command  Shared Object  Symbol\n'
+                  '# ........  .......  .............  ......\n#\n')
+        entries = rng.randint(50, 2000)
+        weights = [_zipf_weight(rng, i) for i in range(entries)]
+        total = sum(weights)
+        for i, weight in enumerate(weights):
+            out.write('{:>9.2f}%  {:<12} {:<20} [k] {}\n'.format(
+                100 * weight / total, rng.choice(_COMMANDS),
+                rng.choice(_DSOS), symbol_name(rng, i)))
+        out.write('\n\n')
+        records += entries
+        section += 1
+    return records
+
+
+def generate_perf_script(fobj, size, seed=0):
+    """Generates the output of 'perf record -g' followed by 'perf script'.
+
+    The stacks are drawn from a fixed set of call paths so that they
+    aggregate, as they would in a real profile.
+    """
+    rng = random.Random(seed)
+    out = _CountingWriter(fobj)
+    paths = []
+    for _ in range(200):
+        depth = rng.randint(3, 30)
+        paths.append([(rng.randint(0xffffffff81000000, 0xffffffff81ffffff),
+                       symbol_name(rng), rng.randint(1, 0x1ff))
+                      for _ in range(depth)])
+    weights = [_zipf_weight(rng, i) for i in range(len(paths))]
+    records = 0
+    timestamp = 1000.0
+    while out.written < size:
+        path = rng.choices(paths, weights)[0]
+        timestamp += rng.uniform(0, 0.001)
+        out.write('{} {:>5} [{:03d}] {:.6f}: {:>10} {}: \n'.format(
+            rng.choice(_COMMANDS), rng.randint(100, 30000),
+            rng.randint(0, 63), timestamp, rng.randint(1000, 500000),
+            rng.choice(_PERF_EVENTS)))
+        # perf script prints the leaf first.
+        for address, symbol, offset in reversed(path):
+            out.write('\t{:16x} {}+0x{:x} ([kernel.kallsyms])\n'.format(
+                address, symbol, offset))
+        out.write('\n')
+        records += 1
+    return records
+
+
+def generate_oprofile(fobj, size, seed=0):
+    """Generates the call-graph output of 'opreport -cl' with two events.
+
+    Each symbol is printed as a block of its callers (indented), itself, its
+    '[self]' cost and its callees (indented), separated by dashed lines.
+    """
+    rng = random.Random(seed)
+    out = _CountingWriter(fobj)
+    out.write('CPU: Intel Core/i7, speed 2.4e+06 MHz (estimated)\n')
+    for event in _OPROFILE_EVENTS:
+        out.write('Counted {} events ({}) with a unit mask of 0x00 '
+                  '(No unit mask) count 100000\n'.format(event, event.lower()))
+    out.write('samples  %        ' * len(_OPROFILE_EVENTS) +
+              'image name               symbol name\n')
+    out.write('-' * 79 + '\n')
+
+    def _line(indent, counts, symbol):
+        fields = ''.join('{:<8d} {:<8.4f} '.format(c, 100.0 * c / 10 ** 7)
+                         for c in counts)
+        return '{}{}{:<24} {}\n'.format(' ' * indent, fields, 'vmlinux',
+                                        symbol)
+
+    symbols = []
+    records = 0
+    while out.written < size:
+        symbol = symbol_name(rng, records)
+        counts = [int(10 ** 6 * _zipf_weight(rng, records % 5000)) + 1
+                  for _ in _OPROFILE_EVENTS]
+        for caller in rng.sample(symbols, min(len(symbols), 3)):
+            out.write(_line(2, [rng.randint(0, c) for c in counts], caller))
+        out.write(_line(0, counts, symbol))
+        out.write(_line(2, [rng.randint(0, c) for c in counts],
+                        symbol + ' [self]'))
+        for callee in rng.sample(symbols, min(len(symbols), 2)):
+            out.write(_line(2, [rng.randint(0, c) for c in counts], callee))
+        out.write('-' * 79 + '\n')
+        # Only keep a window of recent symbols as callers and callees.
+        symbols.append(symbol)
+        if len(symbols) > 100:
+            symbols.pop(0)
+        records += 1
+    return records
+
+
+def generate_postmark(fobj, size, seed=0):
+    """Generates the outputs of consecutive postmark runs.
+    """
+    rng = random.Random(seed)
+    out = _CountingWriter(fobj)
+    records = 0
+    while out.written < size:
+        seconds = rng.randint(10, 600)
+        files = rng.randint(1000, 100000)
+        out.write('Time:\n\t{} seconds total\n'
+                  '\t{} seconds of transactions ({} per second)\n\n'.format(
+                      seconds, seconds - 1, rng.randint(100, 10000)))
+        out.write('Files:\n\t{} created ({} per second)\n'.format(
+            files, files // seconds))
+        out.write('\t\tCreation alone: {} files ({} per second)\n'.format(
+            files // 2, rng.randint(100, 50000)))
+        out.write('\t\tMixed with transactions: {} files ({} per second)\n'
+                  .format(files // 2, rng.randint(10, 1000)))
+        out.write('\t{} read ({} per second)\n'.format(
+            files // 4, rng.randint(10, 1000)))
+        out.write('\t{} appended ({} per second)\n'.format(
+            files // 4, rng.randint(10, 1000)))
+        out.write('\t{} deleted ({} per second)\n'.format(
+            files, files // seconds))
+        out.write('\t\tDeletion alone: {} files ({} per second)\n'.format(
+            files // 2, rng.randint(100, 50000)))
+        out.write('\t\tMixed with transactions: {} files ({} per second)\n\n'
+                  .format(files // 2, rng.randint(10, 1000)))
+        unit = rng.choice(['kilobytes', 'megabytes'])
+        out.write('Data:\n\t{:.2f} {} read ({:.2f} {} per second)\n'.format(
+            rng.uniform(1, 1000), unit, rng.uniform(1, 100), unit))
+        out.write('\t{:.2f} {} written ({:.2f} {} per second)\n\n'.format(
+            rng.uniform(1, 1000), unit, rng.uniform(1, 100), unit))
+        records += 1
+    return records
+
+
+def generate_top_data(num_fields, seed=0, threads=None):
+    """Generates the {threads: {field: value}} input of
+    perftest.trans_top_data_to_curves().
+
+    @param num_fields the number of fields in each thread configuration.
+    @param threads a list of thread counts (default: 1, 2, 4 ... 64).
+    """
+    rng = random.Random(seed)
+    threads = threads or [1, 2, 4, 8, 16, 32, 64]
+    fields = [symbol_name(rng, i) for i in range(num_fields)]
+    return dict((thd, dict((field, rng.uniform(0, 100)) for field in fields))
+                for thd in threads)
+
+
+def generate_result_tree(num_leaves, seed=0, fanout=8):
+    """Generates an analysis.Result tree of
+    'workload.filesystem.threads.iteration' with about num_leaves values.
+    """
+    rng = random.Random(seed)
+    filesystems = ['ext4', 'btrfs', 'xfs']
+    result = Result('workload.filesystem.threads.iteration')
+    for leaf in range(num_leaves):
+        config = leaf // fanout
+        workload = 'workload{}'.format(config // fanout // len(filesystems))
+        filesystem = filesystems[config // fanout % len(filesystems)]
+        threads = 2 ** (config % fanout)
+        result[workload, filesystem, threads, leaf % fanout] = \
+            rng.uniform(0, 10000)
+    return result
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# Author: Lei Xu <eddyxu@gmail.com>
+# License: BSD License
+
+"""Unit tests for pyro.synthetic and pyro.parserbench
+"""
+
+from pyro import parserbench, perftest, synthetic
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestSynthetic(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def generate(self, generator, size, seed=0):
+        path = os.path.join(self.tmpdir, generator.__name__)
+        with open(path, 'w') as fobj:
+            records = generator(fobj, size, seed)
+        return path, records
+
+    def test_deterministic(self):
+        for generator, _ in parserbench.FILE_BENCHMARKS.values():
+            outputs = []
+            for seed in [1, 1, 2]:
+                buf = io.StringIO()
+                generator(buf, 4096, seed)
+                outputs.append(buf.getvalue())
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertNotEqual(outputs[0], outputs[2])
+            self.assertTrue(len(outputs[0]) >= 4096)
+
+    def test_lockstat(self):
+        path, records = self.generate(synthetic.generate_lockstat, 64 * 1024)
+        data = perftest.parse_lockstat_data(path)
+        self.assertEqual(records, len(data))
+        for values in data.values():
+            self.assertTrue(values['acquisitions'] > 0)
+
+    def test_perf(self):
+        path, _ = self.generate(synthetic.generate_perf_report, 64 * 1024)
+        data = perftest.parse_perf_data(path, top=5)
+        self.assertTrue('cycles' in data)
+        self.assertEqual(5, len(data['cycles']))
+
+    def test_oprofile(self):
+        path, records = self.generate(synthetic.generate_oprofile, 64 * 1024)
+        data = perftest.parse_oprofile_data(path)
+        self.assertEqual(records, len(data))
+        for values in data.values():
+            self.assertEqual(set(['CPU_CLK_UNHALTED', 'LLC_MISSES']),
+                             set(values))
+
+    def test_postmark(self):
+        path, records = self.generate(synthetic.generate_postmark, 4096)
+        self.assertTrue(records > 1)
+        data = perftest.parse_postmark_data(path)
+        self.assertEqual(set(['creation', 'deletion', 'read', 'write']),
+                         set(data))
+
+    def test_result_tree(self):
+        result = synthetic.generate_result_tree(1000)
+        self.assertEqual(1000, len(result.collect()))
+        self.assertEqual(4, result.depth)
+
+
+class TestParserBench(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(1024, parserbench.parse_size('1K'))
+        self.assertEqual(1536 * 1024, parserbench.parse_size('1.5MB'))
+        self.assertEqual(1024 ** 3, parserbench.parse_size('1g'))
+        self.assertEqual(100, parserbench.parse_size('100'))
+
+    def test_run_all(self):
+        output = parserbench.run_all(['postmark', 'result_collect'], [1024],
+                                     repeat=1)
+        self.assertEqual(2, len(output['results']))
+        for result in output['results']:
+            self.assertTrue(result['records'] > 0)
+            self.assertTrue(result['peak_memory'] > 0)
+        self.assertTrue(output['results'][0]['mb_per_sec'] > 0)
+        speedups = parserbench.compare(output, output)
+        self.assertEqual(1.0, speedups[('postmark', 1024)])
+
+    def test_parsed_records(self):
+        # Only the top 10 entries of each event are parsed.
+        result = parserbench.run_benchmark('perf', 64 * 1024, repeat=1,
+                                           memory=False)
+        buf = io.StringIO()
+        generated = synthetic.generate_perf_report(buf, 64 * 1024)
+        parsed = perftest.parse_perf_data(buf.getvalue().encode('utf-8'))
+        self.assertEqual(sum(len(entries) for entries in parsed.values()),
+                         result['records'])
+        self.assertTrue(result['records'] < generated)
+
+
+if __name__ == '__main__':
+    unittest.main()